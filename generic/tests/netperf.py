@@ -12,6 +12,7 @@ from virttest import utils_misc
 from virttest import utils_net
 from virttest import remote
 from virttest import error_context
+from provider import kvm_stats
 from provider import netperf_base
 
 _netserver_started = False
@@ -537,9 +538,12 @@ def launch_client(sessions, server, server_ctl, host, clients, l, nf_args,
             state_list.append('intr')
             state_list.append(ninit)
 
-        exits = int(netperf_base.ssh_cmd(host, "cat /sys/kernel/debug/kvm/exits"))
-        state_list.append('exits')
-        state_list.append(exits)
+        # All the exit counters in one read, 'exits' is the total
+        exits = kvm_stats.parse_debugfs(netperf_base.ssh_cmd(
+            host, "grep -H . /sys/kernel/debug/kvm/*exits"))
+        for reason in sorted(exits):
+            state_list.append(reason)
+            state_list.append(exits[reason])
 
         return state_list
 
@@ -3,6 +3,38 @@ import logging
 from virttest import env_process
 from virttest import error_context
 
+from provider.vm_launcher import VMLauncher
+
+
+def boot_parallel(test, params, env, vm, sessions, launcher):
+    """
+    Boot the other VMs through the launcher, then check all of them.
+    """
+    max_vms = int(params.get("max_vms"))
+    error_context.base_context("booting guests #2 to #%d" % max_vms,
+                               logging.info)
+    vms = launcher.clone(vm, ["vm%d" % num for num in range(2, max_vms + 1)])
+    launcher.launch(vms)
+    sessions += [launcher.sessions[curr_vm.name] for curr_vm in vms
+                 if curr_vm.name in launcher.sessions]
+    failed = launcher.failed()
+    if failed:
+        test.fail("Expect to boot up %s guests. Failed to boot up %s "
+                  "with error: %s." % (
+                      max_vms, ", ".join(sorted(failed)),
+                      "; ".join(launcher.results[name]["error"]
+                                for name in sorted(failed))))
+
+    # Check whether all shell sessions are responsive
+    for i, se in enumerate(sessions):
+        error_context.context("checking responsiveness of guest"
+                              " #%d" % (i + 1), logging.debug)
+        try:
+            se.cmd(params.get("alive_test_cmd"))
+        except Exception as emsg:
+            test.fail("Expect %s guests to respond. Guest #%d did not "
+                      "respond with error: %s." % (max_vms, i + 1, emsg))
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -14,6 +46,11 @@ def run(test, params, env):
        and all booted vms respond to shell commands
     3) go on until cannot create VM anymore or cannot allocate memory for VM
 
+    With 'vm_launch_concurrency' above 1, all the vms are booted at once
+    instead, 'vm_launch_concurrency' of them at a time, checked once all of
+    them logged in, and the time to login of every vm and the host
+    resources at every number of booted vms are recorded.
+
     :param test:   kvm test object
     :param params: Dictionary with the test parameters
     :param env:    Dictionary with test environment.
@@ -24,39 +61,59 @@ def run(test, params, env):
     vm.verify_alive()
     login_timeout = float(params.get("login_timeout", 240))
     session = vm.wait_for_login(timeout=login_timeout)
-
-    num = 2
     sessions = [session]
 
-    # Boot the VMs
-    try:
+    concurrency = int(params.get("vm_launch_concurrency", 1))
+    if concurrency <= 1:
+        num = 2
+        # Boot the VMs
         try:
-            while num <= int(params.get("max_vms")):
-                # Clone vm according to the first one
-                error_context.base_context("booting guest #%d" % num,
-                                           logging.info)
-                vm_name = "vm%d" % num
-                vm_params = vm.params.copy()
-                curr_vm = vm.clone(vm_name, vm_params)
-                env.register_vm(vm_name, curr_vm)
-                env_process.preprocess_vm(test, vm_params, env, vm_name)
-                params["vms"] += " " + vm_name
-
-                session = curr_vm.wait_for_login(timeout=login_timeout)
-                sessions.append(session)
-                logging.info("Guest #%d booted up successfully", num)
-
-                # Check whether all previous shell sessions are responsive
-                for i, se in enumerate(sessions):
-                    error_context.context("checking responsiveness of guest"
-                                          " #%d" % (i + 1), logging.debug)
-                    se.cmd(params.get("alive_test_cmd"))
-                num += 1
-        except Exception as emsg:
-            test.fail("Expect to boot up %s guests."
-                      "Failed to boot up #%d guest with "
-                      "error: %s." % (params["max_vms"], num, emsg))
+            try:
+                while num <= int(params.get("max_vms")):
+                    # Clone vm according to the first one
+                    error_context.base_context("booting guest #%d" % num,
+                                               logging.info)
+                    vm_name = "vm%d" % num
+                    vm_params = vm.params.copy()
+                    curr_vm = vm.clone(vm_name, vm_params)
+                    env.register_vm(vm_name, curr_vm)
+                    env_process.preprocess_vm(test, vm_params, env, vm_name)
+                    params["vms"] += " " + vm_name
+
+                    session = curr_vm.wait_for_login(timeout=login_timeout)
+                    sessions.append(session)
+                    logging.info("Guest #%d booted up successfully", num)
+
+                    # Check whether all previous shell sessions are
+                    # responsive
+                    for i, se in enumerate(sessions):
+                        error_context.context("checking responsiveness of "
+                                              "guest #%d" % (i + 1),
+                                              logging.debug)
+                        se.cmd(params.get("alive_test_cmd"))
+                    num += 1
+            except Exception as emsg:
+                test.fail("Expect to boot up %s guests."
+                          "Failed to boot up #%d guest with "
+                          "error: %s." % (params["max_vms"], num, emsg))
+        finally:
+            for se in sessions:
+                se.close()
+            logging.info("Total number booted: %d", (num - 1))
+        return
+
+    launcher = VMLauncher(test, params, env, concurrency=concurrency,
+                          login_timeout=login_timeout)
+    try:
+        boot_parallel(test, params, env, vm, sessions, launcher)
     finally:
-        for se in sessions:
-            se.close()
-        logging.info("Total number booted: %d", (num - 1))
+        session.close()
+        launcher.close_sessions()
+        launcher.save(test.resultsdir, "stress_boot")
+        summary = launcher.summary()
+        logging.info("Total number booted: %d", summary["logged_in"] + 1)
+        if summary["logged_in"]:
+            logging.info("Time to login: min %.1fs, avg %.1fs, max %.1fs",
+                         summary["time_to_login_min_s"],
+                         summary["time_to_login_avg_s"],
+                         summary["time_to_login_max_s"])
@@ -1,5 +1,4 @@
 import logging
-import time
 from autotest.client.shared import error
 from autotest.client.shared import utils
 from virttest import virt_vm
@@ -7,6 +6,8 @@ from virttest import utils_test
 from virttest import utils_misc
 from virttest.utils_test.qemu import migration
 
+from provider.migration_telemetry import MigrationTelemetry
+
 
 @error.context_aware
 def run(test, params, env):
@@ -214,69 +215,40 @@ def run(test, params, env):
                                          "auto-converge on.")
 
         @error.context_aware
-        def get_mig_cpu_throttling_percentage(self, vm):
-            """
-            get cpu throttling percentage during migration
-
-            :param vm: vm object
-            """
-
-            error.context("Get cpu throttling percentage during migration",
-                          logging.info)
-            cpu_throttling_percentage = vm.monitor.info("migrate").get(
-                "cpu-throttle-percentage")
-            logging.info("The cpu throttling percentage is %s%%",
-                         cpu_throttling_percentage)
-            return cpu_throttling_percentage
-
-        @error.context_aware
-        def check_mig_cpu_throttling_percentage(self):
+        def check_mig_cpu_throttling_percentage(self, telemetry):
             """
             check if cpu throttling percentage equal to given value
+
+            :param telemetry: MigrationTelemetry sampled during migration
             """
 
             error.context("check cpu throttling percentage during migration",
                           logging.info)
+            parameters_value = list(map(int, self.parameters_value))
+            cpu_throttling_percentage_list = [
+                int(value) for _, value in
+                telemetry.values("cpu_throttle_percentage")]
             logging.info("The cpu throttling percentage list is %s",
-                         cpu_throttling_percentage_list)
-            if ((self.parameters_value[0] not in cpu_throttling_percentage_list) or
-                    (sum(self.parameters_value) not in cpu_throttling_percentage_list)):
+                         telemetry.summary()["throttle_steps"])
+            if not cpu_throttling_percentage_list:
+                raise error.TestFail("No cpu throttling percentage was "
+                                     "reported during migration")
+            if ((parameters_value[0] not in cpu_throttling_percentage_list) or
+                    (sum(parameters_value) not in cpu_throttling_percentage_list)):
                 raise error.TestFail("The value of cpu throttling percentage "
                                      "should include: %s %s" %
-                                     (self.parameters_value[0],
-                                      sum(self.parameters_value)))
-            if min(cpu_throttling_percentage_list) != self.parameters_value[0]:
+                                     (parameters_value[0],
+                                      sum(parameters_value)))
+            if min(cpu_throttling_percentage_list) != parameters_value[0]:
                 raise error.TestFail("The expected cpu-throttle-initial is %s,"
                                      " but the actual value is %s" %
-                                     (self.parameters_value[0],
+                                     (parameters_value[0],
                                       min(cpu_throttling_percentage_list)))
             if max(cpu_throttling_percentage_list) > 99:
                 raise error.TestFail("The expected max cpu-throttling percentage"
                                      "is %s, but the actual value is %s" %
                                      (99, max(cpu_throttling_percentage_list)))
 
-        def thread_check_mig_cpu_throttling_percentage(self):
-            """
-            function, called by utils.InterruptedThread()
-            """
-
-            self.parameters_value = list(map(int, self.parameters_value))
-            vm = self.env.get_vm(self.params["main_vm"])
-            while self.migration_timeout:
-                list_item = self.get_mig_cpu_throttling_percentage(vm)
-                if list_item is not None:
-                    cpu_throttling_percentage_list.append(int(list_item))
-                if not cpu_throttling_percentage_list:
-                    time.sleep(1)
-                    self.migration_timeout -= 1
-                    continue
-                if max(cpu_throttling_percentage_list) >= sum(self.parameters_value):
-                    break
-                else:
-                    time.sleep(1)
-                    self.migration_timeout -= 1
-            self.check_mig_cpu_throttling_percentage()
-
         def before_migration_capability(self, mig_data):
             """
             get migration capability (auto-converge: on/off)
@@ -331,13 +303,16 @@ def run(test, params, env):
             :param mig_data: Data for migration
             """
 
+            telemetry = None
             if set_auto_converge == "yes":
-                mig_thread = utils.InterruptedThread(
-                    self.thread_check_mig_cpu_throttling_percentage)
-                mig_thread.start()
+                telemetry = MigrationTelemetry(vm, mig_telemetry_interval)
+                telemetry.start()
             try:
                 vm.wait_for_migration(self.migration_timeout)
                 logging.info("Migration completed with auto-converge on")
+                if telemetry:
+                    telemetry.stop()
+                    self.check_mig_cpu_throttling_percentage(telemetry)
             except virt_vm.VMMigrateTimeoutError:
                 if set_auto_converge == "yes":
                     raise error.TestFail("Migration failed with "
@@ -354,6 +329,9 @@ def run(test, params, env):
                                              "migration failed with "
                                              "auto-converge off")
             finally:
+                if telemetry:
+                    telemetry.stop()
+                    telemetry.save(test.resultsdir)
                 if self.session:
                     self.session.close()
                 vm.destroy(gracefully=False)
@@ -485,7 +463,7 @@ def run(test, params, env):
     sar_cpu_str = params.get("sar_cpu_str", "")
     sar_memory_str = params.get("sar_memory_str", "")
     sar_output = []
-    cpu_throttling_percentage_list = []
+    mig_telemetry_interval = float(params.get("mig_telemetry_interval", 0.5))
     for set_auto_converge in set_auto_converge_list:
         if sar_log_name:
             sar_log_index = str(set_auto_converge_list.index(set_auto_converge))
@@ -1,15 +1,14 @@
 import os
-import re
 import logging
 import time
 import socket
-import six
 from autotest.client.shared import error, utils
 from autotest.client.shared.barrier import listen_server
 from autotest.client.shared.syncdata import SyncData
 from virttest import utils_misc
 from virttest.utils_test.qemu import migration
 from provider import cpuflags
+from provider.migration_telemetry import MigrationTelemetry
 
 
 def run(test, params, env):
@@ -45,46 +44,29 @@ def run(test, params, env):
 
     vm_mem = int(params.get("mem", "512"))
 
-    get_mig_speed = re.compile(r"^transferred ram: (\d+) kbytes$",
-                               re.MULTILINE)
-
     mig_speed = params.get("mig_speed", "1G")
     mig_speed_accuracy = float(params.get("mig_speed_accuracy", "0.2"))
 
-    def get_migration_statistic(vm):
-        last_transfer_mem = 0
-        transfered_mem = 0
-        mig_stat = utils.Statistic()
-        for _ in range(30):
-            o = vm.monitor.info("migrate")
-            warning_msg = ("Migration already ended. Migration speed is"
-                           " probably too high and will block vm while"
-                           " filling its memory.")
-            fail_msg = ("Could not determine the transferred memory from"
-                        " monitor data: %s" % o)
-            if isinstance(o, six.string_types):
-                if "status: active" not in o:
-                    raise error.TestWarn(warning_msg)
-                try:
-                    transfered_mem = int(get_mig_speed.search(o).groups()[0])
-                except (IndexError, ValueError):
-                    raise error.TestFail(fail_msg)
-            else:
-                if o.get("status") != "active":
-                    raise error.TestWarn(warning_msg)
-                try:
-                    transfered_mem = o.get("ram").get("transferred") / (1024)
-                except (IndexError, ValueError):
-                    raise error.TestFail(fail_msg)
-
-            real_mig_speed = (transfered_mem - last_transfer_mem) / 1024
-
-            last_transfer_mem = transfered_mem
-
-            logging.debug("Migration speed: %s MB/s", real_mig_speed)
-            mig_stat.record(real_mig_speed)
-            time.sleep(1)
+    mig_telemetry_interval = float(params.get("mig_telemetry_interval", 1))
+    mig_measure_time = float(params.get("mig_measure_time", 30))
 
+    def get_migration_statistic(vm):
+        telemetry = MigrationTelemetry(vm, mig_telemetry_interval)
+        telemetry.start()
+        time.sleep(mig_measure_time)
+        telemetry.stop()
+        telemetry.save(test.resultsdir)
+        mig_stat = telemetry.summary()
+        if mig_stat.get("status") != "active":
+            raise error.TestWarn("Migration already ended. Migration speed is"
+                                 " probably too high and will block vm while"
+                                 " filling its memory.")
+        if "speed_avg_mbps" not in mig_stat:
+            raise error.TestFail("Could not determine the transferred memory"
+                                 " from monitor data: %s" % telemetry.samples)
+        for t, speed in telemetry.values("speed"):
+            logging.debug("Migration speed at %.2fs: %s MB/s", t,
+                          speed / 1048576.0)
         return mig_stat
 
     class TestMultihostMigration(base_class):
@@ -189,15 +171,16 @@ def run(test, params, env):
         mig_stat = mig.mig_stat
 
         mig_speed = mig_speed / (1024 * 1024)
-        real_speed = mig_stat.get_average()
+        real_speed = mig_stat["speed_avg_mbps"]
         ack_speed = mig.link_speed * mig_speed_accuracy
 
         logging.info("Target migration speed: %d MB/s", mig_speed)
         logging.info("Real Link speed: %d MB/s", mig.link_speed)
-        logging.info(
-            "Average migration speed: %d MB/s", mig_stat.get_average())
-        logging.info("Minimum migration speed: %d MB/s", mig_stat.get_min())
-        logging.info("Maximum migration speed: %d MB/s", mig_stat.get_max())
+        logging.info("Average migration speed: %d MB/s", real_speed)
+        logging.info("Minimum migration speed: %d MB/s",
+                     mig_stat["speed_min_mbps"])
+        logging.info("Maximum migration speed: %d MB/s",
+                     mig_stat["speed_max_mbps"])
 
         logging.info("Maximum tolerable divergence: %3.1f%%",
                      mig_speed_accuracy * 100)
@@ -1,7 +1,10 @@
 import json
+import logging
 import math
+import os
 import random
 import re
+import time
 
 from avocado import fail_on
 from avocado.utils import process
@@ -14,8 +17,12 @@ from virttest import utils_misc
 from virttest import utils_disk
 
 from provider import block_dirty_bitmap as block_bitmap
+from provider import nbd_client
+from provider.nbd_image_export import QemuNBDExportImage
 from provider.virt_storage.storage_admin import sp_admin
 from provider import job_utils
+from provider.session_pool import guest_session
+from provider.session_pool import pooled
 
 
 def generate_log2_value(start, end, step=1, blacklist=None):
@@ -73,9 +80,15 @@ def copy_out_dict_if_exists(params_in, keys):
 
 
 @fail_on
-def generate_tempfile(vm, root_dir, filename, size="10M", timeout=720):
-    """Generate temp data file in VM"""
-    session = vm.wait_for_login()
+@pooled
+def generate_tempfile(vm, root_dir, filename, size="10M", timeout=720,
+                      runner=None):
+    """
+    Generate temp data file in VM
+
+    :param runner: GuestExecRunner object, run the commands through the
+                   guest agent instead of a login session if given
+    """
     if vm.params["os_type"] == "windows":
         file_path = "%s\\%s" % (root_dir, filename)
         mk_file_cmd = "fsutil file createnew %s %s" % (file_path, size)
@@ -91,14 +104,17 @@ def generate_tempfile(vm, root_dir, filename, size="10M", timeout=720):
             "dd_cmd", "dd if=/dev/urandom of=%s bs=1M count=%s oflag=direct")
         mk_file_cmd = dd_cmd % (file_path, count)
         md5_cmd = "md5sum %s > %s.md5 && sync" % (file_path, file_path)
-    try:
+    if runner:
+        runner.cmd(mk_file_cmd, timeout=timeout)
+        runner.cmd(md5_cmd, timeout=timeout)
+        return
+    with guest_session(vm) as session:
         session.cmd(mk_file_cmd, timeout=timeout)
         session.cmd(md5_cmd, timeout=timeout)
-    finally:
-        session.close()
 
 
 @fail_on
+@pooled
 def verify_file_md5(vm, root_dir, filename, timeout=720):
     if vm.params["os_type"] == "windows":
         file_path = "%s\\%s" % (root_dir, filename)
@@ -109,8 +125,7 @@ def verify_file_md5(vm, root_dir, filename, timeout=720):
         md5_cmd = "md5sum %s" % file_path
         cat_cmd = "cat %s.md5" % file_path
 
-    session = vm.wait_for_login()
-    try:
+    with guest_session(vm) as session:
         status1, output1 = session.cmd_status_output(md5_cmd, timeout=timeout)
         now = output1.strip()
         assert status1 == 0, "Get file ('%s') MD5 with error: %s" % (
@@ -121,8 +136,6 @@ def verify_file_md5(vm, root_dir, filename, timeout=720):
             filename, output2)
         assert now == saved, "File's ('%s') MD5 is mismatch! (%s, %s)" % (
             filename, now, saved)
-    finally:
-        session.close()
 
 
 def blockdev_snapshot_qmp_cmd(source, target, **extra_options):
@@ -425,6 +438,9 @@ def copyif(params, nbd_image, target_image, bitmap=None):
     :params target_image: target image tag
     :params bitmap: bitmap name
     """
+    if params.get('copyif_method') == 'nbd':
+        return nbd_copyif(params, nbd_image, target_image, bitmap)
+
     def _qemu_io_read(qemu_io, s, l, img):
         cmd = '{io} -C -c "r {s} {l}" -f {fmt} {f}'.format(
             io=qemu_io, s=s, l=l, fmt=img.image_format,
@@ -479,6 +495,128 @@ def copyif(params, nbd_image, target_image, bitmap=None):
     img_obj.rebase(img_obj.params)
 
 
+def nbd_copyif(params, nbd_image, target_image, bitmap=None):
+    """
+    Copy the allocated data of an nbd image, or only the ranges dirty in
+    an exported bitmap, into a local image with a native NBD client.
+
+    Block status replies of the 'qemu:dirty-bitmap:<bitmap>' (or
+    'base:allocation') metadata context are walked one window at a time
+    and only the selected ranges are read, with up to 'nbd_copy_depth'
+    reads of at most 'nbd_copy_chunk' in flight, so the copy is bounded
+    by the amount of data to copy and its memory by depth * chunk.
+    A raw target is written in place and stays sparse, other formats are
+    written through a qemu-nbd export of the target.
+
+    :params params: utils_params.Params object
+    :params nbd_image: nbd image tag
+    :params target_image: target image tag
+    :params bitmap: bitmap name
+    :return: dict with the 'copied' bytes and the 'seconds' spent
+    """
+    chunk = int(utils_numeric.normalize_data_size(
+        params.get('nbd_copy_chunk', '4M'), order_magnitude='B'))
+    window = int(utils_numeric.normalize_data_size(
+        params.get('nbd_copy_status_window', '1G'), order_magnitude='B'))
+    depth = params.get_numeric('nbd_copy_depth', 16)
+
+    if bitmap is None:
+        context = 'base:allocation'
+
+        def _selected(flags):
+            return not flags & nbd_client.STATE_ZERO
+    else:
+        context = 'qemu:dirty-bitmap:%s' % bitmap
+
+        def _selected(flags):
+            return flags & nbd_client.STATE_DIRTY
+
+    def _ranges(source):
+        for offset, length, flags in source.iter_extents(context,
+                                                         window=window):
+            if not _selected(flags):
+                continue
+            end = offset + length
+            while offset < end:
+                yield offset, min(chunk, end - offset)
+                offset += chunk
+
+    def _drain(target, inflight):
+        while target.inflight > inflight:
+            _, result = target.receive()
+            if result['error']:
+                raise nbd_client.NBDError('Write to %s failed with errno %d'
+                                          % (target_image, result['error']))
+
+    img_obj = qemu_storage.QemuImg(params.object_params(target_image),
+                                   data_dir.get_data_dir(), target_image)
+    target_fd = target = exporter = None
+    source = nbd_client.connect(params.object_params(nbd_image),
+                                meta_contexts=[context])
+    try:
+        if img_obj.image_format == 'raw':
+            target_fd = os.open(img_obj.image_filename, os.O_WRONLY)
+        else:
+            target_params = params.copy()
+            socket_path = os.path.join(data_dir.get_tmp_dir(),
+                                       'copyif_%s.sock' % target_image)
+            target_params['nbd_unix_socket_%s' % target_image] = socket_path
+            target_params['nbd_export_format_%s' % target_image] = \
+                img_obj.image_format
+            # The target is written, whatever the source exports are
+            target_params['nbd_export_writable_%s' % target_image] = 'yes'
+            exporter = QemuNBDExportImage(target_params, target_image)
+            exporter.export_image()
+            target = nbd_client.NBDClient(unix_socket=socket_path,
+                                          structured=False)
+
+        start = time.time()
+        copied = 0
+        pending = {}
+        ranges = _ranges(source)
+        more = True
+        while more or pending:
+            while more and len(pending) < depth:
+                item = next(ranges, None)
+                if item is None:
+                    more = False
+                    break
+                pending[source.submit(nbd_client.CMD_READ, *item)] = item
+            if not pending:
+                break
+            handle, result = source.receive()
+            offset, length = pending.pop(handle)
+            if result['error']:
+                raise nbd_client.NBDError(
+                    'Read of %d bytes at %d from %s failed with errno %d'
+                    % (length, offset, nbd_image, result['error']))
+            if target is None:
+                os.lseek(target_fd, offset, os.SEEK_SET)
+                os.write(target_fd, result['data'])
+            else:
+                target.submit(nbd_client.CMD_WRITE, offset,
+                              data=result['data'])
+                _drain(target, depth)
+            copied += length
+        if target is not None:
+            _drain(target, 0)
+            target.flush()
+        else:
+            os.fsync(target_fd)
+        seconds = time.time() - start
+        logging.info('Copied %d bytes from %s to %s in %.2fs', copied,
+                     nbd_image, target_image, seconds)
+        return {'copied': copied, 'seconds': seconds}
+    finally:
+        source.close()
+        if target_fd is not None:
+            os.close(target_fd)
+        if target is not None:
+            target.close()
+        if exporter is not None:
+            exporter.stop_export()
+
+
 def get_disk_info_by_param(tag, params, session):
     """
     Get disk info by by serial/wwn or by size.
@@ -0,0 +1,207 @@
+"""
+Module for following the balloon of a VM from the host side.
+
+Available classes:
+- BalloonTracker: Follow the balloon size through BALLOON_CHANGE events
+                  and query-balloon, optionally together with the guest
+                  virtio-balloon statistics, and report when a balloon
+                  operation settled and how fast it went.
+
+Available methods:
+- parse_balloon_info: Get the balloon size from 'info balloon', a QMP dict
+                      or human monitor text.
+
+Every operation tracked by BalloonTracker.wait() gives a record with:
+
+- 'start_mb', 'end_mb', 'target_mb': balloon size before/after/wanted
+- 'direction': 'inflate' (guest memory shrinks), 'deflate' or 'none'
+- 'settled': whether the size settled (or reached the target) in time
+- 'elapsed': seconds from mark() to the detection of completion
+- 'duration': seconds from mark() to the last change of the size
+- 'rate_mbps': MB/s the balloon moved at over 'duration'
+- 'events': number of BALLOON_CHANGE events seen
+- 'series': list of (t, size in MB), from events and polling
+- 'guest_stats': list of (t, free MB, total MB) reported by the guest
+"""
+
+import logging
+import re
+import time
+
+MB = 1048576.0
+EVENT = "BALLOON_CHANGE"
+STAT_UNSUPPORTED = 0xffffffffffffffff
+
+
+def parse_balloon_info(info):
+    """
+    Get the balloon size.
+
+    :param info: output of vm.monitor.info("balloon")
+    :return: size in MB, None if it can not be parsed
+    """
+    if isinstance(info, dict):
+        return info["actual"] / MB
+    match = re.search(r"actual=(\d+)", str(info))
+    return float(match.group(1)) if match else None
+
+
+def _event_time(event):
+    stamp = event.get("timestamp", {})
+    if "seconds" not in stamp:
+        return time.time()
+    return stamp["seconds"] + stamp.get("microseconds", 0) / 1000000.0
+
+
+class BalloonTracker(object):
+
+    """
+    Host side view of the balloon of one VM.
+    """
+
+    def __init__(self, vm, interval=0.5, settle_time=3.0, stats_path=None,
+                 stats_interval=2, stats_threshold=100):
+        """
+        :param vm: VM object
+        :param interval: seconds between two query-balloon polls
+        :param settle_time: seconds without a size change after which the
+                            balloon is considered settled
+        :param stats_path: QOM path of the balloon device, enables the
+                           guest statistics polling when set (QMP only)
+        :param stats_interval: guest-stats-polling-interval in seconds
+        :param stats_threshold: MB two guest free memory reports may
+                                differ by for the guest to count as stable
+        """
+        self.vm = vm
+        self.interval = float(interval)
+        self.settle_time = float(settle_time)
+        self.stats_path = stats_path
+        self.stats_interval = int(stats_interval)
+        self.stats_threshold = float(stats_threshold)
+        self.records = []
+        self._mark = None
+        self.stats_enabled = False
+
+    @property
+    def qmp(self):
+        """Whether events and QOM are available"""
+        return self.vm.monitor.protocol == "qmp"
+
+    def actual(self):
+        """Current balloon size in MB"""
+        return parse_balloon_info(self.vm.monitor.info("balloon"))
+
+    def enable_stats(self):
+        """Turn on the guest statistics polling of the balloon device."""
+        if self.stats_enabled or not (self.stats_path and self.qmp):
+            return
+        self.vm.monitor.qom_set(self.stats_path,
+                                "guest-stats-polling-interval",
+                                self.stats_interval)
+        self.stats_enabled = True
+
+    def guest_stats(self):
+        """
+        Get the last guest statistics report.
+
+        :return: tuple of (last-update, free MB, total MB), None when the
+                 statistics are not available
+        """
+        if not self.stats_enabled:
+            return None
+        stats = self.vm.monitor.qom_get(self.stats_path, "guest-stats")
+        free = stats["stats"].get("stat-free-memory", STAT_UNSUPPORTED)
+        total = stats["stats"].get("stat-total-memory", STAT_UNSUPPORTED)
+        if free == STAT_UNSUPPORTED:
+            return None
+        return (stats.get("last-update"), free / MB,
+                None if total == STAT_UNSUPPORTED else total / MB)
+
+    def mark(self):
+        """
+        Remember the balloon size before an operation, call it right before
+        changing the balloon.
+        """
+        if self.qmp:
+            self.vm.monitor.clear_event(EVENT)
+        self.enable_stats()
+        # Event timestamps are wall clock, so is the whole series
+        self._mark = (time.time(), self.actual())
+
+    def _events(self, start):
+        if not self.qmp:
+            return []
+        changes = [(_event_time(e) - start, e["data"]["actual"] / MB)
+                   for e in self.vm.monitor.get_events()
+                   if e.get("event") == EVENT]
+        self.vm.monitor.clear_event(EVENT)
+        return changes
+
+    def wait(self, timeout, target=None):
+        """
+        Wait for the balloon operation started after mark() to finish.
+
+        Without a target the operation is over once the size did not change
+        for settle_time seconds and, with the guest statistics enabled, the
+        guest reported a stable free memory twice. With a target it is over
+        as soon as the size gets within 1 MB of it.
+
+        :param timeout: seconds to wait
+        :param target: expected balloon size in MB
+        :return: the record of the operation
+        """
+        if self._mark is None:
+            self.mark()
+        start, start_mb = self._mark
+        self._mark = None
+        series = [(0.0, start_mb)]
+        stats = []
+        last_update = None
+        events = 0
+        current, changed = start_mb, 0.0
+        settled = False
+        while True:
+            now = time.time() - start
+            changes = self._events(start)
+            events += len(changes)
+            polled = self.actual()
+            for t, size in changes + [(now, polled)]:
+                if size is None:
+                    continue
+                if size != current:
+                    current = size
+                    changed = min(max(t, changed), now)
+                    series.append((round(t, 6), size))
+            report = self.guest_stats()
+            if report and report[0] != last_update:
+                last_update = report[0]
+                stats.append((round(now, 6), report[1], report[2]))
+            if target is not None:
+                settled = abs(current - target) < 1
+            else:
+                # A guest without a balloon statistics driver never reports
+                silent = (not stats and now - changed >=
+                          self.settle_time + 2 * self.stats_interval)
+                guest_stable = (not self.stats_enabled or silent or
+                                (len(stats) > 1 and stats[-1][0] > changed and
+                                 abs(stats[-1][1] - stats[-2][1]) <
+                                 self.stats_threshold))
+                settled = now - changed >= self.settle_time and guest_stable
+            if settled or now >= timeout:
+                break
+            time.sleep(self.interval)
+        moved = current - start_mb
+        record = {"start_mb": start_mb, "end_mb": current,
+                  "target_mb": target, "settled": settled,
+                  "direction": ("inflate" if moved < 0 else
+                                "deflate" if moved > 0 else "none"),
+                  "elapsed": round(now, 6), "duration": round(changed, 6),
+                  "rate_mbps": (abs(moved) / changed if changed else None),
+                  "events": events, "series": series, "guest_stats": stats}
+        self.records.append(record)
+        logging.info("Balloon %s from %s MB to %s MB in %.2fs (%s MB/s), "
+                     "%s", record["direction"], start_mb, current, changed,
+                     "-" if record["rate_mbps"] is None else
+                     "%.1f" % record["rate_mbps"],
+                     "settled" if settled else "not settled")
+        return record
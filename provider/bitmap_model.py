@@ -0,0 +1,329 @@
+"""
+Module for checking the content of dirty bitmaps on the host.
+
+Available classes:
+- DirtyBitmap: Host side copy of a dirty bitmap, one bit per cluster of
+               'granularity' bytes, built from guest writes recorded by a
+               test or read from QEMU, with OR, AND, ANDNOT, popcount,
+               granularity conversion and comparison.
+
+Available methods:
+- pull_bitmaps: Read bitmaps of a running VM through its internal NBD
+                server and the 'qemu:dirty-bitmap:<name>' metadata contexts.
+- pull_persistent_bitmaps: Read the persistent bitmaps of an image with
+                           qemu-nbd, their granularity from qemu-img info.
+
+The bits are kept in one python integer, bit n for the cluster at offset
+n * granularity, so bitwise operations on whole bitmaps run in C and a 2T
+disk with 64K granularity takes 4M of memory. Extents are only walked when
+a bitmap is built, converted or printed.
+"""
+
+import binascii
+import itertools
+import json
+import logging
+import os
+import re
+
+from avocado.utils import process
+
+from virttest import data_dir
+from virttest import qemu_storage
+
+from provider import block_dirty_bitmap
+from provider import nbd_client
+from provider.nbd_image_export import InternalNBDExportImage
+from provider.nbd_image_export import QemuNBDExportImage
+
+
+def _popcount(value):
+    if hasattr(value, "bit_count"):
+        return value.bit_count()
+    return bin(value).count("1")
+
+
+class DirtyBitmap(object):
+
+    """
+    Dirty bitmap model.
+
+    Operations with a bitmap of another granularity convert it to the
+    granularity of the left operand first, the way block-dirty-bitmap-merge
+    does into its target: a cluster is dirty if any byte in it is dirty.
+    """
+
+    def __init__(self, size, granularity, bits=0):
+        """
+        :param size: disk size in bytes
+        :param granularity: bytes per bit
+        :param bits: integer, bit n set if cluster n is dirty
+        """
+        self.size = int(size)
+        self.granularity = int(granularity)
+        self.bits = bits
+
+    @property
+    def clusters(self):
+        return (self.size + self.granularity - 1) // self.granularity
+
+    def _cluster_range(self, offset, length):
+        first = offset // self.granularity
+        last = min((offset + length - 1) // self.granularity,
+                   self.clusters - 1)
+        return first, last
+
+    def mark(self, offset, length):
+        """Set the clusters written by a guest write."""
+        if length > 0 and offset < self.size:
+            first, last = self._cluster_range(offset, length)
+            self.bits |= ((1 << (last - first + 1)) - 1) << first
+
+    @classmethod
+    def from_extents(cls, size, granularity, extents):
+        """
+        Build a bitmap from dirty ranges.
+
+        :param extents: iterable of (offset, length) in bytes
+        """
+        bitmap = cls(size, granularity)
+        buf = bytearray((bitmap.clusters + 7) // 8)
+        for offset, length in extents:
+            if length <= 0 or offset >= bitmap.size:
+                continue
+            first, last = bitmap._cluster_range(offset, length)
+            head, tail = first >> 3, last >> 3
+            head_mask = (0xff << (first & 7)) & 0xff
+            tail_mask = 0xff >> (7 - (last & 7))
+            if head == tail:
+                buf[head] |= head_mask & tail_mask
+            else:
+                buf[head] |= head_mask
+                buf[head + 1:tail] = b"\xff" * (tail - head - 1)
+                buf[tail] |= tail_mask
+        # Little endian bytes, the lowest cluster in the first byte
+        bitmap.bits = int(binascii.hexlify(bytes(buf[::-1])) or b"0", 16)
+        return bitmap
+
+    @classmethod
+    def from_nbd(cls, client, name, granularity, window=1 << 30):
+        """
+        Read a bitmap exported by an NBD server.
+
+        :param client: NBDClient with the 'qemu:dirty-bitmap:<name>'
+                       metadata context negotiated
+        :param name: bitmap name
+        :param granularity: bitmap granularity, from query-block
+        :param window: max length of one block status request
+        """
+        extents = client.iter_extents("qemu:dirty-bitmap:%s" % name,
+                                      window=window)
+        return cls.from_extents(client.size, granularity,
+                                ((offset, length)
+                                 for offset, length, flags in extents
+                                 if flags & nbd_client.STATE_DIRTY))
+
+    @classmethod
+    def from_qemu_img(cls, qemu_img, filename, name, granularity,
+                      dirty_bitmap_opt="x-dirty-bitmap"):
+        """
+        Read a bitmap exported by an NBD server with qemu-img map.
+
+        The NBD client of QEMU reports the dirty ranges of the context
+        selected by 'x-dirty-bitmap' as holes.
+
+        :param qemu_img: qemu-img binary
+        :param filename: NBD image filename, e.g. nbd://host:port/export
+        :param name: bitmap name
+        :param granularity: bitmap granularity
+        """
+        opts = qemu_storage.filename_to_file_opts(filename)
+        opts[dirty_bitmap_opt] = "qemu:dirty-bitmap:%s" % name
+        cmd = "%s map --output=json 'json:%s'" % (qemu_img, json.dumps(opts))
+        extents = json.loads(process.run(cmd, shell=True,
+                                         verbose=False).stdout_text)
+        size = max([e["start"] + e["length"] for e in extents] or [0])
+        return cls.from_extents(size, granularity,
+                                ((e["start"], e["length"]) for e in extents
+                                 if not e["data"]))
+
+    def runs(self):
+        """
+        Walk the runs of dirty clusters.
+
+        :return: generator of (first cluster, number of clusters)
+        """
+        if not self.clusters:
+            return
+        data = binascii.unhexlify(
+            "%0*x" % ((self.clusters + 7) // 8 * 2, self.bits))[::-1]
+        start = end = None
+        # Skip clean bytes and take full bytes at once, test bits of the
+        # other bytes one by one
+        for segment in re.finditer(br"[^\x00]+", data):
+            for chunk in re.finditer(br"\xff+|[^\xff]", segment.group()):
+                base = (segment.start() + chunk.start()) * 8
+                byte = bytearray(chunk.group())[0]
+                if byte == 0xff:
+                    pieces = [(base, len(chunk.group()) * 8)]
+                else:
+                    pieces = [(base + bit, 1) for bit in range(8)
+                              if byte >> bit & 1]
+                for first, count in pieces:
+                    if first == end:
+                        end += count
+                        continue
+                    if start is not None:
+                        yield start, end - start
+                    start, end = first, first + count
+        if start is not None:
+            yield start, end - start
+
+    def extents(self):
+        """
+        Walk the dirty ranges.
+
+        :return: generator of (offset, length) in bytes
+        """
+        for first, count in self.runs():
+            offset = first * self.granularity
+            yield offset, min(count * self.granularity, self.size - offset)
+
+    def regranulate(self, granularity):
+        """Convert to another granularity."""
+        if granularity == self.granularity:
+            return DirtyBitmap(self.size, granularity, self.bits)
+        return DirtyBitmap.from_extents(self.size, granularity,
+                                        self.extents())
+
+    def count(self):
+        """Number of dirty clusters."""
+        return _popcount(self.bits)
+
+    def dirty_bytes(self):
+        """Dirty bytes as the 'count' of query-block reports them."""
+        return self.count() * self.granularity
+
+    def _other_bits(self, other):
+        if other.size != self.size:
+            raise ValueError("Bitmaps of %d and %d bytes disks" %
+                             (self.size, other.size))
+        return other.regranulate(self.granularity).bits
+
+    def __or__(self, other):
+        return DirtyBitmap(self.size, self.granularity,
+                           self.bits | self._other_bits(other))
+
+    def __and__(self, other):
+        return DirtyBitmap(self.size, self.granularity,
+                           self.bits & self._other_bits(other))
+
+    def __sub__(self, other):
+        """AND NOT, the clusters dirty in this bitmap only."""
+        return DirtyBitmap(self.size, self.granularity,
+                           self.bits & ~self._other_bits(other))
+
+    def __eq__(self, other):
+        return (isinstance(other, DirtyBitmap) and
+                self.bits == self._other_bits(other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        extents = ["%d+%d" % e for e in itertools.islice(self.extents(), 9)]
+        if len(extents) > 8:
+            extents[8:] = ["..."]
+        return "<DirtyBitmap %d/%d clusters of %d bytes dirty: %s>" % (
+            self.count(), self.clusters, self.granularity, " ".join(extents))
+
+    def diff(self, expected):
+        """
+        Compare with the expected bitmap.
+
+        :return: tuple of (DirtyBitmap of the clusters dirty only in
+                 expected, DirtyBitmap of the clusters dirty only in self)
+        """
+        return expected.regranulate(self.granularity) - self, self - expected
+
+
+def pull_bitmaps(vm, params, node, names, tag=None):
+    """
+    Read bitmaps of a block node of a running VM.
+
+    The node is exported read-only on the internal NBD server over a unix
+    socket, so enabled bitmaps can't be read, disable them first.
+
+    :param vm: VM object
+    :param params: Dictionary with the test parameters
+    :param node: block node name
+    :param names: bitmap names
+    :param tag: image tag of the node for the export params, the node name
+                by default
+    :return: dict of bitmap name: DirtyBitmap
+    """
+    tag = tag or node
+    granularities = dict((b["name"], b["granularity"]) for b in
+                         block_dirty_bitmap.get_bitmaps_in_device(vm, node))
+    socket_path = os.path.join(data_dir.get_tmp_dir(),
+                               "bitmaps_%s.sock" % tag)
+    export_params = params.copy()
+    export_params["nbd_unix_socket_%s" % tag] = socket_path
+    export_params["nbd_export_bitmaps_%s" % tag] = " ".join(names)
+    export_params["block_export_writable_%s" % tag] = "no"
+    exporter = InternalNBDExportImage(vm, export_params, tag)
+    exporter.start_nbd_server()
+    try:
+        exporter.add_nbd_image(node)
+        client = nbd_client.NBDClient(
+            unix_socket=socket_path, export=exporter.get_export_name(),
+            meta_contexts=["qemu:dirty-bitmap:%s" % n for n in names])
+        try:
+            return dict((name, DirtyBitmap.from_nbd(client, name,
+                                                    granularities[name]))
+                        for name in names)
+        finally:
+            client.close()
+    finally:
+        exporter.stop_export()
+
+
+def pull_persistent_bitmaps(params, tag, names=None):
+    """
+    Read the persistent bitmaps of a qcow2 image no VM is using.
+
+    :param params: Dictionary with the test parameters
+    :param tag: image tag
+    :param names: bitmap names, all bitmaps of the image by default
+    :return: dict of bitmap name: DirtyBitmap
+    """
+    image_params = params.object_params(tag)
+    image = qemu_storage.QemuImg(image_params, data_dir.get_data_dir(), tag)
+    info = json.loads(image.info(output="json"))
+    bitmaps = info.get("format-specific", {}).get("data", {}).get(
+        "bitmaps", [])
+    granularities = dict((b["name"], b["granularity"]) for b in bitmaps)
+    names = names or list(granularities)
+    socket_path = os.path.join(data_dir.get_tmp_dir(),
+                               "bitmaps_%s.sock" % tag)
+    export_params = params.copy()
+    export_params["nbd_unix_socket_%s" % tag] = socket_path
+    export_params["nbd_export_format_%s" % tag] = image.image_format
+    export_params["nbd_export_bitmaps_%s" % tag] = " ".join(names)
+    exporter = QemuNBDExportImage(export_params, tag)
+    exporter.export_image()
+    try:
+        client = nbd_client.NBDClient(
+            unix_socket=socket_path,
+            meta_contexts=["qemu:dirty-bitmap:%s" % n for n in names])
+        try:
+            result = {}
+            for name in names:
+                result[name] = DirtyBitmap.from_nbd(client, name,
+                                                    granularities[name])
+                logging.debug("%s in %s: %s", name, tag, result[name])
+            return result
+        finally:
+            client.close()
+    finally:
+        exporter.stop_export()
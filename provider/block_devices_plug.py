@@ -31,6 +31,9 @@ from virttest.qemu_devices.utils import (DeviceError, DeviceHotplugError,
                                          DeviceUnplugError)
 from virttest.qemu_monitor import MonitorLockError
 
+from provider.session_pool import guest_session
+from provider.session_pool import pooled
+
 HOTPLUG, UNPLUG = ('hotplug', 'unplug')
 HOTPLUGGED_HBAS = {}
 DELETED_EVENT = 'DEVICE_DELETED'
@@ -59,18 +62,17 @@ def _verify_plugged_num(action):
                     disks_info_win = ('wmic logicaldisk get drivetype,name,description '
                                       '& wmic diskdrive list brief /format:list')
                     disks_info_linux = 'lsblk -a'
-                    _session = self.vm.wait_for_login(timeout=360)
-                    disks_info = _session.cmd(
-                        disks_info_win if self._iswindows else disks_info_linux)
+                    with guest_session(self.vm, timeout=360) as _session:
+                        disks_info = _session.cmd(
+                            disks_info_win if self._iswindows else disks_info_linux)
                     logging.debug("The details of disks:\n %s", disks_info)
-                    _session.close()
                     raise TestError(
                         "%s--> Actual: %s disks. Expected: %s disks." %
                         (action, len(self._all_disks ^ orig_disks), len(self._imgs)))
                 self._plugged_disks = sorted(
                     [disk.split('/')[-1] for disk in list(self._all_disks ^ orig_disks)])
             return result
-        return wrapper
+        return pooled(wrapper)
     return decorator
 
 
@@ -195,12 +197,12 @@ class BlockDevicesPlug(object):
 
     def _list_all_disks(self):
         """ List all the disks. """
-        session = self.vm.wait_for_login(timeout=360)
-        if self._islinux:
-            self._all_disks = utils_misc.list_linux_guest_disks(session)
-        else:
-            self._all_disks = set(session.cmd('wmic diskdrive get index').split()[1:])
-        session.close()
+        with guest_session(self.vm, timeout=360) as session:
+            if self._islinux:
+                self._all_disks = utils_misc.list_linux_guest_disks(session)
+            else:
+                self._all_disks = set(
+                    session.cmd('wmic diskdrive get index').split()[1:])
         return self._all_disks
 
     def _check_qmp_outputs(self, action):
@@ -12,6 +12,8 @@ from virttest import qemu_vm
 from virttest.qemu_capabilities import Flags
 
 from provider import backup_utils
+from provider.session_pool import guest_session
+from provider.session_pool import pooled_sessions
 from provider.virt_storage.storage_admin import sp_admin
 
 
@@ -95,15 +97,12 @@ class BlockdevBackupBaseTest(object):
                 self.main_vm, self.disks_info[tag][1], "data")
 
     def verify_data_files(self):
-        session = self.clone_vm.wait_for_login()
-        try:
+        with guest_session(self.clone_vm) as session:
             backup_utils.refresh_mounts(self.disks_info, self.params, session)
             for tag, info in self.disks_info.items():
                 logging.debug("mount target disk in VM!")
                 utils_disk.mount(info[0], info[1], session=session)
                 backup_utils.verify_file_md5(self.clone_vm, info[1], "data")
-        finally:
-            session.close()
 
     def prepare_clone_vm(self):
         """Boot VM with target data disk for verify purpose"""
@@ -122,8 +121,7 @@ class BlockdevBackupBaseTest(object):
 
     @error_context.context_aware
     def format_data_disk(self, tag):
-        session = self.main_vm.wait_for_login()
-        try:
+        with guest_session(self.main_vm) as session:
             disk_params = self.params.object_params(tag)
             disk_size = disk_params["image_size"]
             disks = utils_disk.get_linux_disks(session, True)
@@ -137,8 +135,6 @@ class BlockdevBackupBaseTest(object):
             mount_point = utils_disk.configure_empty_linux_disk(
                 session, disk_id, disk_size)[0]
             self.disks_info[tag] = [disk_path, mount_point]
-        finally:
-            session.close()
 
     @error_context.context_aware
     def add_target_data_disks(self):
@@ -221,8 +217,9 @@ class BlockdevBackupBaseTest(object):
             memory.drop_caches()
 
     def run_test(self):
-        self.prepare_test()
-        try:
-            self.do_backup()
-        finally:
-            self.post_test()
+        with pooled_sessions():
+            self.prepare_test()
+            try:
+                self.do_backup()
+            finally:
+                self.post_test()
@@ -13,6 +13,8 @@ from virttest.qemu_capabilities import Flags
 
 from provider import backup_utils
 from provider import job_utils
+from provider.session_pool import guest_session
+from provider.session_pool import pooled_sessions
 from provider.virt_storage.storage_admin import sp_admin
 
 
@@ -131,8 +133,7 @@ class BlockdevBaseTest(object):
         """
         Verify temp file's md5sum in all data disks
         """
-        session = self.clone_vm.wait_for_login()
-        try:
+        with guest_session(self.clone_vm) as session:
             backup_utils.refresh_mounts(self.disks_info, self.params, session)
             for tag, info in self.disks_info.items():
                 if tag != 'image1':
@@ -141,13 +142,10 @@ class BlockdevBaseTest(object):
                 for data_file in self.files_info[tag]:
                     backup_utils.verify_file_md5(
                         self.clone_vm, info[1], data_file)
-        finally:
-            session.close()
 
     @error_context.context_aware
     def format_data_disk(self, tag):
-        session = self.main_vm.wait_for_login()
-        try:
+        with guest_session(self.main_vm) as session:
             info = backup_utils.get_disk_info_by_param(tag, self.params,
                                                        session)
             if info is None:
@@ -156,8 +154,6 @@ class BlockdevBaseTest(object):
             mount_point = utils_disk.configure_empty_linux_disk(
                 session, info['kname'], info['size'])[0]
             self.disks_info[tag] = [disk_path, mount_point]
-        finally:
-            session.close()
 
     @error_context.context_aware
     def add_target_data_disks(self):
@@ -192,11 +188,12 @@ class BlockdevBaseTest(object):
                 vm.destroy()
 
     def run_test(self):
-        self.prepare_test()
-        try:
-            self.do_test()
-        finally:
-            self.post_test()
+        with pooled_sessions():
+            self.prepare_test()
+            try:
+                self.do_test()
+            finally:
+                self.post_test()
 
     def do_test(self):
         raise NotImplementedError
@@ -7,6 +7,8 @@ from virttest import utils_disk
 from provider import backup_utils
 from provider import job_utils
 
+from provider.session_pool import guest_session
+from provider.session_pool import pooled_sessions
 from provider.virt_storage.storage_admin import sp_admin
 
 
@@ -110,8 +112,7 @@ class BlockDevCommitTest(object):
         os_type = self.params["os_type"]
         disk_params = self.params.object_params(tag)
         disk_size = disk_params["image_size"]
-        session = self.main_vm.wait_for_login()
-        try:
+        with guest_session(self.main_vm) as session:
             if os_type != "windows":
                 disk_id = self.get_linux_disk_path(session, disk_size)
                 assert disk_id, "Disk not found in guest!"
@@ -127,8 +128,6 @@ class BlockDevCommitTest(object):
                     session, disk_id, disk_size)[0]
                 mount_point = r"%s:\\" % driver_letter
                 self.disks_info.append([disk_id, mount_point, tag])
-        finally:
-            session.close()
 
     def generate_tempfile(self, root_dir, filename="data",
                           size="10M", timeout=360):
@@ -157,9 +156,10 @@ class BlockDevCommitTest(object):
             logging.error(str(error))
 
     def run_test(self):
-        self.pre_test()
-        try:
-            self.commit_snapshots()
-            self.verify_data_file()
-        finally:
-            self.post_test()
+        with pooled_sessions():
+            self.pre_test()
+            try:
+                self.commit_snapshots()
+                self.verify_data_file()
+            finally:
+                self.post_test()
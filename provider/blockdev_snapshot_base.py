@@ -7,6 +7,8 @@ from virttest.qemu_capabilities import Flags
 
 from provider import backup_utils
 
+from provider.session_pool import guest_session
+from provider.session_pool import pooled_sessions
 from provider.virt_storage.storage_admin import sp_admin
 
 
@@ -56,15 +58,12 @@ class BlockDevSnapshotTest(object):
     def mount_data_disks(self):
         if self.params["os_type"] == "windows":
             return
-        session = self.clone_vm.wait_for_login()
-        try:
+        with guest_session(self.clone_vm) as session:
             backup_utils.refresh_mounts(self.disks_info, self.params, session)
             for info in self.disks_info.values():
                 disk_path = info[0]
                 mount_point = info[1]
                 utils_disk.mount(disk_path, mount_point, session=session)
-        finally:
-            session.close()
 
     def verify_data_file(self):
         for info in self.files_info:
@@ -112,8 +111,7 @@ class BlockDevSnapshotTest(object):
         os_type = self.params["os_type"]
         disk_params = self.params.object_params(self.base_tag)
         disk_size = disk_params["image_size"]
-        session = self.main_vm.wait_for_login()
-        try:
+        with guest_session(self.main_vm) as session:
             if os_type != "windows":
                 disk_id = self.get_linux_disk_path(session, disk_size)
                 assert disk_id, "Disk not found in guest!"
@@ -128,8 +126,6 @@ class BlockDevSnapshotTest(object):
                     session, disk_id, disk_size)[0]
                 mount_point = r"%s:\\" % driver_letter
                 self.disks_info[self.base_tag] = [disk_id, mount_point]
-        finally:
-            session.close()
 
     def generate_tempfile(self, root_dir, filename="data",
                           size="10M", timeout=360):
@@ -159,8 +155,9 @@ class BlockDevSnapshotTest(object):
             logging.error(str(error))
 
     def run_test(self):
-        self.pre_test()
-        try:
-            self.snapshot_test()
-        finally:
-            self.post_test()
+        with pooled_sessions():
+            self.pre_test()
+            try:
+                self.snapshot_test()
+            finally:
+                self.post_test()
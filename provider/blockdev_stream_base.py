@@ -3,6 +3,7 @@ import json
 
 from provider import backup_utils
 from provider.blockdev_snapshot_base import BlockDevSnapshotTest
+from provider.session_pool import pooled_sessions
 
 
 class BlockDevStreamTest(BlockDevSnapshotTest):
@@ -87,8 +88,9 @@ class BlockDevStreamTest(BlockDevSnapshotTest):
         self.verify_data_file()
 
     def run_test(self):
-        self.pre_test()
-        try:
-            self.do_test()
-        finally:
-            self.post_test()
+        with pooled_sessions():
+            self.pre_test()
+            try:
+                self.do_test()
+            finally:
+                self.post_test()
@@ -0,0 +1,214 @@
+"""
+Module for profiling guest boot phases.
+
+Available classes:
+- BootProfiler: Timestamp boot phases from the serial console and QMP
+                events, and store the breakdown of every run.
+
+Each phase is a regex matched on the serial console output, the phase
+starts when its marker shows up first and lasts until the next marker
+that was seen.  The origin of a profile is the QEMU process start for a
+cold boot, or the QMP RESET event for a reboot.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from virttest import utils_misc
+
+QEMU_START = "qemu_start"
+RESET_EVENT = "RESET"
+
+# Default markers, the firmware one covers SeaBIOS, OVMF and SLOF.  A
+# marker line belongs to one phase only: OVMF prints 'BdsDxe: loading' when
+# it picks a boot option and 'BdsDxe: starting' when it hands over to it,
+# both at the start of a line, maybe after terminal escape sequences.
+_LINE_START = r"^(?:\x1b\[[0-9;?]*[A-Za-z])*"
+DEFAULT_PHASES = ("firmware", "bootloader", "kernel", "initramfs",
+                  "userspace", "login")
+DEFAULT_PATTERNS = {
+    "firmware": (r"SeaBIOS \(version|UEFI Interactive Shell|SLOF\b|" +
+                 _LINE_START + r"BdsDxe: loading"),
+    "bootloader": (r"Booting from (Hard Disk|ROM|DVD)|GRUB|grub|"
+                   r"Trying to load:|" + _LINE_START + r"BdsDxe: starting"),
+    "kernel": r"Linux version \d",
+    "initramfs": r"Run /init as init process|Unpacking initramfs|dracut",
+    "userspace": r"Switching root|systemd\[1\]: |Welcome to ",
+    "login": r"login:\s*$",
+}
+
+
+class BootProfiler(object):
+
+    """
+    Watch the serial console of a VM and timestamp every boot phase.
+    """
+
+    def __init__(self, vm, params):
+        """
+        :param vm: VM object
+        :param params: Dictionary with the test parameters, markers are
+                       overridable with 'boot_phase_pattern_<phase>' and
+                       the phase list with 'boot_phases'.
+        """
+        self.vm = vm
+        self.phases = params.objects("boot_phases") or list(DEFAULT_PHASES)
+        self._patterns = []
+        for phase in self.phases:
+            pattern = params.get("boot_phase_pattern_%s" % phase,
+                                 DEFAULT_PATTERNS.get(phase))
+            if pattern:
+                self._patterns.append((phase, re.compile(pattern, re.M)))
+        self._interval = float(params.get("boot_profile_interval", 0.05))
+        self._history = params.get("boot_profile_history")
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._offset = 0
+        self._floor = 0
+        self.origin = None
+        self.origin_name = None
+        self.marks = {}
+
+    def _serial_output(self):
+        try:
+            return self.vm.serial_console.get_output() or ""
+        except Exception:
+            return ""
+
+    def _scan(self, now):
+        output = self._serial_output()
+        # Markers may straddle two polls, keep a small overlap.
+        window = output[max(self._offset - 256, self._floor):]
+        self._offset = len(output)
+        for phase, pattern in self._patterns:
+            if phase not in self.marks and pattern.search(window):
+                self.marks[phase] = now
+                logging.debug("Boot phase '%s' seen at +%.3fs", phase,
+                              now - self.origin)
+
+    def _poll(self):
+        while not self._stop_event.is_set():
+            self._scan(utils_misc.monotonic_time())
+            if len(self.marks) == len(self._patterns):
+                break
+            self._stop_event.wait(self._interval)
+
+    def start(self, origin=None, origin_name=QEMU_START):
+        """
+        Start watching the serial console from now on.
+
+        :param origin: monotonic time the profile starts from, the QEMU
+                       process start time of the VM by default
+        :param origin_name: name of the origin mark
+        """
+        if origin is None:
+            origin = self.vm.start_monotonic_time
+        self.origin = origin
+        self.origin_name = origin_name
+        self.marks = {}
+        # A reboot keeps the console, skip what the previous boot printed.
+        self._floor = len(self._serial_output()) if \
+            origin_name != QEMU_START else 0
+        self._offset = self._floor
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def start_reboot(self, fallback):
+        """
+        Start watching a guest reboot, the origin is moved to the QMP
+        RESET event once it is seen.
+
+        :param fallback: monotonic time the reboot was requested
+        """
+        if self.vm.monitor.protocol == "qmp":
+            self.vm.monitor.clear_event(RESET_EVENT)
+        self.start(fallback, "reboot")
+
+    def _reset_origin(self):
+        if self.origin_name != "reboot" or \
+                self.vm.monitor.protocol != "qmp":
+            return
+        event = self.vm.monitor.get_event(RESET_EVENT)
+        if not event or "timestamp" not in event:
+            return
+        stamp = event["timestamp"]
+        wall = stamp["seconds"] + stamp["microseconds"] / 1000000.0
+        # QMP events carry wall clock time, move it to the monotonic one.
+        origin = utils_misc.monotonic_time() - (time.time() - wall)
+        logging.debug("Reboot origin moved to the QMP %s event (%+.3fs)",
+                      RESET_EVENT, origin - self.origin)
+        self.origin = origin
+        self.origin_name = RESET_EVENT.lower()
+
+    def stop(self, login_time=None):
+        """
+        Stop watching and return the phase breakdown.
+
+        :param login_time: monotonic time the login finished, recorded as
+                           the end of the profile
+        :return: list of dicts with phase name, start offset and duration
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        end = login_time or utils_misc.monotonic_time()
+        self._scan(end)
+        self._reset_origin()
+        return self.breakdown(end)
+
+    def breakdown(self, end):
+        """
+        Convert the marks into consecutive phases.
+
+        :param end: monotonic time of the end of the profile
+        :return: list of dicts with phase name, start offset and duration
+        """
+        seen = sorted((stamp, self.phases.index(phase), phase)
+                      for phase, stamp in self.marks.items())
+        points = ([(self.origin, self.origin_name)] +
+                  [(stamp, phase) for stamp, _, phase in seen] +
+                  [(end, "end")])
+        phases = []
+        for (start, name), (stop, _) in zip(points, points[1:]):
+            phases.append({"phase": name,
+                           "start": round(max(start - self.origin, 0), 3),
+                           "duration": round(max(stop - start, 0), 3)})
+        missing = [phase for phase, _ in self._patterns
+                   if phase not in self.marks]
+        if missing:
+            logging.warning("Boot phases not seen on serial console: %s",
+                            ", ".join(missing))
+        return phases
+
+    def save(self, test, phases, tag):
+        """
+        Store the breakdown of one run in the test results, and append it
+        to the 'boot_profile_history' file if configured.
+
+        :param test: QEMU test object
+        :param phases: breakdown returned by stop()
+        :param tag: name of this run, e.g. 'boot' or 'reboot'
+        """
+        total = sum(phase["duration"] for phase in phases)
+        record = {"tag": tag, "vm": self.vm.name, "time": time.time(),
+                  "total": round(total, 3), "phases": phases}
+        for phase in phases:
+            logging.info("%-12s +%8.3fs  %8.3fs", phase["phase"],
+                         phase["start"], phase["duration"])
+        test.write_test_keyval(dict(("%s_%s" % (tag, phase["phase"]),
+                                     "%ss" % phase["duration"])
+                                    for phase in phases))
+        result_file = os.path.join(test.resultsdir, "%s_phases.json" % tag)
+        with open(result_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        if self._history:
+            with open(self._history, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
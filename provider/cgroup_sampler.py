@@ -0,0 +1,330 @@
+"""
+Module for sampling the kernel resource accounting of VM cgroups.
+
+Available classes:
+- CgroupSampler: Read cpu, io and memory counters of the cgroups of a set
+                 of processes (cgroup v1 or v2) plus their per thread
+                 schedstat at a fixed rate, and compute per group shares
+                 and fairness over time.
+
+Available methods:
+- cgroup_dirs: Get the cgroup directory of a process for every controller.
+- read_counters: Read the current counters of a process and its cgroups.
+- jain_index: Jain's fairness index of a list of allocations.
+
+Counters of a sample (missing when the controller is not available):
+- cpu_usec: cgroup CPU time (cpuacct.usage or cpu.stat usage_usec)
+- read_bytes, write_bytes, rios, wios: cgroup block I/O (throttle
+  io_service_bytes/io_serviced or io.stat), summed over the devices
+- mem_usage, mem_anon, mem_file: cgroup memory usage
+- run_ns, wait_ns, timeslices: sum of /proc/<pid>/task/*/schedstat
+"""
+
+import glob
+import json
+import logging
+import os
+
+from provider.host_stats import Sampler
+
+
+def _read(path):
+    try:
+        with open(path) as cgroup_file:
+            return cgroup_file.read()
+    except (IOError, OSError):
+        return ""
+
+
+def cgroup_mounts():
+    """
+    Get the cgroup mount points of the host.
+
+    :return: tuple of (dict of v1 controller: mount point, v2 mount point)
+    """
+    v1 = {}
+    v2 = None
+    for line in _read("/proc/self/mountinfo").splitlines():
+        left, right = line.split(" - ", 1)
+        mount_point = left.split()[4]
+        fstype, _, options = right.split()[:3]
+        if fstype == "cgroup2" and v2 is None:
+            v2 = mount_point
+        elif fstype == "cgroup":
+            for option in options.split(","):
+                v1.setdefault(option, mount_point)
+    return v1, v2
+
+
+def cgroup_dirs(pid):
+    """
+    Get the cgroup directories of a process.
+
+    :param pid: process id
+    :return: dict of controller: directory, the v2 directory is 'unified'
+    """
+    v1, v2 = cgroup_mounts()
+    dirs = {}
+    for line in _read("/proc/%s/cgroup" % pid).splitlines():
+        _, controllers, path = line.split(":", 2)
+        if not controllers:
+            if v2:
+                dirs["unified"] = v2.rstrip("/") + path
+            continue
+        for controller in controllers.split(","):
+            if controller in v1:
+                dirs[controller] = v1[controller].rstrip("/") + path
+    return dirs
+
+
+def _keyed(text):
+    """Parse 'key value' lines"""
+    values = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1].isdigit():
+            values[fields[0]] = int(fields[1])
+    return values
+
+
+def _io_v1(directory, devices):
+    counters = {}
+    for name, read_key, write_key in (
+            ("blkio.throttle.io_service_bytes", "read_bytes", "write_bytes"),
+            ("blkio.throttle.io_serviced", "rios", "wios")):
+        text = _read(os.path.join(directory, name))
+        if not text:
+            continue
+        counters[read_key] = counters[write_key] = 0
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) != 3 or (devices and fields[0] not in devices):
+                continue
+            if fields[1] == "Read":
+                counters[read_key] += int(fields[2])
+            elif fields[1] == "Write":
+                counters[write_key] += int(fields[2])
+    return counters
+
+
+def _io_v2(directory, devices):
+    text = _read(os.path.join(directory, "io.stat"))
+    if not text:
+        return {}
+    counters = dict.fromkeys(("read_bytes", "write_bytes", "rios", "wios"),
+                             0)
+    keys = {"rbytes": "read_bytes", "wbytes": "write_bytes",
+            "rios": "rios", "wios": "wios"}
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields or (devices and fields[0] not in devices):
+            continue
+        for field in fields[1:]:
+            key, _, value = field.partition("=")
+            if key in keys:
+                counters[keys[key]] += int(value)
+    return counters
+
+
+def read_counters(pid, devices=None):
+    """
+    Read the counters of a process and of its cgroups.
+
+    :param pid: process id, e.g. a QEMU pid
+    :param devices: list of 'major:minor' to account I/O of, all if None
+    :return: dict of counter: value
+    """
+    dirs = cgroup_dirs(pid)
+    unified = dirs.get("unified")
+    counters = {}
+    if "cpuacct" in dirs:
+        usage = _read(os.path.join(dirs["cpuacct"], "cpuacct.usage"))
+        if usage:
+            counters["cpu_usec"] = int(usage) // 1000
+    elif unified:
+        stat = _keyed(_read(os.path.join(unified, "cpu.stat")))
+        if "usage_usec" in stat:
+            counters["cpu_usec"] = stat["usage_usec"]
+    if "blkio" in dirs:
+        counters.update(_io_v1(dirs["blkio"], devices))
+    elif unified:
+        counters.update(_io_v2(unified, devices))
+    if "memory" in dirs:
+        stat = _keyed(_read(os.path.join(dirs["memory"], "memory.stat")))
+        usage = _read(os.path.join(dirs["memory"], "memory.usage_in_bytes"))
+        anon, page_cache = stat.get("rss"), stat.get("cache")
+    elif unified:
+        stat = _keyed(_read(os.path.join(unified, "memory.stat")))
+        usage = _read(os.path.join(unified, "memory.current"))
+        anon, page_cache = stat.get("anon"), stat.get("file")
+    else:
+        usage = anon = page_cache = None
+    if usage:
+        counters.update({"mem_usage": int(usage), "mem_anon": anon,
+                         "mem_file": page_cache})
+    run_ns = wait_ns = slices = 0
+    for path in glob.glob("/proc/%s/task/*/schedstat" % pid):
+        fields = _read(path).split()
+        if len(fields) == 3:
+            run_ns += int(fields[0])
+            wait_ns += int(fields[1])
+            slices += int(fields[2])
+    counters.update({"run_ns": run_ns, "wait_ns": wait_ns,
+                     "timeslices": slices})
+    return counters
+
+
+def jain_index(values, weights=None):
+    """
+    Jain's fairness index, 1 when every allocation matches its weight and
+    1/n when a single member gets everything.
+
+    :param values: list of allocations
+    :param weights: list of weights, equal weights if None
+    :return: index in [1/n, 1], None without any allocation
+    """
+    if weights:
+        values = [float(v) / w for v, w in zip(values, weights)]
+    square_sum = sum(float(v) ** 2 for v in values)
+    if not values or not square_sum:
+        return None
+    return sum(values) ** 2 / (len(values) * square_sum)
+
+
+class CgroupSampler(Sampler):
+
+    """
+    Time series of the kernel accounting of a set of VM cgroups.
+    """
+
+    def __init__(self, groups, interval=1.0, devices=None):
+        """
+        :param groups: dict of name: pid, the cgroups of every pid are read
+        :param interval: seconds between two samples
+        :param devices: list of 'major:minor' to account I/O of
+        """
+        super(CgroupSampler, self).__init__(interval)
+        self.groups = groups
+        self.devices = devices
+
+    def sample(self):
+        """
+        Take one sample and append it to the time series.
+
+        :return: dict with 't' and 'groups' of name: counters
+        """
+        groups = dict((name, read_counters(pid, self.devices))
+                      for name, pid in self.groups.items())
+        sample = {"t": self.elapsed(), "groups": groups}
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def deltas(self, counter, first=0, last=-1):
+        """
+        Get the growth of a counter of every group between two samples.
+
+        :param counter: counter name, e.g. 'write_bytes'
+        :param first: index of the first sample
+        :param last: index of the last sample
+        :return: dict of name: delta, groups without the counter are skipped
+        """
+        with self._lock:
+            begin, end = self.samples[first], self.samples[last]
+        return dict((name, end["groups"][name][counter] -
+                     begin["groups"][name][counter])
+                    for name in self.groups
+                    if end["groups"][name].get(counter) is not None and
+                    begin["groups"][name].get(counter) is not None)
+
+    def rates(self, counter):
+        """
+        Get the per second rate of a counter of every group over time.
+
+        :param counter: counter name
+        :return: list of (t, {name: rate}), one entry per interval
+        """
+        with self._lock:
+            count = len(self.samples)
+            times = [s["t"] for s in self.samples]
+        rates = []
+        for i in range(1, count):
+            elapsed = times[i] - times[i - 1]
+            if elapsed <= 0:
+                continue
+            rates.append((times[i], dict(
+                (name, delta / elapsed) for name, delta in
+                self.deltas(counter, i - 1, i).items())))
+        return rates
+
+    def shares(self, counter, first=0, last=-1):
+        """
+        Get the part of the total growth of a counter every group got.
+
+        :return: dict of name: share in [0, 1]
+        """
+        deltas = self.deltas(counter, first, last)
+        total = float(sum(deltas.values()))
+        return dict((name, delta / total if total else 0.0)
+                    for name, delta in deltas.items())
+
+    def fairness(self, counter, weights=None):
+        """
+        Get Jain's fairness index of a counter over time.
+
+        :param counter: counter name
+        :param weights: dict of name: weight, equal weights if None
+        :return: list of (t, index), one entry per interval
+        """
+        names = sorted(self.groups)
+        result = []
+        for t, rates in self.rates(counter):
+            if set(rates) != set(names):
+                continue
+            result.append((t, jain_index(
+                [rates[name] for name in names],
+                [weights[name] for name in names] if weights else None)))
+        return result
+
+    def summary(self, counter, weights=None):
+        """
+        Summarize one counter over the whole sampling.
+
+        :return: dict with the per group 'shares', the expected shares
+                 from the weights, the overall 'jain_index' and the
+                 min/avg of the per interval index
+        """
+        names = sorted(self.groups)
+        deltas = self.deltas(counter)
+        over_time = [index for _, index in self.fairness(counter, weights)
+                     if index is not None]
+        result = {"counter": counter, "deltas": deltas,
+                  "shares": self.shares(counter),
+                  "jain_index": jain_index(
+                      [deltas.get(name, 0) for name in names],
+                      [weights[name] for name in names] if weights else None)}
+        if weights:
+            total = float(sum(weights.values()))
+            result["expected_shares"] = dict((name, weights[name] / total)
+                                             for name in names)
+        if over_time:
+            result.update({"jain_min": min(over_time),
+                           "jain_avg": sum(over_time) / len(over_time)})
+        logging.debug("cgroup %s summary: %s", counter, result)
+        return result
+
+    def save(self, result_dir, tag):
+        """
+        Write the time series as JSON.
+
+        :param result_dir: directory to store the file
+        :param tag: file name suffix
+        :return: path of the file
+        """
+        path = os.path.join(result_dir, "cgroup_samples_%s.json" % tag)
+        with self._lock:
+            samples = list(self.samples)
+        with open(path, "w") as samples_file:
+            json.dump({"groups": self.groups, "interval": self.interval,
+                       "samples": samples}, samples_file, indent=2)
+        return path
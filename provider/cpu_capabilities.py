@@ -0,0 +1,280 @@
+"""
+Module for caching what the host and QEMU know about CPU models.
+
+Available classes:
+- CpuCapabilities: Probe the CPU models and flags of a QEMU binary and of
+                   the host once, save the parsed tables on disk and answer
+                   queries from them.
+
+Available methods:
+- get_capabilities: CpuCapabilities of the QEMU binary of a test, shared by
+                    every caller in the process.
+
+The probe runs the '-cpu' help options of QEMU, query-cpu-definitions on a
+'-machine none' QEMU, and the host and QEMU model lookups of virttest, and
+reads cpu_map.xml. Its result is saved as JSON in a file named after a key
+made of the sha256 of the QEMU binary and of cpu_map.xml, the host CPU
+signature (vendor, family, model, stepping, microcode and flags) and the
+host kernel release, so a new QEMU build, a microcode update or a kernel
+update is probed again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from xml.etree import ElementTree
+
+from avocado.utils import process
+
+from virttest import cpu
+from virttest import data_dir
+from virttest import utils_misc
+
+# '-cpu' options whose output is kept
+CPU_HELP_OPTIONS = ("?", "?cpuid", "?dump", "?model")
+
+CPUINFO_KEYS = ("vendor_id", "cpu family", "model", "stepping", "microcode",
+                "flags")
+
+_loaded = {}
+_hashes = {}
+_lock = threading.Lock()
+
+
+def _file_hash(path):
+    """sha256 of a file, computed once per file version."""
+    stat = os.stat(path)
+    version = (path, stat.st_size, stat.st_mtime)
+    if version not in _hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1 << 20), b""):
+                digest.update(block)
+        _hashes[version] = digest.hexdigest()
+    return _hashes[version]
+
+
+def _cpu_signature():
+    """Fields of the first processor in /proc/cpuinfo."""
+    signature = {}
+    with open("/proc/cpuinfo") as cpuinfo:
+        for line in cpuinfo:
+            if not line.strip():
+                break
+            name, _, value = line.partition(":")
+            if name.strip() in CPUINFO_KEYS:
+                signature[name.strip()] = value.strip()
+    return signature
+
+
+def parse_cpu_map(cpu_map):
+    """
+    Read the models and features of a cpu_map.xml file.
+
+    A model referring to another model gets its features too.
+
+    :param cpu_map: path of cpu_map.xml
+    :return: tuple of (dict of arch: {model: list of features}, list of the
+             features defined out of models)
+    """
+    models = {}
+    features = []
+    for arch in ElementTree.parse(cpu_map).getroot().iter("arch"):
+        arch_models = models[arch.get("name")] = {}
+        for element in arch:
+            if element.tag == "feature":
+                features.append(element.get("name"))
+            elif element.tag == "model":
+                flags = []
+                for child in element:
+                    if child.tag == "model":
+                        flags += arch_models.get(child.get("name"), [])
+                    elif child.tag == "feature":
+                        flags.append(child.get("name"))
+                arch_models[element.get("name")] = flags
+    return models, features
+
+
+class CpuCapabilities(object):
+
+    """
+    CPU models and flags of a QEMU binary on this host, probed once.
+    """
+
+    def __init__(self, qemu_binary, cache_dir=None, cpu_map=None):
+        """
+        :param qemu_binary: path of the QEMU binary
+        :param cache_dir: directory of the saved probes, a
+                          'cpu_capabilities' directory in the avocado-vt
+                          tmp dir by default
+        :param cpu_map: path of cpu_map.xml, the one in deps/cpu_flags by
+                        default
+        """
+        self.qemu_binary = qemu_binary
+        self.cache_dir = cache_dir or os.path.join(data_dir.get_tmp_dir(),
+                                                   "cpu_capabilities")
+        self.cpu_map = cpu_map or os.path.join(
+            data_dir.get_deps_dir("cpu_flags"), "cpu_map.xml")
+        self.key = self._key()
+        self.data = None
+
+    def _key(self):
+        signature = {"qemu": _file_hash(self.qemu_binary),
+                     "cpu_map": _file_hash(self.cpu_map),
+                     "cpu": _cpu_signature(),
+                     "kernel": os.uname()[2]}
+        return hashlib.sha256(json.dumps(signature, sort_keys=True).encode()
+                              ).hexdigest()[:32]
+
+    def _qmp(self, commands):
+        """Run QMP commands on a '-machine none' QEMU, return their replies."""
+        lines = ['{"execute": "qmp_capabilities"}']
+        for cmd in commands:
+            lines.append(json.dumps({"execute": cmd, "id": cmd}))
+        lines.append('{"execute": "quit"}')
+        cmd = ("echo -e '{0}' | {1} -qmp stdio -vnc none "
+               "-machine none,accel=kvm:tcg".format(r"\n".join(lines),
+                                                    self.qemu_binary))
+        output = process.run(cmd, timeout=30, ignore_status=True, shell=True,
+                             verbose=False).stdout_text
+        replies = {}
+        for line in output.splitlines():
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(reply, dict) and reply.get("id") in commands:
+                replies[reply["id"]] = reply.get("return")
+        return replies
+
+    def probe(self):
+        """
+        Probe QEMU and the host.
+
+        :return: dict of the probed tables
+        """
+        logging.info("Probing the CPU capabilities of %s", self.qemu_binary)
+        cpu_help = {}
+        for option in CPU_HELP_OPTIONS:
+            result = process.run("%s -cpu '%s'" % (self.qemu_binary, option),
+                                 timeout=30, ignore_status=True, shell=True,
+                                 verbose=False)
+            cpu_help[option] = (result.stdout_text if result.exit_status == 0
+                                else None)
+        definitions = self._qmp(["query-cpu-definitions"]).get(
+            "query-cpu-definitions") or []
+        models, features = parse_cpu_map(self.cpu_map)
+        return {"key": self.key,
+                "qemu_binary": self.qemu_binary,
+                "cpu_help": cpu_help,
+                "definitions": dict(
+                    (model["name"], model.get("unavailable-features", []))
+                    for model in definitions),
+                "qemu_cpu_models": list(cpu.get_qemu_cpu_models(
+                    self.qemu_binary)),
+                "host_cpu_models": list(utils_misc.get_host_cpu_models()),
+                "host_flags": list(cpu.get_cpu_flags()),
+                "cpu_map_models": models,
+                "cpu_map_features": features}
+
+    def load(self):
+        """
+        Load the saved probe, probe and save it if there is none.
+
+        :return: dict of the probed tables
+        """
+        if self.data is not None:
+            return self.data
+        path = os.path.join(self.cache_dir, "%s.json" % self.key)
+        try:
+            with open(path) as cache_file:
+                self.data = json.load(cache_file)
+            logging.debug("Loaded the CPU capabilities from %s", path)
+            return self.data
+        except (IOError, OSError, ValueError):
+            pass
+        self.data = self.probe()
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Concurrent tests may probe at the same time, replace atomically
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(self.data, cache_file)
+        os.rename(tmp_path, path)
+        return self.data
+
+    def cpu_help(self, option="?"):
+        """
+        Output of 'qemu -cpu <option>'.
+
+        :return: the output, None if QEMU failed with this option
+        """
+        return self.load()["cpu_help"].get(option)
+
+    def qemu_cpu_models(self):
+        """CPU models of QEMU, as cpu.get_qemu_cpu_models() returns."""
+        return self.load()["qemu_cpu_models"]
+
+    def host_cpu_models(self):
+        """Models the host CPU can run, as utils_misc.get_host_cpu_models()."""
+        return self.load()["host_cpu_models"]
+
+    def host_flags(self):
+        """Flags of the host CPU."""
+        return self.load()["host_flags"]
+
+    def definitions(self):
+        """
+        CPU models reported by query-cpu-definitions.
+
+        :return: dict of model: list of features the host lacks to run it
+        """
+        return self.load()["definitions"]
+
+    def runnable_models(self):
+        """Models query-cpu-definitions reports no unavailable feature for."""
+        return [model for model, missing in self.definitions().items()
+                if not missing]
+
+    def best_model(self, default=None):
+        """
+        The first host CPU model known by QEMU, as
+        cpu.get_qemu_best_cpu_model() returns.
+        """
+        for model in self.host_cpu_models():
+            if model in self.qemu_cpu_models():
+                return model
+        return default
+
+    def cpu_map_models(self, arch="x86"):
+        """
+        Models defined in cpu_map.xml.
+
+        :return: dict of model: list of features
+        """
+        return self.load()["cpu_map_models"].get(arch, {})
+
+    def cpu_map_features(self):
+        """Features defined in cpu_map.xml."""
+        return self.load()["cpu_map_features"]
+
+
+def get_capabilities(params):
+    """
+    CPU capabilities of the QEMU binary of a test.
+
+    :param params: Dictionary with the test parameters, 'cpu_caps_cache_dir'
+                   overrides the directory of the saved probes
+    :return: CpuCapabilities object, loaded
+    """
+    qemu_binary = utils_misc.get_qemu_binary(params)
+    with _lock:
+        caps = CpuCapabilities(qemu_binary, params.get("cpu_caps_cache_dir"))
+        if caps.key not in _loaded:
+            caps.load()
+            _loaded[caps.key] = caps
+        return _loaded[caps.key]
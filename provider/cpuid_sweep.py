@@ -0,0 +1,382 @@
+"""
+Module for checking the CPUID data of many CPU models at once.
+
+Available classes:
+- CpuidSweep: Get the CPUID data of a list of (machine type, CPU model,
+              flags) combinations, either expanded through QMP on one
+              paused QEMU instance per machine type, or dumped by the
+              cpuid test kernel in several VMs booted at the same time.
+
+Available methods:
+- parse_cpuid_dump: Parse the output of the cpuid test kernel.
+- load_feature_bits: Read the CPUID bit of every feature in cpu_map.xml.
+- build_test_kernel: Build the cpuid test kernel unless it is up to date.
+- wait_for_serial: Wait for a string on the serial console of a VM, only
+                   searching the output received since the last check.
+
+CPUID data is a dict of (in_eax, in_ecx, register): value. QMP expansion
+only knows the feature bits listed in cpu_map.xml, so it also returns a
+dict of (in_eax, in_ecx, register): mask of the bits it knows, every other
+bit must be ignored when comparing.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+from xml.etree import ElementTree
+
+from avocado.utils import build
+
+from virttest import env_process
+from virttest import virt_vm
+
+from provider.vm_launcher import CREATE_LOCK
+
+END_MARKER = "==END TEST=="
+
+# QEMU names of the features cpu_map.xml names differently
+FEATURE_ALIASES = {"pni": "sse3", "pclmuldq": "pclmulqdq",
+                   "i64": "lm", "ffxsr": "fxsr-opt"}
+
+# QEMU start errors meaning the model can't run on this host
+UNSUPPORTED_ERRORS = ("host doesn't support requested feature:",
+                      "lacks requested flag", "flag restricted to guest",
+                      "Unable to find CPU definition:")
+
+_built = set()
+_build_lock = threading.Lock()
+
+
+def parse_cpuid_dump(output):
+    """
+    Parse a cpuid test kernel dump.
+
+    :param output: serial output or dump file content
+    :return: dict of (in_eax, in_ecx, register): value, None if the output
+             has no valid dump
+    """
+    cpuid_re = re.compile(
+        "^ *(0x[0-9a-f]+) +0x([0-9a-f]+): +eax=0x([0-9a-f]+) ebx=0x([0-9a-f]+) ecx=0x([0-9a-f]+) edx=0x([0-9a-f]+)$")
+    output_match = re.search('(==START TEST==.*==END TEST==)', output,
+                             re.M | re.DOTALL)
+    if output_match is None:
+        logging.debug("cpuid dump doesn't follow expected pattern")
+        return None
+    out_lines = output_match.group(1).splitlines()
+    if out_lines[0] != '==START TEST==' or out_lines[-1] != END_MARKER:
+        logging.debug("cpuid dump doesn't have expected delimiters")
+        return None
+    if out_lines[1] != 'CPU:':
+        logging.debug("cpuid dump doesn't start with 'CPU:' line")
+        return None
+    result = {}
+    for line in out_lines[2:-1]:
+        m = cpuid_re.match(line)
+        if m is None:
+            logging.debug("invalid cpuid dump line: %r", line)
+            return None
+        in_eax = int(m.group(1), 16)
+        in_ecx = int(m.group(2), 16)
+        for index, reg in enumerate(("eax", "ebx", "ecx", "edx")):
+            result[in_eax, in_ecx, reg] = int(m.group(3 + index), 16)
+    return result
+
+
+def _feature_name(name):
+    name = name.replace("_", "-").replace(".", "-")
+    return FEATURE_ALIASES.get(name, name)
+
+
+def load_feature_bits(cpu_map):
+    """
+    Read the CPUID bits of the features defined in a cpu_map.xml file.
+
+    :param cpu_map: path of cpu_map.xml
+    :return: dict of QEMU feature name: (in_eax, in_ecx, register, mask)
+    """
+    features = {}
+    root = ElementTree.parse(cpu_map).getroot()
+    for feature in root.iter("feature"):
+        cpuid = feature.find("cpuid")
+        if feature.get("name") is None or cpuid is None:
+            continue
+        for reg in ("eax", "ebx", "ecx", "edx"):
+            if cpuid.get(reg):
+                # Older files name the inputs function and index
+                in_eax = cpuid.get("eax_in", cpuid.get("function"))
+                in_ecx = cpuid.get("ecx_in", cpuid.get("index", "0"))
+                features[_feature_name(feature.get("name"))] = (
+                    int(in_eax, 16), int(in_ecx, 16), reg,
+                    int(cpuid.get(reg), 16))
+    return features
+
+
+def build_test_kernel(src_dir, target="cpuid_dump_kernel.bin"):
+    """
+    Build the cpuid test kernel once.
+
+    make is skipped if the kernel was built by this process already or is
+    newer than every source file.
+
+    :param src_dir: directory of the test kernel sources
+    :param target: make target
+    :return: path of the kernel
+    """
+    path = os.path.join(src_dir, target)
+    with _build_lock:
+        if path in _built:
+            return path
+        sources = [os.path.join(src_dir, name) for name in os.listdir(src_dir)
+                   if name != target]
+        newest = max([os.path.getmtime(source) for source in sources] or [0])
+        if not os.path.exists(path) or os.path.getmtime(path) < newest:
+            build.make(src_dir, extra_args=target)
+        _built.add(path)
+    return path
+
+
+def wait_for_serial(vm, pattern, timeout, step=0.1):
+    """
+    Wait for a string on the serial console of a VM.
+
+    Only the output received since the previous check is searched, and the
+    wait stops as soon as the QEMU process is gone.
+
+    :param vm: VM object
+    :param pattern: string to wait for
+    :param timeout: max seconds to wait
+    :param step: seconds between two checks
+    :return: the whole serial output, None on timeout
+    """
+    offset = 0
+    end_time = time.time() + timeout
+    while True:
+        output = vm.serial_console.get_output() or ""
+        if pattern in output[max(offset - len(pattern), 0):]:
+            return output
+        offset = len(output)
+        if time.time() > end_time or vm.is_dead():
+            return None
+        time.sleep(step)
+
+
+def parse_flags(flags):
+    """
+    Split -cpu flags into QOM properties.
+
+    :param flags: flags as in 'cpu_model_flags', e.g. ',+apic,-svm,level=7'
+    :return: dict of property: value, 'enforce' and 'check' are dropped
+    """
+    props = {}
+    for flag in (flags or "").split(","):
+        flag = flag.strip()
+        if not flag or flag in ("enforce", "check"):
+            continue
+        if flag[0] in "+-":
+            props[_feature_name(flag[1:])] = flag[0] == "+"
+        elif "=" in flag:
+            name, value = flag.split("=", 1)
+            if value in ("on", "off"):
+                value = value == "on"
+            elif value.isdigit():
+                value = int(value)
+            props[_feature_name(name)] = value
+        else:
+            props[_feature_name(flag)] = True
+    return props
+
+
+class CpuidSweep(object):
+
+    """
+    CPUID data of many CPU models with as few QEMU processes as possible.
+    """
+
+    def __init__(self, test, params, env, cpu_map=None, concurrency=None):
+        """
+        :param test: QEMU test object
+        :param params: Dictionary with the test parameters
+        :param env: Dictionary with test environment
+        :param cpu_map: path of cpu_map.xml, needed by expand()
+        :param concurrency: VMs running the test kernel at the same time,
+                            'cpuid_sweep_concurrency' (4) by default
+        """
+        self.test = test
+        self.params = params
+        self.env = env
+        self.concurrency = int(concurrency or
+                               params.get("cpuid_sweep_concurrency", 4))
+        self.timeout = float(params.get("login_timeout", 240))
+        self.features = load_feature_bits(cpu_map) if cpu_map else {}
+        self._instances = {}
+        self._definitions = {}
+        self._lock = threading.Lock()
+
+    def _vm_params(self, machine_type, cpu_model, flags, kernel=None):
+        params = self.params.copy()
+        params["machine_type"] = machine_type
+        params["cpu_model"] = cpu_model
+        params["cpu_model_flags"] = flags
+        params["smp"] = 1
+        params["images"] = ""
+        params["nics"] = ""
+        if kernel:
+            params["kernel"] = kernel
+        else:
+            params["monitor_type"] = "qmp"
+            params["paused_after_start_vm"] = "yes"
+        return params
+
+    def _create(self, name, params):
+        # Port and MAC address allocation are not thread safe, only the
+        # guests run in parallel
+        with CREATE_LOCK:
+            env_process.preprocess_vm(self.test, params, self.env, name)
+            vm = self.env.get_vm(name)
+            vm.create()
+        return vm
+
+    def _instance(self, machine_type):
+        """Paused QEMU instance of a machine type, started once."""
+        vm = self._instances.get(machine_type)
+        if vm is None or vm.is_dead():
+            name = "cpuid_qmp_%d" % len(self._instances)
+            logging.info("Starting a paused QEMU for machine type %s",
+                         machine_type)
+            vm = self._create(name, self._vm_params(
+                machine_type, self.params.get("cpu_model", "qemu64"), ""))
+            self._instances[machine_type] = vm
+        return vm
+
+    def definitions(self, machine_type):
+        """
+        CPU models QEMU knows with this machine type.
+
+        :return: dict of model name: list of features the host lacks to
+                 run it
+        """
+        if machine_type not in self._definitions:
+            vm = self._instance(machine_type)
+            self._definitions[machine_type] = dict(
+                (model["name"], model.get("unavailable-features", []))
+                for model in vm.monitor.cmd("query-cpu-definitions"))
+        return self._definitions[machine_type]
+
+    def runnable(self, machine_type, cpu_model, flags=""):
+        """
+        Check if a model can run with enforce on this host.
+
+        :return: tuple of (True or False, reason)
+        """
+        definitions = self.definitions(machine_type)
+        if cpu_model not in definitions:
+            return False, "Unable to find CPU definition: %s" % cpu_model
+        props = parse_flags(flags)
+        missing = [feature for feature in definitions[cpu_model]
+                   if props.get(_feature_name(feature)) is not False]
+        if missing:
+            return False, ("host doesn't support requested feature: %s"
+                           % " ".join(missing))
+        return True, ""
+
+    def expand(self, machine_type, cpu_model, flags=""):
+        """
+        Feature bits of a CPU model through query-cpu-model-expansion.
+
+        Like the feature-words and filtered-features QOM properties of a
+        running CPU, this is the set of features requested by the model
+        and the flags, before filtering by the host.
+
+        :return: tuple of (CPUID data, mask of the bits known)
+        """
+        vm = self._instance(machine_type)
+        model = {"name": cpu_model}
+        props = parse_flags(flags)
+        if props:
+            model["props"] = props
+        expansion = vm.monitor.cmd("query-cpu-model-expansion",
+                                   {"type": "full", "model": model})
+        cpuid = {}
+        masks = {}
+        for name, value in expansion["model"]["props"].items():
+            bit = self.features.get(_feature_name(name))
+            if bit is None or not isinstance(value, bool):
+                continue
+            key = bit[:3]
+            masks[key] = masks.get(key, 0) | bit[3]
+            cpuid[key] = cpuid.get(key, 0) | (bit[3] if value else 0)
+        return cpuid, masks
+
+    def _run_kernel(self, name, kernel, job):
+        machine_type, cpu_model, flags = job
+        result = {"machine_type": machine_type, "cpu_model": cpu_model,
+                  "flags": flags, "cpuid": None, "error": None,
+                  "skipped": False}
+        begin = time.time()
+        vm = None
+        try:
+            vm = self._create(name, self._vm_params(machine_type, cpu_model,
+                                                    flags, kernel))
+            vm.resume()
+            output = wait_for_serial(vm, END_MARKER, self.timeout)
+            if output is None:
+                result["error"] = "Could not get test complete message"
+            else:
+                result["cpuid"] = parse_cpuid_dump(output)
+                if result["cpuid"] is None:
+                    result["error"] = "Test output signature not found"
+        except (virt_vm.VMStartError, virt_vm.VMCreateError) as details:
+            result["error"] = str(details)
+            result["skipped"] = any(error in str(details)
+                                    for error in UNSUPPORTED_ERRORS)
+        except Exception as details:
+            result["error"] = str(details)
+        finally:
+            if vm:
+                vm.destroy(gracefully=False)
+        result["seconds"] = time.time() - begin
+        logging.debug("%s %s%s: %.1fs%s", machine_type, cpu_model,
+                      flags or "", result["seconds"],
+                      ", %s" % result["error"] if result["error"] else "")
+        return result
+
+    def run_kernel(self, kernel, jobs):
+        """
+        Dump the CPUID data with the test kernel, 'concurrency' VMs at a
+        time.
+
+        :param kernel: path of the cpuid test kernel
+        :param jobs: list of (machine type, cpu model, flags)
+        :return: list of dicts with 'machine_type', 'cpu_model', 'flags',
+                 'cpuid', 'error', 'skipped' and 'seconds', in the order of
+                 the jobs
+        """
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        pending = list(enumerate(jobs))
+
+        def _worker(name):
+            while True:
+                with self._lock:
+                    if not pending:
+                        return
+                    index, job = pending.pop(0)
+                results[index] = self._run_kernel(name, kernel, job)
+
+        workers = [threading.Thread(target=_worker,
+                                    args=("cpuid_kernel_%d" % index,))
+                   for index in range(min(self.concurrency, len(jobs)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def close(self):
+        """Stop the paused QEMU instances."""
+        for vm in self._instances.values():
+            vm.destroy(gracefully=False)
+        self._instances = {}
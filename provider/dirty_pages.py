@@ -0,0 +1,139 @@
+"""
+Module for running the deterministic guest memory dirtier.
+
+Available classes:
+- DirtyPageWorkload: Deploy qemu/deps/migration/dirty_pages.py to a Linux
+                     guest, run it in the background and read its achieved
+                     dirty rate.
+
+The workload is configured with the params below, every one optional:
+
+- dirty_size: working set in MB (512)
+- dirty_rate: dirty rate in MB/s, 0 for as fast as possible (0)
+- dirty_pattern: sequential, random or hotcold (sequential)
+- dirty_hot_ratio, dirty_hot_weight: hot/cold split (0.1, 0.9)
+- dirty_compressibility: zero filled part of every page (0.5)
+- dirty_seed: seed of the page order (0)
+- dirty_pages_dir: guest directory of the script and its log (/var/tmp)
+"""
+
+import json
+import logging
+import os
+
+from virttest import data_dir
+from virttest import utils_misc
+
+from provider.session_pool import guest_session
+from provider.session_pool import pooled
+
+SCRIPT = "dirty_pages.py"
+OPTIONS = (("dirty_size", "--size", "512"),
+           ("dirty_rate", "--rate", "0"),
+           ("dirty_pattern", "--pattern", "sequential"),
+           ("dirty_hot_ratio", "--hot-ratio", "0.1"),
+           ("dirty_hot_weight", "--hot-weight", "0.9"),
+           ("dirty_compressibility", "--compressibility", "0.5"),
+           ("dirty_seed", "--seed", "0"))
+
+
+class DirtyPageWorkload(object):
+
+    """
+    Background memory dirtier of one guest.
+    """
+
+    def __init__(self, vm, params, tag="dirty_pages"):
+        """
+        :param vm: VM object
+        :param params: Dictionary with the workload params
+        :param tag: name of the guest log file
+        """
+        self.vm = vm
+        self.params = params
+        self.guest_dir = params.get("dirty_pages_dir", "/var/tmp")
+        self.script = "%s/%s" % (self.guest_dir, SCRIPT)
+        self.log = "%s/%s.log" % (self.guest_dir, tag)
+        self.python = params.get("python_bin",
+                                 "`command -v python3 python | head -1`")
+        self.timeout = int(params.get("login_timeout", 360))
+        self.info = None
+
+    @property
+    def options(self):
+        """Command line options of the dirtier"""
+        return " ".join("%s %s" % (option, self.params.get(key, default))
+                        for key, option, default in OPTIONS)
+
+    def _lines(self, session, prefix):
+        output = session.cmd_output("grep '^%s' %s" % (prefix, self.log))
+        return [json.loads(line[len(prefix):].strip())
+                for line in output.splitlines() if line.startswith(prefix)]
+
+    def deploy(self):
+        """Copy the dirtier into the guest."""
+        self.vm.copy_files_to(os.path.join(
+            data_dir.get_deps_dir("migration"), SCRIPT), self.guest_dir)
+
+    def command(self):
+        """Foreground command of the dirtier, it runs until killed"""
+        return "%s %s %s" % (self.python, self.script, self.options)
+
+    @pooled
+    def start(self, vm=None, timeout=300):
+        """
+        Copy the dirtier into the guest and start it in the background.
+
+        :param vm: VM to run in, e.g. after a migration, self.vm by default
+        :param timeout: seconds to wait for the working set to be touched
+        :return: the READY info, with the pid and number of pages
+        """
+        self.vm = vm or self.vm
+        self.deploy()
+        cmd = "nohup %s > %s 2>&1 &" % (self.command(), self.log)
+        logging.info("Start memory dirtier in %s: %s", self.vm.name, cmd)
+        with guest_session(self.vm, self.timeout) as session:
+            session.cmd(cmd)
+            ready = utils_misc.wait_for(
+                lambda: self._lines(session, "READY"), timeout, step=2)
+            if not ready:
+                raise RuntimeError("Memory dirtier did not get ready: %s" %
+                                   session.cmd_output("cat %s" % self.log))
+        self.info = ready[0]
+        return self.info
+
+    @pooled
+    def rates(self, vm=None):
+        """
+        Get the achieved dirty rates so far.
+
+        :param vm: VM the dirtier runs in, self.vm by default
+        :return: list of RATE reports, each with 'seconds', 'mb', 'mbps'
+        """
+        self.vm = vm or self.vm
+        with guest_session(self.vm, self.timeout) as session:
+            return self._lines(session, "RATE:")
+
+    @pooled
+    def stop(self, vm=None, timeout=30):
+        """
+        Stop the dirtier and get its overall result.
+
+        :param vm: VM the dirtier runs in, self.vm by default
+        :param timeout: seconds to wait for the final report
+        :return: the RESULT report, None if the dirtier was not running
+        """
+        self.vm = vm or self.vm
+        if not self.info:
+            return None
+        with guest_session(self.vm, self.timeout) as session:
+            session.cmd_output("kill -TERM %s" % self.info["pid"])
+            result = utils_misc.wait_for(
+                lambda: self._lines(session, "RESULT:"), timeout, step=1)
+        self.info = None
+        if not result:
+            logging.warning("Memory dirtier gave no result")
+            return None
+        logging.info("Memory dirtier achieved %s MB/s (target %s MB/s)",
+                     result[0]["mbps"], result[0]["target_mbps"])
+        return result[0]
@@ -0,0 +1,160 @@
+"""
+Module for timing guest filesystem freezes.
+
+Available classes:
+- FreezeProfiler: Freeze and thaw guest filesystems through the guest agent
+                  while a guest write workload runs, timing the freeze, the
+                  frozen window, an optional action run while frozen (e.g.
+                  a live snapshot or a backup) and the thaw, and the write
+                  stall the workload saw.
+
+The workload is one shell loop per mountpoint doing small synchronous
+writes and logging the guest time each write completes at, the stall of a
+freeze is the longest gap between two writes around it. Guest and host
+times are aligned with the offset measured when the workload starts.
+"""
+
+import logging
+import time
+
+from virttest import guest_agent
+
+WORKLOAD = ("(while [ ! -e {stop} ]; do dd if=/dev/zero of={probe} bs={bs} "
+            "count=1 oflag=dsync conv=notrunc 2>/dev/null; date +%s.%N; "
+            "done) > {log} 2>&1 &")
+
+
+class FreezeProfiler(object):
+
+    """
+    Freeze/thaw timing with a guest write workload.
+    """
+
+    def __init__(self, agent, session, log_dir="/dev/shm", block_size="4k",
+                 timeout=300):
+        """
+        :param agent: QemuAgent object
+        :param session: guest shell session, linux only
+        :param log_dir: guest directory for the workload logs, must not be
+                        frozen
+        :param block_size: bytes per workload write
+        :param timeout: timeout of the guest commands
+        """
+        self.agent = agent
+        self.session = session
+        self.log_dir = log_dir
+        self.block_size = block_size
+        self.timeout = timeout
+        self.records = []
+        self.mountpoints = []
+        self._offset = 0.0
+        self._writes = {}
+
+    def _log(self, index):
+        return "%s/fsfreeze_probe_%d.log" % (self.log_dir, index)
+
+    def _guest_time(self):
+        begin = time.time()
+        guest = float(self.session.cmd_output("date +%s.%N").strip())
+        return guest - (begin + time.time()) / 2
+
+    def start_workload(self, mountpoints):
+        """
+        Start one write loop per mountpoint.
+
+        :param mountpoints: guest mountpoints to write to
+        """
+        self.mountpoints = list(mountpoints)
+        self._writes = {}
+        self.session.cmd("rm -f %s/fsfreeze_probe_stop" % self.log_dir)
+        for index, mountpoint in enumerate(self.mountpoints):
+            probe = "%s/.fsfreeze_probe" % mountpoint.rstrip("/")
+            self.session.cmd(WORKLOAD.format(
+                stop="%s/fsfreeze_probe_stop" % self.log_dir, probe=probe,
+                bs=self.block_size, log=self._log(index)))
+        self._offset = self._guest_time()
+        logging.info("Started the write workload on %s, guest clock offset "
+                     "%.3fs", " ".join(self.mountpoints), self._offset)
+
+    def stop_workload(self):
+        """
+        Stop the write loops and collect the write completion times.
+
+        :return: dict of mountpoint: list of host times
+        """
+        self.session.cmd("touch %s/fsfreeze_probe_stop; sleep 1"
+                         % self.log_dir)
+        for index, mountpoint in enumerate(self.mountpoints):
+            log = self._log(index)
+            output = self.session.cmd_output(
+                "cat %s; rm -f %s %s/.fsfreeze_probe"
+                % (log, log, mountpoint.rstrip("/")), timeout=self.timeout)
+            times = []
+            for line in output.splitlines():
+                try:
+                    times.append(float(line) - self._offset)
+                except ValueError:
+                    continue
+            self._writes[mountpoint] = times
+        for record in self.records:
+            record["stall_ms"] = self._stalls(record)
+        return self._writes
+
+    def _stalls(self, record):
+        stalls = {}
+        for mountpoint, times in self._writes.items():
+            if record["mountpoints"] and mountpoint not in record[
+                    "mountpoints"]:
+                continue
+            # Gaps between two writes overlapping the freeze
+            gaps = [b - a for a, b in zip(times, times[1:])
+                    if b >= record["start"] and a <= record["end"]]
+            stalls[mountpoint] = max(gaps) * 1000 if gaps else None
+        return stalls
+
+    def profile(self, mountpoints=None, action=None, name=None):
+        """
+        Freeze, run an action, thaw, and time every step.
+
+        :param mountpoints: mountpoints to freeze with
+                            guest-fsfreeze-freeze-list, all if None
+        :param action: callable to run while frozen, e.g. taking a snapshot
+        :param name: name of the record
+        :return: dict with 'freeze_ms', 'action_ms', 'frozen_ms' (freeze
+                 done to thaw done), 'thaw_ms', 'total_ms' and the number
+                 of 'frozen' filesystems, 'stall_ms' is filled in by
+                 stop_workload()
+        """
+        record = {"name": name or " ".join(mountpoints or ["all"]),
+                  "mountpoints": mountpoints, "action": bool(action)}
+        start = time.time()
+        if mountpoints:
+            frozen = self.agent.cmd("guest-fsfreeze-freeze-list",
+                                    {"mountpoints": mountpoints})
+        else:
+            frozen = self.agent.cmd("guest-fsfreeze-freeze")
+        frozen_at = time.time()
+        try:
+            if action:
+                action()
+        finally:
+            thaw_at = time.time()
+            try:
+                self.agent.cmd("guest-fsfreeze-thaw")
+            except guest_agent.VAgentCmdError as detail:
+                logging.error("Failed to thaw %s: %s", record["name"],
+                              detail)
+                raise
+        end = time.time()
+        record.update({"start": start, "end": end, "frozen": frozen,
+                       "freeze_ms": (frozen_at - start) * 1000,
+                       "action_ms": (thaw_at - frozen_at) * 1000,
+                       "thaw_ms": (end - thaw_at) * 1000,
+                       "frozen_ms": (end - frozen_at) * 1000,
+                       "total_ms": (end - start) * 1000})
+        self.records.append(record)
+        logging.info("%s: freeze %.1fms, action %.1fms, thaw %.1fms, frozen "
+                     "for %.1fms", record["name"], record["freeze_ms"],
+                     record["action_ms"], record["thaw_ms"],
+                     record["frozen_ms"])
+        return record
@@ -0,0 +1,254 @@
+"""
+Module for running guest commands through the guest agent.
+
+Available classes:
+- GuestExecFuture: A guest command started with guest-exec, completed
+                   in the background.
+- GuestExecRunner: Run many guest commands at once with guest-exec, poll
+                   all of them with one pipelined round of guest-exec-status
+                   at an adaptive interval and decode the output of every
+                   command as soon as it exits.
+
+No login session is needed, so providers can run guest commands in
+parallel through the agent only. The agent returns the captured output of
+a command when it exits, so output is delivered per command and not line
+by line.
+"""
+
+import base64
+import logging
+import threading
+import time
+
+from provider.qga_pipeline import pipeline
+
+
+class GuestExecError(Exception):
+    pass
+
+
+class GuestExecFuture(object):
+
+    """
+    Handle of a guest command.
+    """
+
+    def __init__(self, cmd, timeout):
+        """
+        :param cmd: command line
+        :param timeout: seconds before the command is considered hung
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.pid = None
+        self.start = None
+        self._result = None
+        self._error = None
+        self._event = threading.Event()
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def add_done_callback(self, callback):
+        """
+        Call a function with this future once the command exited, at once
+        if it already did.
+        """
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._event.set()
+        for callback in self._callbacks:
+            try:
+                callback(self)
+            except Exception as details:
+                logging.error("Callback of '%s' failed: %s", self.cmd,
+                              details)
+
+    def result(self, timeout=None):
+        """
+        Wait for the command to exit.
+
+        :param timeout: max seconds to wait
+        :return: dict with 'exitcode', 'signal', 'out', 'err',
+                 'out_truncated', 'err_truncated' and 'elapsed'
+        """
+        if not self._event.wait(timeout):
+            raise GuestExecError("'%s' is still running after %ss" %
+                                 (self.cmd, timeout))
+        if self._error:
+            raise self._error
+        return self._result
+
+    def status_output(self, timeout=None):
+        """
+        Wait for the command to exit.
+
+        :return: tuple of (exit code, stdout + stderr), as
+                 session.cmd_status_output() does
+        """
+        result = self.result(timeout)
+        return result["exitcode"], result["out"] + result["err"]
+
+
+class GuestExecRunner(object):
+
+    """
+    Concurrent guest-exec commands with one poller thread.
+    """
+
+    def __init__(self, agent, os_type="linux", max_running=16,
+                 min_interval=0.05, max_interval=2.0, timeout=600):
+        """
+        :param agent: QemuAgent object
+        :param os_type: 'linux' or 'windows', picks the shell
+        :param max_running: max number of commands running in the guest,
+                            later ones are queued
+        :param min_interval: first poll interval in seconds
+        :param max_interval: the poll interval doubles up to this value
+                             while no command exits
+        :param timeout: default timeout of a command
+        """
+        self.agent = agent
+        self.os_type = os_type
+        self.max_running = max_running
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self._queue = []
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _shell(self, cmd):
+        if self.os_type == "windows":
+            return "cmd.exe", ["/c", cmd]
+        return "/bin/sh", ["-c", cmd]
+
+    def _launch(self, future):
+        path, args = self._shell(future.cmd)
+        try:
+            ret = self.agent.guest_exec(path=path, arg=args,
+                                        capture_output=True)
+        except Exception as details:
+            future._finish(error=GuestExecError("Failed to start '%s': %s" %
+                                                (future.cmd, details)))
+            return
+        future.pid = ret["pid"]
+        future.start = time.time()
+        self._running[future.pid] = future
+
+    def _decode(self, status, key):
+        data = status.get("%s-data" % key)
+        return base64.b64decode(data).decode(errors="replace") if data else ""
+
+    def _poll(self):
+        """One round of guest-exec-status for every running command."""
+        finished = []
+
+        def _requests():
+            for pid in list(self._running):
+                yield "guest-exec-status", {"pid": pid}, pid
+
+        def _on_status(pid, status):
+            future = self._running[pid]
+            if status["exited"]:
+                finished.append(pid)
+                future._finish({
+                    "exitcode": status.get("exitcode"),
+                    "signal": status.get("signal"),
+                    "out": self._decode(status, "out"),
+                    "err": self._decode(status, "err"),
+                    "out_truncated": status.get("out-truncated", False),
+                    "err_truncated": status.get("err-truncated", False),
+                    "elapsed": time.time() - future.start})
+            elif time.time() - future.start > future.timeout:
+                finished.append(pid)
+                future._finish(error=GuestExecError(
+                    "'%s' (pid %s) did not exit within %ss" %
+                    (future.cmd, pid, future.timeout)))
+
+        pipeline(self.agent, _requests(), _on_status,
+                 depth=len(self._running) or 1)
+        for pid in finished:
+            del self._running[pid]
+        return len(finished)
+
+    def _loop(self):
+        interval = self.min_interval
+        while True:
+            with self._lock:
+                while self._queue and len(self._running) < self.max_running:
+                    self._launch(self._queue.pop(0))
+                if not self._running and not self._queue:
+                    self._thread = None
+                    return
+            try:
+                exited = self._poll()
+            except Exception as details:
+                logging.error("Failed to poll guest commands: %s", details)
+                with self._lock:
+                    for future in self._running.values():
+                        future._finish(error=GuestExecError(str(details)))
+                    self._running = {}
+                continue
+            # Poll fast while commands exit, back off while they run
+            if exited:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+    def submit(self, cmd, timeout=None):
+        """
+        Start a guest shell command.
+
+        :param cmd: command line, run by /bin/sh -c or cmd.exe /c
+        :param timeout: seconds before the command is considered hung
+        :return: GuestExecFuture object
+        """
+        future = GuestExecFuture(cmd, timeout or self.timeout)
+        with self._lock:
+            self._queue.append(future)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+        # Start it at once instead of waiting for the current interval
+        self._wakeup.set()
+        return future
+
+    def map(self, cmds, timeout=None):
+        """
+        Run commands concurrently and wait for all of them.
+
+        :param cmds: list of command lines
+        :param timeout: timeout of every command
+        :return: list of results, see GuestExecFuture.result()
+        """
+        futures = [self.submit(cmd, timeout) for cmd in cmds]
+        return [future.result() for future in futures]
+
+    def cmd_status_output(self, cmd, timeout=None):
+        """Run a command and return (exit code, output)."""
+        return self.submit(cmd, timeout).status_output()
+
+    def cmd(self, cmd, timeout=None):
+        """
+        Run a command, raise GuestExecError if it fails.
+
+        :return: the command output
+        """
+        status, output = self.cmd_status_output(cmd, timeout)
+        if status != 0:
+            raise GuestExecError("'%s' failed with status %s: %s" %
+                                 (cmd, status, output))
+        return output
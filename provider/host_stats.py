@@ -0,0 +1,209 @@
+"""
+Module for reading host resource accounting straight from procfs.
+
+Available classes:
+- CpuSnapshot: Host and per-process CPU time taken at one point, the
+               difference of two snapshots gives the CPU cost of a window.
+- Sampler: Base of the samplers taking a sample from a thread at a fixed
+           interval, subclasses implement sample().
+
+Available methods:
+- host_cpu_times: Get busy and total CPU seconds of the host.
+- process_cpu_time: Get user+system CPU seconds of a process.
+- process_memory: Get the resident memory of a process in MB.
+- host_memory: Get the total, available and free memory of the host in MB.
+"""
+
+import os
+import threading
+
+from virttest import utils_misc
+
+CLK_TCK = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+
+
+def host_cpu_times():
+    """
+    Get the busy and total CPU seconds of the host from /proc/stat.
+
+    :return: tuple of (busy seconds, total seconds) summed over all cpus
+    """
+    with open("/proc/stat") as stat:
+        fields = [int(f) for f in stat.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal guest guest_nice,
+    # guest time is already accounted in user/nice.
+    total = sum(fields[:8])
+    idle = fields[3] + fields[4]
+    return float(total - idle) / CLK_TCK, float(total) / CLK_TCK
+
+
+def process_cpu_time(pid):
+    """
+    Get the user+system CPU seconds of a process, all threads included.
+
+    :param pid: process id
+    :return: CPU seconds, 0 if the process is gone
+    """
+    try:
+        with open("/proc/%s/stat" % pid) as stat:
+            # The command name may contain spaces, split after it.
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except (IOError, OSError):
+        return 0.0
+    return float(int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def host_memory():
+    """
+    Get the memory of the host from /proc/meminfo.
+
+    :return: dict of MB values: 'total', 'available', 'free', 'hugepages'
+             (total huge pages) and 'hugepages_free'
+    """
+    keys = {"MemTotal": "total", "MemAvailable": "available",
+            "MemFree": "free"}
+    memory = {}
+    huge = {}
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            fields = line.split()
+            key = fields[0].rstrip(":")
+            if key in keys:
+                memory[keys[key]] = int(fields[1]) / 1024.0
+            elif key in ("HugePages_Total", "HugePages_Free", "Hugepagesize"):
+                huge[key] = int(fields[1])
+    if huge:
+        page_mb = huge.get("Hugepagesize", 0) / 1024.0
+        memory["hugepages"] = huge.get("HugePages_Total", 0) * page_mb
+        memory["hugepages_free"] = huge.get("HugePages_Free", 0) * page_mb
+    return memory
+
+
+def process_memory(pid):
+    """
+    Get the resident memory of a process from /proc/<pid>/status and, when
+    the kernel has it, /proc/<pid>/smaps_rollup.
+
+    :param pid: process id
+    :return: dict of MB values: 'rss', 'rss_anon', 'rss_file', 'rss_shmem'
+             and 'swap' from status, 'pss', 'anon_huge' and 'swap_pss' from
+             smaps_rollup, empty if the process is gone
+    """
+    keys = {"VmRSS": "rss", "RssAnon": "rss_anon", "RssFile": "rss_file",
+            "RssShmem": "rss_shmem", "VmSwap": "swap", "Pss": "pss",
+            "AnonHugePages": "anon_huge", "SwapPss": "swap_pss"}
+    memory = {}
+    for name in ("status", "smaps_rollup"):
+        try:
+            with open("/proc/%s/%s" % (pid, name)) as proc_file:
+                lines = proc_file.readlines()
+        except (IOError, OSError):
+            continue
+        for line in lines:
+            fields = line.split()
+            key = fields[0].rstrip(":") if fields else None
+            if key in keys and len(fields) == 3 and fields[2] == "kB":
+                memory.setdefault(keys[key], int(fields[1]) / 1024.0)
+    return memory
+
+
+class CpuSnapshot(object):
+
+    """
+    CPU time of the host and of some processes at one point.
+    """
+
+    def __init__(self, pids=()):
+        """
+        :param pids: processes to account, e.g. the QEMU pids
+        """
+        self.busy, self.total = host_cpu_times()
+        self.processes = dict((pid, process_cpu_time(pid)) for pid in pids)
+
+    def __sub__(self, other):
+        """
+        CPU seconds spent between two snapshots.
+
+        :return: dict with 'host_busy', 'host_total' and 'processes'
+        """
+        return {"host_busy": self.busy - other.busy,
+                "host_total": self.total - other.total,
+                "processes": sum(self.processes.get(pid, 0.0) - cpu
+                                 for pid, cpu in other.processes.items())}
+
+
+class Sampler(object):
+
+    """
+    Time series taken from a thread at a fixed interval.
+
+    Subclasses implement sample(), which reads one sample, stamps it with
+    elapsed() and appends it to self.samples under self._lock.
+    """
+
+    #: Take a last sample when stopped
+    final_sample = True
+
+    def __init__(self, interval=1.0):
+        """
+        :param interval: seconds between two samples
+        """
+        self.interval = float(interval)
+        self.samples = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def elapsed(self):
+        """Seconds since the first sample or the start of the sampling."""
+        now = utils_misc.monotonic_time()
+        if self._start is None:
+            self._start = now
+        return round(now - self._start, 6)
+
+    def sample(self):
+        """Take one sample and append it to the time series."""
+        raise NotImplementedError
+
+    def poll(self):
+        """
+        Take one sample from the sampler thread.
+
+        :return: False to end the sampling
+        """
+        self.sample()
+        return True
+
+    def _loop(self):
+        deadline = utils_misc.monotonic_time()
+        while not self._stop_event.is_set():
+            if not self.poll():
+                break
+            deadline += self.interval
+            self._stop_event.wait(max(0, deadline -
+                                      utils_misc.monotonic_time()))
+
+    def start(self):
+        """Start sampling in the background."""
+        self.elapsed()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampler thread, then take a last
+        sample if final_sample is set.
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self.interval * 2 + 10)
+            self._thread = None
+        if self.final_sample:
+            self.sample()
+
+    def is_running(self):
+        """Check whether the sampler thread is still alive."""
+        return bool(self._thread and self._thread.is_alive())
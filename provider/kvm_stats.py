@@ -0,0 +1,255 @@
+"""
+Module for collecting the KVM statistics of a VM.
+
+Available classes:
+- KvmStats: Read every per-VM and per-vCPU KVM counter of a VM in one pass,
+            through the KVM binary stats interface exposed by QMP
+            query-stats when QEMU supports it, or through debugfs, and
+            sample them at an interval into a counter matrix.
+
+Available methods:
+- read_debugfs: Read every counter of a KVM debugfs directory in one pass.
+- parse_debugfs: Parse 'grep -H . <dir>/*' output, e.g. from a remote host.
+- exit_reasons: Pick the exit counters of a dict of counters.
+
+Counter names are '<stat>' for VM wide values (the sum over the vCPUs for
+vCPU stats) and 'vcpu<N>.<stat>' for the per vCPU values.
+"""
+
+import glob
+import json
+import logging
+import os
+
+from provider.host_stats import Sampler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEBUGFS = "/sys/kernel/debug/kvm"
+
+
+def _read(path):
+    try:
+        with open(path) as stat_file:
+            return stat_file.read()
+    except (IOError, OSError):
+        return ""
+
+
+def parse_debugfs(output):
+    """
+    Parse the output of 'grep -H . <debugfs dir>/*'.
+
+    :param output: lines of 'path:value'
+    :return: dict of stat name: value
+    """
+    stats = {}
+    for line in output.splitlines():
+        path, _, value = line.rpartition(":")
+        if value.strip().isdigit():
+            stats[os.path.basename(path)] = int(value)
+    return stats
+
+
+def read_debugfs(directory=DEBUGFS):
+    """
+    Read every counter of a KVM debugfs directory, with its vcpu<N>
+    subdirectories.
+
+    :param directory: the global KVM directory (all VMs) or a per VM one
+    :return: dict of counter name: value
+    """
+    stats = {}
+    for path in glob.glob(os.path.join(directory, "*")):
+        name = os.path.basename(path)
+        if os.path.isdir(path):
+            if name.startswith("vcpu"):
+                for stat, value in read_debugfs(path).items():
+                    stats["%s.%s" % (name, stat)] = value
+            continue
+        value = _read(path).strip()
+        if value.isdigit():
+            stats[name] = int(value)
+    return stats
+
+
+def exit_reasons(stats):
+    """
+    Pick the VM wide exit counters.
+
+    :param stats: dict of counter name: value
+    :return: dict of exit reason ('exits' for the total): value
+    """
+    return dict((name, value) for name, value in stats.items()
+                if "." not in name and name.endswith("exits"))
+
+
+class KvmStats(Sampler):
+
+    """
+    Time series of the KVM counters of one VM.
+    """
+
+    def __init__(self, vm, interval=1.0, source=None):
+        """
+        :param vm: VM object
+        :param interval: seconds between two samples
+        :param source: 'qmp' or 'debugfs', the first one that works if None
+        """
+        super(KvmStats, self).__init__(interval)
+        self.vm = vm
+        self.source = source
+        self.names = []
+        self.times = []
+        self.rows = []
+        self.marks = {}
+
+    def _read_qmp(self):
+        stats = {}
+        vcpu = 0
+        for result in self.vm.monitor.cmd("query-stats", {
+                "target": "vm"}) + self.vm.monitor.cmd("query-stats", {
+                "target": "vcpu"}):
+            if result.get("provider") != "kvm":
+                continue
+            prefix = ""
+            if result["target"] == "vcpu":
+                prefix = "vcpu%d." % vcpu
+                vcpu += 1
+            for stat in result["stats"]:
+                # Histograms are lists, only keep the counters
+                if not isinstance(stat["value"], int):
+                    continue
+                stats[prefix + stat["name"]] = stat["value"]
+                if prefix:
+                    stats[stat["name"]] = (stats.get(stat["name"], 0) +
+                                           stat["value"])
+        return stats
+
+    def _read_debugfs(self):
+        # Per VM directories are named <qemu pid>-<vm fd>
+        dirs = glob.glob(os.path.join(DEBUGFS, "%s-*" % self.vm.get_pid()))
+        if not dirs:
+            logging.warning("No KVM debugfs directory for %s, reading the "
+                            "host wide counters", self.vm.name)
+        return read_debugfs(dirs[0] if dirs else DEBUGFS)
+
+    def read(self):
+        """
+        Read every counter once.
+
+        :return: dict of counter name: value
+        """
+        if self.source is None:
+            try:
+                stats = self._read_qmp()
+            except Exception as details:
+                logging.debug("query-stats is not usable: %s", details)
+                stats = None
+            self.source = "qmp" if stats else "debugfs"
+            if stats:
+                return stats
+        if self.source == "qmp":
+            return self._read_qmp()
+        return self._read_debugfs()
+
+    def sample(self):
+        """
+        Take one sample and append it to the counter matrix.
+
+        :return: dict of counter name: value
+        """
+        stats = self.read()
+        t = self.elapsed()
+        with self._lock:
+            if not self.names:
+                self.names = sorted(stats)
+            self.times.append(t)
+            self.rows.append([stats.get(name) for name in self.names])
+        return stats
+
+    def mark(self, name):
+        """
+        Take a sample and name it, e.g. the start or end of a test window.
+
+        :param name: mark name
+        """
+        self.sample()
+        with self._lock:
+            self.marks[name] = len(self.rows) - 1
+
+    def array(self):
+        """
+        Get the counter matrix, one row per sample and one column per name
+        in self.names.
+
+        :return: numpy array when numpy is available, else list of rows
+        """
+        with self._lock:
+            rows = [list(row) for row in self.rows]
+        if numpy is not None:
+            return numpy.array(rows, dtype=float)
+        return rows
+
+    def _index(self, point):
+        if isinstance(point, int):
+            return point
+        return self.marks[point]
+
+    def delta(self, begin=0, end=-1):
+        """
+        Get the growth of every counter between two samples.
+
+        :param begin: sample index or mark name
+        :param end: sample index or mark name
+        :return: dict of counter name: delta
+        """
+        with self._lock:
+            first = self.rows[self._index(begin)]
+            last = self.rows[self._index(end)]
+        return dict((name, b - a) for name, a, b in zip(self.names, first,
+                                                        last)
+                    if a is not None and b is not None)
+
+    def exits(self, begin=0, end=-1):
+        """
+        Get the VM wide exits by reason between two samples.
+
+        :return: dict of reason: count, 'exits' is the total
+        """
+        return exit_reasons(self.delta(begin, end))
+
+    def rates(self, counter):
+        """
+        Get the per second rate of one counter over time.
+
+        :param counter: counter name, e.g. 'exits' or 'vcpu0.halt_exits'
+        :return: list of (t, rate)
+        """
+        with self._lock:
+            column = self.names.index(counter)
+            points = [(t, row[column])
+                      for t, row in zip(self.times, self.rows)]
+        pairs = zip(points, points[1:])
+        return [(t, (v - pv) / (t - pt)) for (pt, pv), (t, v) in pairs
+                if t > pt and v is not None and pv is not None]
+
+    def save(self, result_dir, tag):
+        """
+        Write the samples as JSON.
+
+        :param result_dir: directory to store the file
+        :param tag: file name suffix
+        :return: path of the file
+        """
+        path = os.path.join(result_dir, "kvm_stats_%s.json" % tag)
+        with self._lock:
+            data = {"source": self.source, "names": self.names,
+                    "times": self.times, "rows": self.rows,
+                    "marks": self.marks}
+        with open(path, "w") as stats_file:
+            json.dump(data, stats_file)
+        return path
@@ -0,0 +1,69 @@
+"""
+Module for summarizing latency samples.
+
+Available methods:
+- percentile: Get a percentile of a list of samples.
+- histogram: Count samples into buckets.
+- summarize: Get count, mean, percentiles and histogram of a list of samples.
+"""
+
+import math
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(values, pct):
+    """
+    Get a percentile with the nearest rank method.
+
+    :param values: list of samples
+    :param pct: percentile, from 0 to 100
+    :return: the sample at that rank, None without samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def histogram(values, edges):
+    """
+    Count samples into buckets.
+
+    :param values: list of samples
+    :param edges: ascending upper bounds of the buckets, samples above the
+                  last one go to an overflow bucket
+    :return: list of (upper bound, count), the overflow bound is None
+    """
+    counts = [0] * (len(edges) + 1)
+    for value in values:
+        for i, edge in enumerate(edges):
+            if value <= edge:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return list(zip(list(edges) + [None], counts))
+
+
+def summarize(values, edges=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summarize a list of latency samples.
+
+    :param values: list of samples
+    :param edges: bucket bounds for the histogram, no histogram if None
+    :param percentiles: percentiles to report
+    :return: dict with 'count', 'min', 'mean', 'max', 'p<N>' and
+             'histogram'
+    """
+    result = {"count": len(values)}
+    if values:
+        result.update({"min": min(values), "max": max(values),
+                       "mean": sum(values) / float(len(values))})
+    for pct in percentiles:
+        result["p%s" % ("%g" % pct).replace(".", "_")] = percentile(values,
+                                                                    pct)
+    if edges:
+        result["histogram"] = histogram(values, edges)
+    return result
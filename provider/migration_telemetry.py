@@ -0,0 +1,273 @@
+"""
+Module for sampling the progress of a live migration.
+
+Available classes:
+- MigrationTelemetry: Poll 'info migrate' (query-migrate on QMP) of the
+                      source VM from a thread at a fixed interval and keep
+                      the samples as a time series, with derived transfer
+                      speed, convergence rate and predicted completion.
+
+Available methods:
+- parse_migrate_info: Flatten the output of 'info migrate', a QMP dict or
+                      human monitor text, into one sample dict.
+
+Every sample holds the raw counters ('status', 'transferred', 'remaining',
+'total', 'dirty_pages_rate', 'cpu_throttle_percentage', 'multifd_bytes',
+'postcopy_requests', ...) in bytes/ms/pages as reported by QEMU, plus:
+
+- 't': seconds since the telemetry was started
+- 'speed': bytes/s transferred since the previous sample
+- 'convergence': bytes/s the remaining RAM shrinks by, i.e. the transfer
+                 speed minus the guest dirty rate, negative when the guest
+                 dirties memory faster than it is sent
+- 'eta': seconds to completion at the current convergence rate, None when
+         the migration does not converge
+"""
+
+import json
+import logging
+import os
+import re
+
+import six
+
+from provider.host_stats import Sampler
+
+MIN_INTERVAL = 0.05
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# sample key: path in the query-migrate dict
+QMP_FIELDS = {
+    "status": ("status",),
+    "total_time": ("total-time",),
+    "setup_time": ("setup-time",),
+    "expected_downtime": ("expected-downtime",),
+    "downtime": ("downtime",),
+    "cpu_throttle_percentage": ("cpu-throttle-percentage",),
+    "transferred": ("ram", "transferred"),
+    "remaining": ("ram", "remaining"),
+    "total": ("ram", "total"),
+    "duplicate": ("ram", "duplicate"),
+    "normal_bytes": ("ram", "normal-bytes"),
+    "dirty_pages_rate": ("ram", "dirty-pages-rate"),
+    "dirty_sync_count": ("ram", "dirty-sync-count"),
+    "page_size": ("ram", "page-size"),
+    "mbps": ("ram", "mbps"),
+    "multifd_bytes": ("ram", "multifd-bytes"),
+    "postcopy_requests": ("ram", "postcopy-requests"),
+    "precopy_bytes": ("ram", "precopy-bytes"),
+    "postcopy_bytes": ("ram", "postcopy-bytes"),
+    "xbzrle_bytes": ("xbzrle-cache", "bytes"),
+    "xbzrle_cache_miss_rate": ("xbzrle-cache", "cache-miss-rate"),
+    "compressed_size": ("compression", "compressed-size"),
+    "compression_rate": ("compression", "compression-rate"),
+}
+
+# sample key: (regex on the human monitor text, scale to bytes/ms/pages)
+HMP_FIELDS = {
+    "status": (r"Migration status: (\S+)", None),
+    "total_time": (r"total time: (\d+) ms", 1),
+    "setup_time": (r"setup: (\d+) ms", 1),
+    "expected_downtime": (r"expected downtime: (\d+) ms", 1),
+    "downtime": (r"^downtime: (\d+) ms", 1),
+    "cpu_throttle_percentage": (r"cpu throttle percentage: (\d+)", 1),
+    "transferred": (r"transferred ram: (\d+) kbytes", 1024),
+    "remaining": (r"remaining ram: (\d+) kbytes", 1024),
+    "total": (r"total ram: (\d+) kbytes", 1024),
+    "duplicate": (r"duplicate: (\d+) pages", 1),
+    "normal_bytes": (r"normal bytes: (\d+) kbytes", 1024),
+    "dirty_pages_rate": (r"dirty pages rate: (\d+) pages", 1),
+    "dirty_sync_count": (r"dirty sync count: (\d+)", 1),
+    "mbps": (r"throughput: ([\d.]+) mbps", 1),
+    "multifd_bytes": (r"multifd bytes: (\d+) kbytes", 1024),
+    "postcopy_requests": (r"postcopy request count: (\d+)", 1),
+}
+
+
+def parse_migrate_info(info):
+    """
+    Flatten the output of 'info migrate' into one sample.
+
+    :param info: QMP query-migrate dict or human monitor text
+    :return: dict of sample key: value, missing counters are left out
+    """
+    sample = {}
+    if isinstance(info, six.string_types):
+        for key, (pattern, scale) in HMP_FIELDS.items():
+            match = re.search(pattern, info, re.MULTILINE)
+            if not match:
+                continue
+            value = match.group(1)
+            if scale is not None:
+                value = float(value) * scale
+                if value.is_integer():
+                    value = int(value)
+            sample[key] = value
+        return sample
+    for key, path in QMP_FIELDS.items():
+        value = info
+        for name in path:
+            value = value.get(name) if isinstance(value, dict) else None
+        if value is not None:
+            sample[key] = value
+    return sample
+
+
+class MigrationTelemetry(Sampler):
+
+    """
+    Time series of the migration progress of a source VM.
+    """
+
+    final_sample = False
+
+    def __init__(self, vm, interval=1.0, stop_on_end=True):
+        """
+        :param vm: source VM object
+        :param interval: seconds between two samples, at least MIN_INTERVAL
+        :param stop_on_end: stop sampling once the migration completed,
+                            failed or was cancelled
+        """
+        super(MigrationTelemetry, self).__init__(max(float(interval),
+                                                     MIN_INTERVAL))
+        self.vm = vm
+        self.stop_on_end = stop_on_end
+
+    def sample(self):
+        """
+        Take one sample and append it to the time series.
+
+        :return: the new sample
+        """
+        info = self.vm.monitor.info("migrate")
+        now = self.elapsed()
+        sample = parse_migrate_info(info)
+        sample["t"] = now
+        with self._lock:
+            self._derive(sample, self.samples[-1] if self.samples else None)
+            self.samples.append(sample)
+        return sample
+
+    @staticmethod
+    def _derive(sample, previous):
+        sample["speed"] = sample["convergence"] = sample["eta"] = None
+        if previous is None or "transferred" not in sample:
+            return
+        elapsed = sample["t"] - previous["t"]
+        if elapsed <= 0 or "transferred" not in previous:
+            return
+        speed = (sample["transferred"] - previous["transferred"]) / elapsed
+        sample["speed"] = speed
+        if "dirty_pages_rate" not in sample:
+            return
+        dirty_rate = sample["dirty_pages_rate"] * sample.get("page_size", 4096)
+        sample["convergence"] = speed - dirty_rate
+        if sample["convergence"] > 0 and "remaining" in sample:
+            sample["eta"] = sample["remaining"] / sample["convergence"]
+
+    def poll(self):
+        """
+        Take one sample from the sampler thread.
+
+        :return: False once the VM is gone or, with stop_on_end, the
+                 migration ended
+        """
+        try:
+            sample = self.sample()
+        except Exception as details:
+            if not self.vm.is_alive():
+                logging.debug("Migration telemetry of %s ended, VM is "
+                              "gone", self.vm.name)
+                return False
+            logging.debug("Failed to sample migration of %s: %s",
+                          self.vm.name, details)
+            return True
+        return not (self.stop_on_end and
+                    sample.get("status") in FINAL_STATUSES)
+
+    def start(self):
+        """Start sampling in the background."""
+        super(MigrationTelemetry, self).start()
+        logging.debug("Migration telemetry of %s started, interval %ss",
+                      self.vm.name, self.interval)
+
+    def values(self, key):
+        """
+        Get the time series of one field.
+
+        :param key: sample key, e.g. 'cpu_throttle_percentage'
+        :return: list of (t, value), samples without the field are skipped
+        """
+        with self._lock:
+            return [(s["t"], s[key]) for s in self.samples
+                    if s.get(key) is not None]
+
+    def statuses(self):
+        """Distinct migration statuses in the order they were seen."""
+        seen = []
+        for _, status in self.values("status"):
+            if not seen or seen[-1] != status:
+                seen.append(status)
+        return seen
+
+    def summary(self):
+        """
+        Summarize the time series.
+
+        :return: dict with the sample count, duration, final status, the
+                 average/min/max transfer speed in MB/s, the throttle steps,
+                 the last convergence rate and predicted completion
+        """
+        with self._lock:
+            samples = list(self.samples)
+        result = {"samples": len(samples), "interval": self.interval,
+                  "statuses": self.statuses()}
+        if not samples:
+            return result
+        last = samples[-1]
+        result.update({"duration": last["t"] - samples[0]["t"],
+                       "status": last.get("status")})
+        for key in ("total_time", "downtime", "setup_time",
+                    "expected_downtime", "dirty_sync_count"):
+            if key in last:
+                result[key] = last[key]
+        speeds = [s["speed"] / 1048576.0 for s in samples
+                  if s.get("speed") is not None]
+        moved = [s for s in samples if "transferred" in s]
+        if speeds:
+            span = moved[-1]["t"] - moved[0]["t"]
+            result.update({
+                "speed_avg_mbps": ((moved[-1]["transferred"] -
+                                    moved[0]["transferred"]) /
+                                   1048576.0 / span if span else 0),
+                "speed_min_mbps": min(speeds),
+                "speed_max_mbps": max(speeds)})
+        throttle = []
+        for _, value in self.values("cpu_throttle_percentage"):
+            if not throttle or throttle[-1] != value:
+                throttle.append(value)
+        result["throttle_steps"] = throttle
+        rates = self.values("convergence")
+        if rates:
+            result["convergence_mbps"] = rates[-1][1] / 1048576.0
+            result["converging_ratio"] = (float(sum(1 for _, r in rates
+                                                    if r > 0)) / len(rates))
+            result["eta"] = last.get("eta")
+        return result
+
+    def save(self, result_dir, tag=None):
+        """
+        Write the time series and its summary as JSON.
+
+        :param result_dir: directory to store the file
+        :param tag: file name suffix, the VM name by default
+        :return: path of the file
+        """
+        path = os.path.join(result_dir, "migration_telemetry_%s.json" %
+                            (tag or self.vm.name))
+        with self._lock:
+            samples = list(self.samples)
+        with open(path, "w") as telemetry_file:
+            json.dump({"summary": self.summary(), "samples": samples},
+                      telemetry_file, indent=2)
+        return path
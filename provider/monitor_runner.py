@@ -0,0 +1,214 @@
+"""
+Module for running a guest workload under host and guest monitors.
+
+Available classes:
+- MonitorRunner: Run host samplers as process groups and guest monitors in
+                 dedicated sessions, stream all their output into one
+                 timestamped dataset while a guest command runs.
+
+Every line printed by a sampler becomes a record
+{"t": seconds since start, "source": "host:<name>" or "guest:<name>",
+"line": text}.  Records are kept in memory, appended to
+<result_dir>/monitor_<tag>.jsonl and to one raw file per sampler, so
+several runners (one per VM tag) never share a file.
+"""
+
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+import aexpect
+
+from virttest import utils_misc
+
+
+class MonitorRunner(object):
+
+    """
+    Stream host and guest monitor output while a guest command runs.
+    """
+
+    def __init__(self, vm, result_dir, tag=None, login_timeout=360):
+        """
+        :param vm: VM object the workload runs in
+        :param result_dir: directory to store the dataset and raw outputs
+        :param tag: suffix of the result files, the VM instance by default
+        :param login_timeout: timeout of the guest logins
+        """
+        self.vm = vm
+        self.tag = tag or vm.instance
+        self.result_dir = result_dir
+        self.login_timeout = login_timeout
+        self.records = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._host = {}
+        self._guest = {}
+        self._threads = []
+        self._dataset = None
+        self._start = None
+        if not os.path.isdir(result_dir):
+            os.makedirs(result_dir)
+
+    def result_file(self, source, name):
+        """Raw output file of a sampler"""
+        return os.path.join(self.result_dir, "%s_monitor_result_%s_%s" %
+                            (source, name, self.tag))
+
+    def _record(self, source, name, line, raw):
+        record = {"t": round(utils_misc.monotonic_time() - self._start, 6),
+                  "source": "%s:%s" % (source, name), "line": line}
+        raw.write(line + "\n")
+        with self._lock:
+            self.records.append(record)
+            self._dataset.write(json.dumps(record) + "\n")
+
+    def _read_host(self, name, proc):
+        with open(self.result_file("host", name), "w") as raw:
+            for line in iter(proc.stdout.readline, b""):
+                self._record("host", name,
+                             line.decode(errors="replace").rstrip("\n"), raw)
+
+    def _read_guest(self, name, session, cmd):
+        def _record(line):
+            # Drop the echo of the command and the shell prompt
+            if cmd in line or re.match(session.prompt, line):
+                return
+            self._record("guest", name, line, raw)
+
+        pending = ""
+        with open(self.result_file("guest", name), "w") as raw:
+            while True:
+                stopping = self._stop_event.is_set()
+                try:
+                    pending += session.read_nonblocking(0.1, 0.5)
+                except (aexpect.ExpectError, OSError):
+                    break
+                lines = pending.split("\n")
+                pending = lines.pop()
+                for line in lines:
+                    _record(line.rstrip("\r"))
+                if stopping:
+                    break
+            if pending.strip():
+                _record(pending.rstrip("\r"))
+
+    def add_host_sampler(self, name, cmd):
+        """
+        Start a host sampler in its own process group.
+
+        :param name: sampler name
+        :param cmd: shell command printing one sample per line
+        """
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                preexec_fn=os.setsid)
+        self._host[name] = proc
+        logging.debug("Host sampler %s started: %s (pgid %s)", name, cmd,
+                      proc.pid)
+        self._spawn(self._read_host, name, proc)
+
+    def add_guest_monitor(self, name, cmd):
+        """
+        Start a monitor command in a dedicated guest session.
+
+        :param name: monitor name
+        :param cmd: guest command printing one sample per line
+        """
+        session = self.vm.wait_for_login(timeout=self.login_timeout)
+        session.sendline(cmd)
+        self._guest[name] = session
+        logging.debug("Guest monitor %s started: %s", name, cmd)
+        self._spawn(self._read_guest, name, session, cmd)
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def start(self, host_samplers=None, guest_monitors=None):
+        """
+        Start all samplers.
+
+        :param host_samplers: dict of name: host command
+        :param guest_monitors: dict of name: guest command
+        """
+        self._start = utils_misc.monotonic_time()
+        self._stop_event.clear()
+        self._dataset = open(os.path.join(self.result_dir, "monitor_%s.jsonl"
+                                          % self.tag), "w")
+        for name, cmd in (host_samplers or {}).items():
+            self.add_host_sampler(name, cmd)
+        for name, cmd in (guest_monitors or {}).items():
+            self.add_guest_monitor(name, cmd)
+
+    def stop(self, grace=5):
+        """
+        Cancel all samplers and wait for their output to be drained.
+
+        :param grace: seconds to wait after SIGTERM before SIGKILL
+        """
+        for proc in self._host.values():
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for session in self._guest.values():
+            try:
+                session.sendcontrol("c")
+            except Exception:
+                pass
+        deadline = time.time() + grace
+        for proc in self._host.values():
+            while proc.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                proc.wait()
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(grace)
+        for session in self._guest.values():
+            session.close()
+        self._host, self._guest, self._threads = {}, {}, []
+        if self._dataset:
+            self._dataset.close()
+            self._dataset = None
+
+    def run(self, cmd, timeout, host_samplers=None, guest_monitors=None):
+        """
+        Run a guest command with the samplers streaming around it.
+
+        :param cmd: guest workload command
+        :param timeout: timeout of the workload
+        :param host_samplers: dict of name: host command
+        :param guest_monitors: dict of name: guest command
+        :return: tuple of (status, output) of the workload
+        """
+        session = self.vm.wait_for_login(timeout=self.login_timeout)
+        self.start(host_samplers, guest_monitors)
+        try:
+            return session.cmd_status_output(cmd, timeout=timeout)
+        finally:
+            self.stop()
+            session.close()
+
+    def samples(self, source):
+        """
+        Get the records of one sampler.
+
+        :param source: 'host:<name>' or 'guest:<name>'
+        :return: list of (t, line)
+        """
+        with self._lock:
+            return [(r["t"], r["line"]) for r in self.records
+                    if r["source"] == source]
@@ -0,0 +1,410 @@
+"""
+Module for talking to NBD servers without external tools.
+
+Available classes:
+- NBDClient: Fixed newstyle NBD client over TCP or a unix socket, with
+             structured replies, metadata contexts (base:allocation,
+             qemu:dirty-bitmap:<name>...) and pipelined requests.
+
+Available methods:
+- connect: Open a client from image params (nbd_server, nbd_port,
+           nbd_unix_socket, nbd_export_name).
+
+A request is sent with submit() and its reply read with receive(), so a
+caller can keep several requests in flight on one connection. read(),
+write(), flush() and block_status() are the synchronous forms, and
+iter_extents() walks the extents of a metadata context, e.g. the dirty
+ranges of an exported bitmap.
+"""
+
+import socket
+import struct
+
+NBD_MAGIC = b"NBDMAGIC"
+IHAVEOPT = 0x49484156454F5054
+OPT_REPLY_MAGIC = 0x3e889045565a9
+REQUEST_MAGIC = 0x25609513
+SIMPLE_REPLY_MAGIC = 0x67446698
+STRUCTURED_REPLY_MAGIC = 0x668e33ef
+
+# Handshake flags
+FLAG_FIXED_NEWSTYLE = 1 << 0
+FLAG_NO_ZEROES = 1 << 1
+
+# Options and option replies
+OPT_ABORT = 2
+OPT_GO = 7
+OPT_STRUCTURED_REPLY = 8
+OPT_SET_META_CONTEXT = 10
+REP_ACK = 1
+REP_INFO = 3
+REP_META_CONTEXT = 4
+REP_FLAG_ERROR = 1 << 31
+INFO_EXPORT = 0
+
+# Transmission flags
+FLAG_READ_ONLY = 1 << 1
+FLAG_SEND_FLUSH = 1 << 2
+FLAG_SEND_TRIM = 1 << 5
+FLAG_CAN_MULTI_CONN = 1 << 8
+
+# Commands and command flags
+CMD_READ = 0
+CMD_WRITE = 1
+CMD_DISC = 2
+CMD_FLUSH = 3
+CMD_TRIM = 4
+CMD_BLOCK_STATUS = 7
+CMD_FLAG_REQ_ONE = 1 << 3
+
+# Structured reply chunks
+REPLY_FLAG_DONE = 1 << 0
+REPLY_TYPE_NONE = 0
+REPLY_TYPE_OFFSET_DATA = 1
+REPLY_TYPE_OFFSET_HOLE = 2
+REPLY_TYPE_BLOCK_STATUS = 5
+REPLY_TYPE_ERROR = (1 << 15) + 1
+REPLY_TYPE_ERROR_OFFSET = (1 << 15) + 2
+
+# base:allocation extent flags
+STATE_HOLE = 1 << 0
+STATE_ZERO = 1 << 1
+# qemu:dirty-bitmap extent flag
+STATE_DIRTY = 1 << 0
+
+
+class NBDError(Exception):
+    pass
+
+
+class NBDClient(object):
+
+    """
+    One connection to an NBD export.
+    """
+
+    def __init__(self, host="localhost", port=10809, unix_socket=None,
+                 export="", meta_contexts=(), structured=True, timeout=60):
+        """
+        :param host: server address, unused with unix_socket
+        :param port: server port, unused with unix_socket
+        :param unix_socket: path of the server unix socket
+        :param export: export name
+        :param meta_contexts: metadata contexts to negotiate, e.g.
+                              ['base:allocation', 'qemu:dirty-bitmap:b0']
+        :param structured: whether to negotiate structured replies, needed
+                           for block status
+        :param timeout: socket timeout in seconds
+        """
+        self.export = export
+        self.size = None
+        self.flags = 0
+        self.contexts = {}
+        self.structured = False
+        self._handle = 0
+        self._inflight = {}
+        self._partial = {}
+        self._completed = {}
+        if unix_socket:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = unix_socket
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (host, int(port))
+        self._sock.settimeout(timeout)
+        self._sock.connect(address)
+        try:
+            self._handshake(structured or bool(meta_contexts),
+                            list(meta_contexts))
+        except Exception:
+            self._sock.close()
+            raise
+
+    def _recv(self, length):
+        buf = bytearray(length)
+        view = memoryview(buf)
+        while length:
+            received = self._sock.recv_into(view, length)
+            if not received:
+                raise NBDError("Connection closed by the server")
+            view = view[received:]
+            length -= received
+        return buf
+
+    def _unpack(self, fmt):
+        return struct.unpack(fmt, self._recv(struct.calcsize(fmt)))
+
+    def _option(self, option, data=b""):
+        self._sock.sendall(struct.pack(">QII", IHAVEOPT, option, len(data)) +
+                           data)
+
+    def _option_reply(self, option):
+        magic, reply_option, reply, length = self._unpack(">QIII")
+        if magic != OPT_REPLY_MAGIC or reply_option != option:
+            raise NBDError("Bad option reply %x for option %d" %
+                           (magic, reply_option))
+        data = bytes(self._recv(length))
+        if reply & REP_FLAG_ERROR:
+            raise NBDError("Option %d failed with reply %x: %s" %
+                           (option, reply, data.decode(errors="replace")))
+        return reply, data
+
+    def _handshake(self, structured, meta_contexts):
+        magic, opt_magic, flags = self._unpack(">8sQH")
+        if magic != NBD_MAGIC or opt_magic != IHAVEOPT:
+            raise NBDError("Not a newstyle NBD server")
+        if not flags & FLAG_FIXED_NEWSTYLE:
+            raise NBDError("Server does not support fixed newstyle")
+        client_flags = FLAG_FIXED_NEWSTYLE | (flags & FLAG_NO_ZEROES)
+        self._sock.sendall(struct.pack(">I", client_flags))
+        name = self.export.encode()
+        if structured:
+            self._option(OPT_STRUCTURED_REPLY)
+            try:
+                self._option_reply(OPT_STRUCTURED_REPLY)
+                self.structured = True
+            except NBDError:
+                self.structured = False
+        if meta_contexts:
+            if not self.structured:
+                raise NBDError("Metadata contexts need structured replies")
+            data = struct.pack(">I", len(name)) + name
+            data += struct.pack(">I", len(meta_contexts))
+            for context in meta_contexts:
+                context = context.encode()
+                data += struct.pack(">I", len(context)) + context
+            self._option(OPT_SET_META_CONTEXT, data)
+            while True:
+                reply, data = self._option_reply(OPT_SET_META_CONTEXT)
+                if reply == REP_ACK:
+                    break
+                if reply == REP_META_CONTEXT:
+                    context_id = struct.unpack(">I", data[:4])[0]
+                    self.contexts[data[4:].decode()] = context_id
+            missing = set(meta_contexts) - set(self.contexts)
+            if missing:
+                raise NBDError("Server has no metadata context %s" %
+                               ", ".join(sorted(missing)))
+        self._option(OPT_GO, struct.pack(">I", len(name)) + name +
+                     struct.pack(">H", 0))
+        while True:
+            reply, data = self._option_reply(OPT_GO)
+            if reply == REP_ACK:
+                break
+            if reply == REP_INFO and len(data) >= 12:
+                info = struct.unpack(">H", data[:2])[0]
+                if info == INFO_EXPORT:
+                    self.size, self.flags = struct.unpack(">QH", data[2:12])
+        if self.size is None:
+            raise NBDError("Server did not send the export size")
+
+    @property
+    def can_multi_conn(self):
+        """Whether the server allows consistent multi connection use"""
+        return bool(self.flags & FLAG_CAN_MULTI_CONN)
+
+    @property
+    def read_only(self):
+        return bool(self.flags & FLAG_READ_ONLY)
+
+    def submit(self, command, offset=0, length=0, data=None, flags=0):
+        """
+        Send a request without waiting for its reply.
+
+        :param command: CMD_READ, CMD_WRITE, CMD_BLOCK_STATUS...
+        :param offset: offset in bytes
+        :param length: length in bytes, len(data) for writes
+        :param data: payload of a write
+        :param flags: command flags
+        :return: handle of the request
+        """
+        self._handle += 1
+        handle = self._handle
+        if data is not None:
+            length = len(data)
+        header = struct.pack(">IHHQQI", REQUEST_MAGIC, flags, command,
+                             handle, offset, length)
+        self._inflight[handle] = (command, offset, length)
+        self._sock.sendall(header)
+        if data is not None:
+            self._sock.sendall(data)
+        return handle
+
+    @property
+    def inflight(self):
+        """Number of requests waiting for a reply, or not received yet"""
+        return len(self._inflight) + len(self._completed)
+
+    def _result(self, handle):
+        result = self._partial.get(handle)
+        if result is None:
+            command, _, length = self._inflight[handle]
+            result = {"error": 0, "message": None, "data": None,
+                      "extents": {}}
+            if command == CMD_READ:
+                result["data"] = bytearray(length)
+            self._partial[handle] = result
+        return result
+
+    def _chunk(self, handle, kind, length):
+        result = self._result(handle)
+        _, offset, _ = self._inflight[handle]
+        if kind == REPLY_TYPE_OFFSET_DATA:
+            chunk_offset = self._unpack(">Q")[0] - offset
+            result["data"][chunk_offset:chunk_offset + length - 8] = \
+                self._recv(length - 8)
+        elif kind == REPLY_TYPE_OFFSET_HOLE:
+            # The read buffer is zero filled already
+            self._unpack(">QI")
+        elif kind == REPLY_TYPE_BLOCK_STATUS:
+            payload = self._recv(length)
+            context_id = struct.unpack(">I", payload[:4])[0]
+            extents = result["extents"].setdefault(context_id, [])
+            for i in range(4, length, 8):
+                extents.append(struct.unpack(">II", payload[i:i + 8]))
+        elif kind in (REPLY_TYPE_ERROR, REPLY_TYPE_ERROR_OFFSET):
+            payload = self._recv(length)
+            error, message_len = struct.unpack(">IH", payload[:6])
+            result["error"] = error
+            result["message"] = bytes(payload[6:6 + message_len]).decode(
+                errors="replace")
+        else:
+            self._recv(length)
+
+    def receive(self):
+        """
+        Read replies until one request completes.
+
+        :return: tuple of (handle, result), result is a dict with 'error'
+                 (errno, 0 on success), 'message', 'data' (reads) and
+                 'extents' (block status, dict of context id: list of
+                 (length, flags))
+        """
+        if self._completed:
+            return self._completed.popitem()
+        return self._receive()
+
+    def _receive(self):
+        while True:
+            magic = self._unpack(">I")[0]
+            if magic == SIMPLE_REPLY_MAGIC:
+                error, handle = self._unpack(">IQ")
+                command, _, length = self._inflight[handle]
+                result = self._result(handle)
+                result["error"] = error
+                if command == CMD_READ and not error:
+                    result["data"] = self._recv(length)
+                break
+            if magic != STRUCTURED_REPLY_MAGIC:
+                raise NBDError("Bad reply magic %x" % magic)
+            flags, kind, handle, length = self._unpack(">HHQI")
+            if handle not in self._inflight:
+                raise NBDError("Reply for unknown handle %d" % handle)
+            self._chunk(handle, kind, length)
+            if flags & REPLY_FLAG_DONE:
+                break
+        del self._inflight[handle]
+        return handle, self._partial.pop(handle)
+
+    def _call(self, *args, **kwargs):
+        handle = self.submit(*args, **kwargs)
+        while True:
+            done, result = self._receive()
+            if done != handle:
+                # Keep the replies of pipelined requests for receive()
+                self._completed[done] = result
+                continue
+            if result["error"]:
+                raise NBDError("Request failed with errno %d: %s" %
+                               (result["error"], result["message"]))
+            return result
+
+    def read(self, offset, length):
+        return bytes(self._call(CMD_READ, offset, length)["data"])
+
+    def write(self, offset, data):
+        self._call(CMD_WRITE, offset, data=data)
+
+    def flush(self):
+        self._call(CMD_FLUSH)
+
+    def block_status(self, offset, length, req_one=False):
+        """
+        Get the extents of every negotiated metadata context.
+
+        :param offset: offset in bytes
+        :param length: length in bytes
+        :param req_one: ask for a single extent per context
+        :return: dict of context name: list of (length, flags)
+        """
+        result = self._call(CMD_BLOCK_STATUS, offset, length,
+                            flags=CMD_FLAG_REQ_ONE if req_one else 0)
+        names = dict((context_id, name)
+                     for name, context_id in self.contexts.items())
+        return dict((names.get(context_id, context_id), extents)
+                    for context_id, extents in result["extents"].items())
+
+    def iter_extents(self, context, offset=0, length=None, window=1 << 30):
+        """
+        Walk the extents of one metadata context, one block status request
+        of at most 'window' bytes at a time, so that the memory used does
+        not depend on the export size.
+
+        :param context: negotiated metadata context name
+        :param offset: offset in bytes
+        :param length: length in bytes, up to the end of the export if None
+        :param window: max length of one block status request
+        :return: generator of (offset, length, flags), adjacent extents
+                 with the same flags are merged
+        """
+        end = self.size
+        if length is not None:
+            end = min(end, offset + length)
+        current = None
+        while offset < end:
+            extents = self.block_status(offset, min(window, end - offset))
+            extents = extents.get(context)
+            if not extents:
+                raise NBDError("No extent of %s at offset %d" %
+                               (context, offset))
+            for extent_length, flags in extents:
+                extent_length = min(extent_length, end - offset)
+                if current and current[2] == flags:
+                    current[1] += extent_length
+                else:
+                    if current:
+                        yield tuple(current)
+                    current = [offset, extent_length, flags]
+                offset += extent_length
+                if offset >= end:
+                    break
+        if current:
+            yield tuple(current)
+
+    def close(self):
+        """Disconnect from the server."""
+        try:
+            self.submit(CMD_DISC)
+        except socket.error:
+            pass
+        finally:
+            self._inflight.clear()
+            self._completed.clear()
+            self._sock.close()
+
+
+def connect(params, export=None, **kwargs):
+    """
+    Connect to the NBD server described by image params.
+
+    :param params: image params with 'nbd_unix_socket', or 'nbd_server'
+                   and 'nbd_port', and 'nbd_export_name'
+    :param export: export name, overrides 'nbd_export_name'
+    :return: NBDClient object
+    """
+    if export is None:
+        export = params.get("nbd_export_name", "")
+    return NBDClient(params.get("nbd_server", "localhost"),
+                     params.get("nbd_port", 10809),
+                     params.get("nbd_unix_socket"), export, **kwargs)
@@ -5,22 +5,27 @@ import six
 from avocado.utils import process
 
 
-from virttest import utils_test
-from virttest import utils_misc
 from virttest import remote
 from virttest import data_dir
 from virttest import error_context
 
+from provider.thread_pinning import ThreadPinner
+
 
 def pin_vm_threads(vm, node):
     """
     pin vm threads to assigned node
 
+    :param node: 1-based host node number, negative counts from the last
+    :return: node, to pin other vms to the same host node
     """
     if node:
-        if not isinstance(node, utils_misc.NumaNode):
-            node = utils_misc.NumaNode(int(node))
-        utils_test.qemu.pin_vm_threads(vm, node)
+        pinner = ThreadPinner(vm)
+        node_id = pinner.pin_to_node(node)
+        misplaced = pinner.verify_node(node_id)
+        if misplaced:
+            logging.warning("Threads not placed on host node %s: %s",
+                            node_id, misplaced)
 
     return node
 
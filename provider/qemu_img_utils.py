@@ -10,6 +10,9 @@ from virttest import utils_misc
 
 from avocado.utils import process
 
+from provider.session_pool import guest_session
+from provider.session_pool import pooled
+
 
 def boot_vm_with_images(test, params, env, images=None, vm_name=None):
     """Boot VM with images specified."""
@@ -27,6 +30,7 @@ def boot_vm_with_images(test, params, env, images=None, vm_name=None):
     return vm
 
 
+@pooled
 def save_random_file_to_vm(vm, save_path, count, sync_bin, blocksize=512):
     """
     Save a random file to vm.
@@ -37,17 +41,16 @@ def save_random_file_to_vm(vm, save_path, count, sync_bin, blocksize=512):
     :param sync_bin: sync binary path
     :param blocksize: block size, default 512
     """
-    session = vm.wait_for_login(timeout=360)
     dd_cmd = "dd if=/dev/urandom of=%s bs=%s count=%s conv=fsync"
     with tempfile.NamedTemporaryFile() as f:
         dd_cmd = dd_cmd % (f.name, blocksize, count)
         process.run(dd_cmd, shell=True, timeout=360)
         vm.copy_files_to(f.name, save_path)
-    sync_bin = utils_misc.set_winutils_letter(session, sync_bin)
-    status, out = session.cmd_status_output(sync_bin, timeout=240)
+    with guest_session(vm, timeout=360) as session:
+        sync_bin = utils_misc.set_winutils_letter(session, sync_bin)
+        status, out = session.cmd_status_output(sync_bin, timeout=240)
     if status:
         raise EnvironmentError("Fail to execute %s: %s" % (sync_bin, out))
-    session.close()
 
 
 @avocado.fail_on(exceptions=(ValueError,))
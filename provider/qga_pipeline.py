@@ -0,0 +1,233 @@
+"""
+Module for pipelining guest agent commands.
+
+Available classes:
+- GuestFileTransfer: Copy files between the host and the guest through the
+                     guest-file-* commands, with the largest read count the
+                     agent accepts and several requests in flight.
+
+Available methods:
+- pipeline: Send a stream of guest agent commands back to back, keeping up
+            to 'depth' of them in flight, and hand every reply over in
+            order.
+
+The agent processes commands in the order they are received and answers
+them in the same order, so requests can be written ahead of the replies.
+The agent lock is held for the whole pipeline, other users of the agent
+wait until it is drained.
+"""
+
+import binascii
+import collections
+import json
+import logging
+import time
+
+from virttest import guest_agent
+
+
+def _build(cmd, args):
+    request = {"execute": cmd}
+    if args:
+        request["arguments"] = args
+    return json.dumps(request) + "\n"
+
+
+def pipeline(agent, requests, on_reply, depth=4, timeout=60):
+    """
+    Run guest agent commands with several of them in flight.
+
+    :param agent: QemuAgent object
+    :param requests: iterable of (cmd, args, context)
+    :param on_reply: called with (context, return value) for every reply in
+                     order, stops sending new requests if it returns False
+    :param depth: max number of requests in flight
+    :param timeout: max seconds to wait for one reply
+    :return: number of replies
+    """
+    requests = iter(requests)
+    if not agent._acquire_lock():
+        raise guest_agent.VAgentLockError("Could not acquire exclusive lock "
+                                          "to pipeline commands")
+    inflight = collections.deque()
+    replies = collections.deque()
+    failure = None
+    pending = True
+    count = 0
+    try:
+        # Drop what is left from previous commands
+        agent._read_objects()
+        while True:
+            while pending and len(inflight) < depth:
+                request = next(requests, None)
+                if request is None:
+                    pending = False
+                    break
+                agent._send(_build(request[0], request[1]))
+                inflight.append(request)
+            if not inflight:
+                break
+            end_time = time.time() + timeout
+            while not replies:
+                if not agent._data_available(end_time - time.time()):
+                    raise guest_agent.VAgentProtocolError(
+                        "No reply to '%s' within %ss" %
+                        (inflight[0][0], timeout))
+                replies.extend(obj for obj in agent._read_objects()
+                               if isinstance(obj, dict) and
+                               ("return" in obj or "error" in obj))
+            reply = replies.popleft()
+            cmd, args, context = inflight.popleft()
+            count += 1
+            if failure:
+                continue
+            if "error" in reply:
+                # Drain the requests in flight before raising
+                failure = guest_agent.VAgentCmdError(cmd, args,
+                                                     reply["error"])
+                pending = False
+            else:
+                try:
+                    if on_reply(context, reply["return"]) is False:
+                        pending = False
+                except Exception as details:
+                    failure = details
+                    pending = False
+    finally:
+        agent._lock.release()
+    if failure:
+        raise failure
+    return count
+
+
+class GuestFileTransfer(object):
+
+    """
+    File transfer through guest-file-read and guest-file-write.
+    """
+
+    MIN_CHUNK = 64 * 1024
+
+    def __init__(self, agent, chunk_size=16 * 1024 * 1024, depth=4,
+                 timeout=60):
+        """
+        :param agent: QemuAgent object
+        :param chunk_size: bytes per request, reads fall back to smaller
+                           chunks if the agent rejects this count
+        :param depth: requests in flight
+        :param timeout: max seconds to wait for one reply
+        """
+        self.agent = agent
+        self.chunk_size = int(chunk_size)
+        self.depth = int(depth)
+        self.timeout = timeout
+        self.records = []
+
+    def _record(self, direction, guest_path, size, begin):
+        seconds = time.time() - begin
+        record = {"direction": direction, "guest_path": guest_path,
+                  "bytes": size, "seconds": seconds,
+                  "mbps": size / 1048576.0 / seconds if seconds else 0,
+                  "chunk": self.chunk_size, "depth": self.depth}
+        self.records.append(record)
+        logging.info("%s %s: %d bytes in %.2fs, %.1f MB/s", direction,
+                     guest_path, size, seconds, record["mbps"])
+        return record
+
+    def _first_read(self, handle):
+        """Read the first chunk with the largest count the agent accepts."""
+        while True:
+            try:
+                return self.agent.guest_file_read(handle,
+                                                  count=self.chunk_size)
+            except guest_agent.VAgentCmdError as detail:
+                if self.chunk_size // 2 < self.MIN_CHUNK:
+                    raise
+                logging.debug("Read count %d rejected: %s", self.chunk_size,
+                              detail)
+                self.chunk_size //= 2
+
+    def download(self, guest_path, host_path):
+        """
+        Copy a guest file to the host.
+
+        :param guest_path: guest file path
+        :param host_path: host file path
+        :return: dict with 'bytes', 'seconds' and 'mbps'
+        """
+        begin = time.time()
+        handle = int(self.agent.guest_file_open(guest_path, mode="rb"))
+        try:
+            size = self.agent.guest_file_seek(handle, 0, 2)["position"]
+            self.agent.guest_file_seek(handle, 0, 0)
+            with open(host_path, "wb") as host_file:
+                # Allocate the whole file once, chunks land at their offset
+                host_file.truncate(size)
+                result = self._first_read(handle)
+                data = binascii.a2b_base64(result["buf-b64"])
+                host_file.seek(0)
+                host_file.write(data)
+                state = {"offset": len(data), "eof": result["eof"]}
+
+                def _reads():
+                    while not state["eof"]:
+                        yield ("guest-file-read",
+                               {"handle": handle, "count": self.chunk_size},
+                               None)
+
+                def _on_read(context, result):
+                    if result["count"]:
+                        data = binascii.a2b_base64(result["buf-b64"])
+                        host_file.seek(state["offset"])
+                        host_file.write(data)
+                        state["offset"] += len(data)
+                    if result["eof"] or not result["count"]:
+                        state["eof"] = True
+                        return False
+
+                pipeline(self.agent, _reads(), _on_read, self.depth,
+                         self.timeout)
+                if state["offset"] != size:
+                    # The file changed while being read
+                    host_file.truncate(state["offset"])
+        finally:
+            self.agent.guest_file_close(handle)
+        return self._record("download", guest_path, state["offset"], begin)
+
+    def upload(self, host_path, guest_path):
+        """
+        Copy a host file to the guest.
+
+        :param host_path: host file path
+        :param guest_path: guest file path
+        :return: dict with 'bytes', 'seconds' and 'mbps'
+        """
+        begin = time.time()
+        written = [0]
+        handle = int(self.agent.guest_file_open(guest_path, mode="wb"))
+        try:
+            with open(host_path, "rb") as host_file:
+                def _writes():
+                    while True:
+                        data = host_file.read(self.chunk_size)
+                        if not data:
+                            break
+                        yield ("guest-file-write",
+                               {"handle": handle,
+                                "buf-b64": binascii.b2a_base64(
+                                    data).decode().rstrip("\n")},
+                               len(data))
+
+                def _on_write(size, result):
+                    if result["count"] != size:
+                        raise guest_agent.VAgentProtocolError(
+                            "Short write to %s: %d of %d bytes" %
+                            (guest_path, result["count"], size))
+                    written[0] += size
+
+                pipeline(self.agent, _writes(), _on_write, self.depth,
+                         self.timeout)
+            self.agent.guest_file_flush(handle)
+        finally:
+            self.agent.guest_file_close(handle)
+        return self._record("upload", guest_path, written[0], begin)
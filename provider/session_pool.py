@@ -0,0 +1,277 @@
+"""
+Module for sharing logged in guest sessions between providers.
+
+Available classes:
+- SessionPool: Per-VM pool of pre-authenticated shell sessions with
+               checkout/checkin semantics and liveness checks.
+
+Available methods:
+- get_pool: Get the session pool of a VM, create it if needed.
+- pooled_sessions: Context manager that closes every pool when the
+                   outermost of the nested with blocks ends.
+- pooled: Decorator running a function inside pooled_sessions().
+- guest_session: Context manager that checks out a session of a VM and
+                 returns it to the pool afterwards.
+- invalidate: Drop all the pooled sessions of a VM.
+- close_all: Close every pool.
+
+The providers using guest_session() open pooled_sessions() in their entry
+points and the blockdev base classes around the whole test, so nested
+calls share the pooled sessions and none of them outlives the outermost
+call.
+
+A pool is invalidated when the QEMU process of the VM changes (restart,
+migration) or when the VM emits a RESET or SHUTDOWN QMP event, so callers
+never get a session that belongs to a previous boot.  Set 'session_pool'
+to 'no' in the VM params to fall back to one login per operation.
+"""
+
+import contextlib
+import functools
+import logging
+import threading
+import time
+
+import aexpect
+
+RESET_EVENTS = ("RESET", "SHUTDOWN")
+
+_LOCK = threading.Lock()
+_POOLS = {}
+_SCOPES = [0]
+
+
+class SessionPool(object):
+
+    """
+    Pool of logged in sessions of one VM.
+    """
+
+    def __init__(self, vm, max_idle=None, login_timeout=None):
+        """
+        :param vm: VM object
+        :param max_idle: max number of idle sessions kept in the pool
+        :param login_timeout: timeout of a new login
+        """
+        self.vm = vm
+        self.max_idle = int(max_idle or vm.params.get("session_pool_size", 4))
+        self.login_timeout = int(login_timeout or
+                                 vm.params.get("login_timeout", 360))
+        self._check_timeout = float(
+            vm.params.get("session_pool_check_timeout", 5))
+        self._lock = threading.Lock()
+        self._idle = []
+        self._generation = 0
+        self._pid = None
+        self._since = None
+        self._reset_marks()
+        self.logins = 0
+        self.reuses = 0
+
+    def _reset_marks(self):
+        self._pid = self._get_pid()
+        self._since = time.time()
+
+    def _get_pid(self):
+        try:
+            return self.vm.get_pid()
+        except Exception:
+            return None
+
+    def _guest_was_reset(self):
+        """Check for a VM restart/migration or a guest reset since the
+        sessions were created."""
+        if self._get_pid() != self._pid:
+            return True
+        monitor = getattr(self.vm, "monitor", None)
+        if not monitor or getattr(monitor, "protocol", None) != "qmp":
+            return False
+        try:
+            events = monitor.get_events()
+        except Exception:
+            return False
+        for event in events:
+            if event.get("event") not in RESET_EVENTS:
+                continue
+            stamp = event.get("timestamp", {})
+            if stamp.get("seconds", 0) + \
+                    stamp.get("microseconds", 0) / 1000000.0 >= self._since:
+                return True
+        return False
+
+    def _is_healthy(self, session):
+        try:
+            return (session.is_alive() and
+                    session.is_responsive(timeout=self._check_timeout))
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(session):
+        try:
+            session.close()
+        except Exception:
+            pass
+
+    def invalidate(self):
+        """
+        Close all idle sessions, and make the checked out ones be closed
+        on checkin instead of returning to the pool.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._generation += 1
+            self._reset_marks()
+        for session in idle:
+            self._close(session)
+
+    def checkout(self, timeout=None):
+        """
+        Get a healthy session, login a new one if no idle session is left.
+
+        :param timeout: login timeout
+        :return: a logged in session
+        """
+        if self._guest_was_reset():
+            logging.debug("Guest of %s was reset, invalidate its %d pooled "
+                          "sessions", self.vm.name, len(self._idle))
+            self.invalidate()
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+                generation = self._generation
+            if session is None:
+                break
+            if self._is_healthy(session):
+                self.reuses += 1
+                session.pool_generation = generation
+                return session
+            self._close(session)
+        session = self.vm.wait_for_login(timeout=timeout or
+                                         self.login_timeout)
+        self.logins += 1
+        session.pool_generation = generation
+        return session
+
+    def checkin(self, session, healthy=True):
+        """
+        Return a session to the pool.
+
+        :param session: session got from checkout()
+        :param healthy: False to close the session instead
+        """
+        with self._lock:
+            if (healthy and len(self._idle) < self.max_idle and
+                    getattr(session, "pool_generation", None) ==
+                    self._generation):
+                self._idle.append(session)
+                return
+        self._close(session)
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        """
+        Check out a session for the duration of a with block.  A session
+        whose command failed at the shell level is closed, not reused.
+
+        :param timeout: login timeout
+        """
+        session = self.checkout(timeout)
+        healthy = True
+        try:
+            yield session
+        except (aexpect.ShellTimeoutError, aexpect.ShellProcessTerminatedError,
+                aexpect.ExpectProcessTerminatedError):
+            healthy = False
+            raise
+        finally:
+            self.checkin(session, healthy)
+
+    def close(self):
+        """Close all idle sessions."""
+        self.invalidate()
+        logging.debug("Session pool of %s: %d logins, %d reuses",
+                      self.vm.name, self.logins, self.reuses)
+
+
+def get_pool(vm):
+    """
+    Get the session pool of a VM, create it if needed.
+
+    :param vm: VM object
+    :return: SessionPool object
+    """
+    with _LOCK:
+        pool = _POOLS.get(vm.name)
+        if pool is None or pool.vm is not vm:
+            if pool is not None:
+                pool.close()
+            pool = _POOLS[vm.name] = SessionPool(vm)
+        return pool
+
+
+@contextlib.contextmanager
+def pooled_sessions():
+    """
+    Share the pooled sessions within a with block, close every pool when
+    the outermost of the nested blocks ends.
+    """
+    with _LOCK:
+        _SCOPES[0] += 1
+    try:
+        yield
+    finally:
+        with _LOCK:
+            _SCOPES[0] -= 1
+            last = not _SCOPES[0]
+        if last:
+            close_all()
+
+
+def pooled(func):
+    """Run a function inside pooled_sessions()."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with pooled_sessions():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def guest_session(vm, timeout=None):
+    """
+    Get a logged in session of a VM for the duration of a with block.
+
+    :param vm: VM object
+    :param timeout: login timeout
+    """
+    if vm.params.get("session_pool", "yes") != "yes":
+        session = vm.wait_for_login(timeout=timeout or 360)
+        try:
+            yield session
+        finally:
+            session.close()
+        return
+    with get_pool(vm).session(timeout) as session:
+        yield session
+
+
+def invalidate(vm):
+    """
+    Drop all the pooled sessions of a VM.
+
+    :param vm: VM object
+    """
+    with _LOCK:
+        pool = _POOLS.pop(vm.name, None)
+    if pool is not None:
+        pool.close()
+
+
+def close_all():
+    """Close every pool."""
+    with _LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
@@ -28,6 +28,9 @@ from virttest.remote import scp_to_remote
 
 from avocado import TestError
 
+from provider.session_pool import guest_session
+from provider.session_pool import pooled
+
 GIT_DOWNLOAD = 'git'
 CURL_DOWNLOAD = 'curl'
 
@@ -240,6 +243,7 @@ class StorageBenchmark(object):
         """
         return self.session.cmd(cmd, timeout=timeout)
 
+    @pooled
     def clean(self, timeout=1800, force=False):
         """
         Clean benchmark tool packages and processes after testing inside guest.
@@ -252,15 +256,14 @@ class StorageBenchmark(object):
         """
         # In order to the output of the previous session object does not
         # disturb the current session object to get the shell prompt, so
-        # new a session.
-        session = self.vm.wait_for_login(timeout=360)
-        if force:
-            self.__kill_procs(session)
-        else:
-            self.__wait_procs_done(session, timeout)
-        if self.env_files:
-            self.__remove_env_files(session)
-        session.close()
+        # use another session.
+        with guest_session(self.vm, timeout=360) as session:
+            if force:
+                self.__kill_procs(session)
+            else:
+                self.__wait_procs_done(session, timeout)
+            if self.env_files:
+                self.__remove_env_files(session)
 
     @staticmethod
     def _clean_env(func):
@@ -0,0 +1,329 @@
+"""
+Module for pinning QEMU and host threads without forking taskset/ps.
+
+Available classes:
+- ThreadPinner: Find the vCPU, iothread, vhost and emulator threads of a VM
+                through QMP and /proc, pin them with sched_setaffinity (or
+                taskset where python lacks it), save
+                and restore their masks and check them against the host
+                NUMA topology.
+
+Available methods:
+- parse_cpu_list: Parse a '0-3,8' style cpu list.
+- mask_to_cpus: Convert an affinity bitmask to a set of cpus.
+- get_affinity: Get the cpus a thread may run on.
+- set_affinity: Set the cpus a thread may run on.
+- numa_nodes: Get the cpus of every host NUMA node.
+- process_tree: Get a pid and the pids of all its descendants.
+- thread_ids: Get the thread ids of a process.
+- pin_process_tree: Pin every thread of a process and of its children.
+- restore_affinity: Restore the masks saved by a pin operation.
+"""
+
+import glob
+import logging
+import os
+import re
+
+import six
+
+from avocado.utils import process
+
+NODE_DIR = "/sys/devices/system/node"
+
+
+def parse_cpu_list(cpu_list):
+    """
+    Parse a kernel cpu list.
+
+    :param cpu_list: string like '0-3,8,10-11'
+    :return: sorted list of cpu ids
+    """
+    cpus = set()
+    for item in cpu_list.strip().split(","):
+        if not item:
+            continue
+        if "-" in item:
+            first, last = item.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(item))
+    return sorted(cpus)
+
+
+def mask_to_cpus(mask):
+    """
+    Convert an affinity bitmask to cpus.
+
+    :param mask: int or hex string bitmask, e.g. 0xFF
+    :return: set of cpu ids
+    """
+    if not isinstance(mask, six.integer_types):
+        mask = int(str(mask), 16)
+    return set(i for i in range(mask.bit_length()) if mask >> i & 1)
+
+
+def numa_nodes():
+    """
+    Get the cpus of every host NUMA node.
+
+    :return: dict of node id: list of cpu ids, one node with all the
+             online cpus if the host exposes no NUMA topology
+    """
+    nodes = {}
+    for path in glob.glob(os.path.join(NODE_DIR, "node[0-9]*")):
+        with open(os.path.join(path, "cpulist")) as cpulist:
+            cpus = parse_cpu_list(cpulist.read())
+        if cpus:
+            nodes[int(re.search(r"(\d+)$", path).group(1))] = cpus
+    return nodes or {0: sorted(get_affinity(os.getpid()))}
+
+
+def get_affinity(tid):
+    """
+    Get the cpus a thread may run on.
+
+    :param tid: thread id
+    :return: set of cpu ids
+    :raise OSError: if the thread is gone
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(tid))
+    try:
+        output = process.system_output("taskset -p %s" % tid,
+                                       verbose=False).decode()
+    except process.CmdError as details:
+        raise OSError(str(details))
+    return mask_to_cpus(output.rsplit(":", 1)[-1].strip())
+
+
+def set_affinity(tid, cpus):
+    """
+    Set the cpus a thread may run on.
+
+    :param tid: thread id
+    :param cpus: iterable of cpu ids
+    :raise OSError: if the thread is gone
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(tid, cpus)
+        return
+    try:
+        process.system("taskset -pc %s %s" % (
+            ",".join(str(cpu) for cpu in sorted(cpus)), tid), verbose=False)
+    except process.CmdError as details:
+        raise OSError(str(details))
+
+
+def _read(path):
+    try:
+        with open(path) as proc_file:
+            return proc_file.read()
+    except (IOError, OSError):
+        return ""
+
+
+def thread_ids(pid):
+    """
+    Get the thread ids of a process.
+
+    :param pid: process id
+    :return: list of thread ids, empty if the process is gone
+    """
+    try:
+        return sorted(int(tid) for tid in os.listdir("/proc/%s/task" % pid))
+    except OSError:
+        return []
+
+
+def thread_name(pid, tid=None):
+    """Get the comm of a thread, of the main thread if tid is None"""
+    if tid is None:
+        return _read("/proc/%s/comm" % pid).strip()
+    return _read("/proc/%s/task/%s/comm" % (pid, tid)).strip()
+
+
+def process_tree(pid):
+    """
+    Get a process and all its descendants.
+
+    :param pid: process id
+    :return: list of pids, the given one first
+    """
+    children = {}
+    for stat_path in glob.glob("/proc/[0-9]*/stat"):
+        stat = _read(stat_path)
+        if not stat:
+            continue
+        fields = stat.rsplit(")", 1)[1].split()
+        children.setdefault(int(fields[1]), []).append(
+            int(stat.split(None, 1)[0]))
+    tree = [int(pid)]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def _set_affinity(tid, cpus, saved):
+    try:
+        if tid not in saved:
+            saved[tid] = get_affinity(tid)
+        set_affinity(tid, cpus)
+    except OSError as details:
+        # Threads may exit while walking the list
+        logging.debug("Could not pin thread %s: %s", tid, details)
+
+
+def pin_process_tree(pid, cpus):
+    """
+    Pin every thread of a process and of all its descendants.
+
+    :param pid: process id
+    :param cpus: iterable of cpu ids, or a bitmask
+    :return: dict of tid: previous cpu set, for restore_affinity()
+    """
+    if isinstance(cpus, six.integer_types):
+        cpus = mask_to_cpus(cpus)
+    cpus = set(cpus)
+    saved = {}
+    for child in process_tree(pid):
+        for tid in thread_ids(child):
+            _set_affinity(tid, cpus, saved)
+    return saved
+
+
+def restore_affinity(saved):
+    """
+    Restore saved cpu affinities.
+
+    :param saved: dict of tid: cpu set
+    """
+    for tid, cpus in saved.items():
+        try:
+            set_affinity(tid, cpus)
+        except OSError:
+            pass
+
+
+class ThreadPinner(object):
+
+    """
+    Pin the threads of one VM.
+    """
+
+    def __init__(self, vm):
+        """
+        :param vm: VM object, with a QMP monitor
+        """
+        self.vm = vm
+        self.saved = {}
+
+    def threads(self):
+        """
+        Classify the threads of the VM.
+
+        :return: dict with 'vcpu' (list of tids ordered by cpu index),
+                 'iothread' (dict of iothread id: tid), 'vhost' (list of
+                 tids) and 'emulator' (list of the other QEMU tids)
+        """
+        pid = self.vm.get_pid()
+        vcpus = sorted((cpu["cpu-index"], cpu["thread-id"])
+                       for cpu in self.vm.monitor.cmd("query-cpus-fast"))
+        iothreads = dict((iothread["id"], iothread["thread-id"])
+                         for iothread in
+                         self.vm.monitor.cmd("query-iothreads"))
+        vhost_name = "vhost-%s" % pid
+        vhost = [tid for tid in thread_ids(pid)
+                 if thread_name(pid, tid).startswith("vhost-")]
+        # Older kernels run vhost workers as separate kernel threads
+        for comm_path in glob.glob("/proc/[0-9]*/comm"):
+            if _read(comm_path).strip() == vhost_name:
+                vhost.append(int(comm_path.split("/")[2]))
+        known = set(tid for _, tid in vcpus) | set(iothreads.values()) | \
+            set(vhost)
+        return {"vcpu": [tid for _, tid in vcpus],
+                "iothread": iothreads,
+                "vhost": sorted(set(vhost)),
+                "emulator": [tid for tid in thread_ids(pid)
+                             if tid not in known]}
+
+    def pin(self, tids, cpus):
+        """
+        Pin threads to cpus, saving their first known masks.
+
+        :param tids: iterable of thread ids
+        :param cpus: iterable of cpu ids
+        """
+        cpus = set(cpus)
+        for tid in tids:
+            _set_affinity(tid, cpus, self.saved)
+
+    def pin_to_node(self, node=-1):
+        """
+        Pin the VM to the cpus of one host NUMA node: every vCPU and vhost
+        thread gets its own cpu as long as there are enough of them, the
+        iothreads and emulator threads float over the whole node.
+
+        :param node: 1-based host node number as in utils_misc.NumaNode,
+                     negative values count from the last node
+        :return: node id the VM was pinned to
+        """
+        nodes = numa_nodes()
+        node = int(node)
+        node = sorted(nodes)[node - 1 if node > 0 else node]
+        cpus = nodes[node]
+        threads = self.threads()
+        dedicated = threads["vcpu"] + threads["vhost"]
+        for i, tid in enumerate(dedicated):
+            self.pin([tid], [cpus[i % len(cpus)]])
+        self.pin(list(threads["iothread"].values()) + threads["emulator"],
+                 cpus)
+        logging.info("Pinned %d vCPU, %d vhost, %d iothread and %d emulator "
+                     "threads of %s to host node %s", len(threads["vcpu"]),
+                     len(threads["vhost"]), len(threads["iothread"]),
+                     len(threads["emulator"]), self.vm.name, node)
+        return node
+
+    def placement(self):
+        """
+        Get the current placement of the VM threads.
+
+        :return: dict of kind: {tid: {"cpus": [...], "nodes": [...]}}
+        """
+        cpu_node = {}
+        for node, cpus in numa_nodes().items():
+            for cpu in cpus:
+                cpu_node[cpu] = node
+        result = {}
+        for kind, tids in self.threads().items():
+            if isinstance(tids, dict):
+                tids = tids.values()
+            result[kind] = {}
+            for tid in tids:
+                try:
+                    cpus = sorted(get_affinity(tid))
+                except OSError:
+                    continue
+                result[kind][tid] = {
+                    "cpus": cpus,
+                    "nodes": sorted(set(cpu_node.get(c) for c in cpus))}
+        return result
+
+    def verify_node(self, node):
+        """
+        Check that every VM thread only runs on one host node.
+
+        :param node: host node id
+        :return: list of (kind, tid, nodes) of the misplaced threads
+        """
+        misplaced = []
+        for kind, threads in self.placement().items():
+            for tid, place in threads.items():
+                if place["nodes"] != [node]:
+                    misplaced.append((kind, tid, place["nodes"]))
+        return misplaced
+
+    def restore(self):
+        """Restore the masks of every thread pinned so far."""
+        restore_affinity(self.saved)
+        self.saved = {}
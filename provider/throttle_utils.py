@@ -18,6 +18,9 @@ from virttest.qemu_monitor import QMPCmdError
 
 from virttest.qemu_devices.qdevices import QThrottleGroup
 
+from provider.session_pool import guest_session
+from provider.session_pool import pooled
+
 
 class ThrottleError(Exception):
     """ General Throttle error"""
@@ -315,14 +318,14 @@ class ThrottleTester(object):
             self._test.error("Please set fio first")
         image_info = args[0]
         fio_option = image_info["fio_option"]
-        session = self._vm.wait_for_login()
         cmd = ' '.join((self._fio.cfg.fio_path, fio_option))
         burst = self._throttle["expected"]["burst"]
         expected_burst = burst["read"] + burst["write"] + burst["total"]
         if expected_burst:
             cmd += " && " + cmd
         logging.info("run_fio:%s", cmd)
-        out = session.cmd(cmd, 1800)
+        with guest_session(self._vm) as session:
+            out = session.cmd(cmd, 1800)
         image_info["output"] = self._generate_output_by_json(out)
         return image_info["output"]
 
@@ -419,6 +422,7 @@ class ThrottleTester(object):
         pool.join()
         return self.check_output(self.images)
 
+    @pooled
     def start(self):
         """
         Process one disk and multi disks throttle testing.
@@ -700,6 +704,7 @@ class ThrottleGroupsTester(object):
         else:
             raise ThrottleError("No found the corresponding group tester.")
 
+    @pooled
     def start(self):
         """
         Start multi groups testing parallel.
@@ -0,0 +1,219 @@
+"""
+Module for booting many VMs at once.
+
+Available classes:
+- VMLauncher: Boot a set of VMs in parallel within a concurrency window,
+              log into them asynchronously and record the time to login of
+              every VM and the host resources at every density level.
+
+The concurrency window bounds the number of VMs booting at the same time,
+from the creation of their QEMU process to their login. The QEMU processes
+themselves are created one at a time under CREATE_LOCK: the create lock of
+avocado-vt only serializes processes, and the port and MAC address
+allocation of concurrent create() calls from threads of one process race.
+Guests boot and log in in parallel. Every launched VM gets a result:
+{"name", "start" (seconds since launch), "create_s", "login_s",
+"time_to_login_s", "error"}, and every login a density sample:
+{"vms" (VMs logged in), "t", "host_mem_available_mb", "qemu_rss_mb",
+"host_cpu_busy" (fraction since the previous sample), "loadavg"}.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from virttest import env_process
+
+from provider.host_stats import CpuSnapshot, host_memory, process_memory
+
+# Held by every thread creating a VM
+CREATE_LOCK = threading.Lock()
+
+
+class VMLauncher(object):
+
+    """
+    Parallel VM boot with per VM and per density level accounting.
+    """
+
+    def __init__(self, test, params, env, concurrency=None,
+                 login_timeout=None):
+        """
+        :param test: QEMU test object
+        :param params: Dictionary with the test parameters
+        :param env: Dictionary with test environment
+        :param concurrency: VMs booting at the same time,
+                            'vm_launch_concurrency' (4) by default
+        :param login_timeout: login timeout of every VM
+        """
+        self.test = test
+        self.params = params
+        self.env = env
+        self.concurrency = int(concurrency or
+                               params.get("vm_launch_concurrency", 4))
+        self.login_timeout = float(login_timeout or
+                                   params.get("login_timeout", 360))
+        self.results = {}
+        self.sessions = {}
+        self.density = []
+        self._lock = threading.Lock()
+        self._window = threading.Semaphore(self.concurrency)
+        self._start = None
+        self._cpu = None
+        self._vms = []
+
+    def clone(self, template, names):
+        """
+        Clone VMs from a template VM and register them.
+
+        :param template: VM object to clone, e.g. the main VM
+        :param names: names of the new VMs
+        :return: list of VM objects, not started
+        """
+        vms = []
+        for name in names:
+            vm = template.clone(name, template.params.copy())
+            self.env.register_vm(name, vm)
+            if name not in self.params.objects("vms"):
+                self.params["vms"] += " " + name
+            vms.append(vm)
+        return vms
+
+    def define(self, names):
+        """
+        Create and register the VM objects of VMs defined in the params,
+        without starting them.
+
+        :param names: VM names
+        :return: list of VM objects
+        """
+        vms = []
+        for name in names:
+            vm_params = self.params.object_params(name)
+            vm_params["start_vm"] = "no"
+            env_process.preprocess_vm(self.test, vm_params, self.env, name)
+            vms.append(self.env.get_vm(name))
+        return vms
+
+    def _sample(self):
+        """Take a density sample, call with the lock held."""
+        cpu = CpuSnapshot()
+        busy = cpu - self._cpu
+        self._cpu = cpu
+        rss = 0.0
+        for vm in self._vms:
+            try:
+                rss += process_memory(vm.get_pid()).get("rss", 0)
+            except Exception:
+                # Not created yet or already gone
+                continue
+        sample = {"vms": len(self.sessions),
+                  "t": round(time.time() - self._start, 3),
+                  "host_mem_available_mb": host_memory().get("available"),
+                  "qemu_rss_mb": rss,
+                  "host_cpu_busy": (busy["host_busy"] / busy["host_total"]
+                                    if busy["host_total"] else None),
+                  "loadavg": os.getloadavg()[0]}
+        self.density.append(sample)
+        return sample
+
+    def _boot(self, vm, login):
+        result = {"name": vm.name, "start": None, "create_s": None,
+                  "login_s": None, "time_to_login_s": None, "error": None}
+        self.results[vm.name] = result
+        try:
+            with self._window:
+                begin = time.time()
+                result["start"] = round(begin - self._start, 3)
+                with CREATE_LOCK:
+                    vm.create()
+                vm.verify_alive()
+                created = time.time()
+                result["create_s"] = created - begin
+                if login:
+                    session = vm.wait_for_login(timeout=self.login_timeout)
+                    done = time.time()
+                    result["login_s"] = done - created
+                    result["time_to_login_s"] = done - begin
+                    with self._lock:
+                        self.sessions[vm.name] = session
+                        sample = self._sample()
+                    logging.info("%s logged in after %.1fs, %d VMs up, "
+                                 "%.0f MB host memory available", vm.name,
+                                 result["time_to_login_s"], sample["vms"],
+                                 sample["host_mem_available_mb"])
+        except Exception as details:
+            result["error"] = str(details)
+            logging.error("Failed to boot %s: %s", vm.name, details)
+
+    def launch(self, vms, login=True):
+        """
+        Boot VMs, at most 'concurrency' of them at the same time, and wait
+        until all of them logged in or failed.
+
+        :param vms: list of VM objects, e.g. from clone() or define()
+        :param login: whether to log into every VM
+        :return: list of the results of these VMs, in order
+        """
+        if self._start is None:
+            self._start = time.time()
+            self._cpu = CpuSnapshot()
+        self._vms.extend(vms)
+        threads = []
+        for vm in vms:
+            thread = threading.Thread(target=self._boot, args=(vm, login))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return [self.results[vm.name] for vm in vms]
+
+    def failed(self):
+        """Names of the VMs that failed to boot or log in"""
+        return [name for name, result in self.results.items()
+                if result["error"]]
+
+    def summary(self):
+        """
+        Summarize the launch.
+
+        :return: dict with the number of VMs booted and failed, the
+                 min/avg/max time to login and the peak density sample
+        """
+        times = [r["time_to_login_s"] for r in self.results.values()
+                 if r["time_to_login_s"] is not None]
+        result = {"concurrency": self.concurrency,
+                  "launched": len(self.results),
+                  "logged_in": len(times), "failed": len(self.failed())}
+        if times:
+            result.update({"time_to_login_min_s": min(times),
+                           "time_to_login_avg_s": sum(times) / len(times),
+                           "time_to_login_max_s": max(times)})
+        if self.density:
+            result["peak"] = self.density[-1]
+        return result
+
+    def save(self, result_dir, tag="vm_launch"):
+        """
+        Write the per VM results and the density samples as JSON.
+
+        :param result_dir: directory to store the file
+        :param tag: file name without extension
+        :return: path of the file
+        """
+        path = os.path.join(result_dir, "%s.json" % tag)
+        with open(path, "w") as launch_file:
+            json.dump({"summary": self.summary(),
+                       "vms": [self.results[vm.name] for vm in self._vms
+                               if vm.name in self.results],
+                       "density": self.density}, launch_file, indent=2)
+        return path
+
+    def close_sessions(self):
+        """Close the login sessions of every VM."""
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
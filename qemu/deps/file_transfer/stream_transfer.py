@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Streaming file transfer between guests with on the fly hashing.
+
+Receiver side, accept a number of streams and store (or discard) them:
+
+    stream_transfer.py receive -p 5201 -n 4 -d /var/tmp/recv
+
+Sender side, push a file over one TCP stream:
+
+    stream_transfer.py send -a 192.168.122.10:5201 -f /var/tmp/data
+
+Every stream starts with 'DATA <size> <name> <hash>', the receiver hashes
+the payload while writing it and answers 'DIGEST <hexdigest>'.  Each end
+prints one line 'RESULT: <json>' per stream with bytes, seconds, MB/s and
+the digest, so integrity is checked without reading the file back.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import optparse
+import threading
+
+
+def recv_line(sock, pending):
+    while b"\n" not in pending:
+        data = sock.recv(65536)
+        if not data:
+            raise IOError("Connection closed by peer")
+        pending += data
+    line, pending = pending.split(b"\n", 1)
+    return line.decode().split(), pending
+
+
+def report(result):
+    sys.stdout.write("RESULT: %s\n" % json.dumps(result))
+    sys.stdout.flush()
+
+
+def send(options):
+    host, port = options.address.rsplit(":", 1)
+    size = os.path.getsize(options.file)
+    name = options.name or os.path.basename(options.file)
+    hasher = hashlib.new(options.hash)
+    sock = socket.create_connection((host, int(port)), options.timeout)
+    result = {"role": "sender", "peer": options.address, "name": name}
+    try:
+        start = time.time()
+        sock.sendall(("DATA %d %s %s\n" % (size, name, options.hash)).encode())
+        with open(options.file, "rb") as src:
+            while True:
+                data = src.read(options.block_size)
+                if not data:
+                    break
+                sock.sendall(data)
+                hasher.update(data)
+        reply, _ = recv_line(sock, b"")
+        elapsed = time.time() - start
+        result.update({"bytes": size, "seconds": elapsed,
+                       "mbps": size / 1048576.0 / elapsed if elapsed else 0,
+                       "digest": hasher.hexdigest(),
+                       "peer_digest": reply[1]})
+    except (IOError, OSError, socket.error) as err:
+        result["error"] = str(err)
+    finally:
+        sock.close()
+    report(result)
+    return "error" not in result
+
+
+def handle(conn, peer, options, lock):
+    result = {"role": "receiver", "peer": peer[0]}
+    try:
+        header, pending = recv_line(conn, b"")
+        size, name, hash_name = int(header[1]), header[2], header[3]
+        hasher = hashlib.new(hash_name)
+        path = os.devnull
+        if options.dir:
+            path = os.path.join(options.dir, "%s-%s-%d" %
+                                (name, peer[0], peer[1]))
+        start = time.time()
+        remaining = size - len(pending)
+        with open(path, "wb") as dst:
+            dst.write(pending)
+            hasher.update(pending)
+            while remaining > 0:
+                data = conn.recv(min(options.block_size, remaining))
+                if not data:
+                    raise IOError("Stream truncated, %d bytes missing" %
+                                  remaining)
+                dst.write(data)
+                hasher.update(data)
+                remaining -= len(data)
+        elapsed = time.time() - start
+        digest = hasher.hexdigest()
+        conn.sendall(("DIGEST %s\n" % digest).encode())
+        if options.dir and options.clean:
+            os.remove(path)
+        result.update({"name": name, "bytes": size, "seconds": elapsed,
+                       "mbps": size / 1048576.0 / elapsed if elapsed else 0,
+                       "digest": digest})
+    except (IOError, OSError, socket.error, IndexError, ValueError) as err:
+        result["error"] = str(err)
+    finally:
+        conn.close()
+    with lock:
+        report(result)
+
+
+def receive(options):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", options.port))
+    server.listen(max(options.count, 16))
+    server.settimeout(options.timeout)
+    if options.dir and not os.path.isdir(options.dir):
+        os.makedirs(options.dir)
+    sys.stdout.write("LISTENING %d\n" % options.port)
+    sys.stdout.flush()
+    lock = threading.Lock()
+    workers = []
+    try:
+        for _ in range(options.count):
+            conn, peer = server.accept()
+            conn.settimeout(options.timeout)
+            worker = threading.Thread(target=handle,
+                                      args=(conn, peer, options, lock))
+            worker.start()
+            workers.append(worker)
+    finally:
+        server.close()
+        for worker in workers:
+            worker.join()
+    return True
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog send|receive [options]")
+    parser.add_option("-a", "--address", help="receiver host:port")
+    parser.add_option("-f", "--file", help="file to send")
+    parser.add_option("--name", help="stream name, file name by default")
+    parser.add_option("-p", "--port", type="int", default=5201)
+    parser.add_option("-n", "--count", type="int", default=1,
+                      help="number of streams to receive")
+    parser.add_option("-d", "--dir",
+                      help="store received streams here, discard if unset")
+    parser.add_option("--clean", action="store_true", default=False,
+                      help="remove every stored stream once verified")
+    parser.add_option("-b", "--block-size", type="int", default=1 << 20)
+    parser.add_option("--hash", default="sha256")
+    parser.add_option("--timeout", type="float", default=600)
+    options, args = parser.parse_args()
+    if not args or args[0] not in ("send", "receive"):
+        parser.error("action must be 'send' or 'receive'")
+    action = send if args[0] == "send" else receive
+    return 0 if action(options) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
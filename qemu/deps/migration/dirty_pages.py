@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Deterministic guest memory dirtier for migration tests.
+
+Allocate a working set and rewrite its pages at a fixed rate:
+
+    dirty_pages.py -s 1024 -r 200 -p hotcold --hot-ratio 0.1 --seed 1
+
+Every rewritten page gets a fresh 8 byte counter at its start, so every
+write really changes the page, followed by data that is random for the
+first (1 - compressibility) part of the page and zeros for the rest.
+Pages are picked sequentially, uniformly at random, or with a hot/cold
+split where 'hot-weight' of the writes go to 'hot-ratio' of the pages.
+The page order only depends on the seed, so two runs with the same
+options dirty the same pages in the same order.
+
+Once the working set is allocated and touched 'READY <json>' is printed,
+then 'RATE: <json>' every report interval and 'RESULT: <json>' when the
+duration ends or on SIGTERM/SIGINT, with the achieved dirty rate.
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import random
+import signal
+import struct
+import optparse
+
+MB = 1048576
+
+
+class Dirtier(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.page_size = mmap.PAGESIZE
+        self.pages = options.size * MB // self.page_size
+        self.buf = mmap.mmap(-1, self.pages * self.page_size,
+                             mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+        self.view = memoryview(self.buf)
+        self.rng = random.Random(options.seed)
+        random_len = int(self.page_size * (1 - options.compressibility))
+        random_len = max(min(random_len, self.page_size - 8), 0)
+        # A pool of page bodies, picked in turn, so the data stays
+        # incompressible without calling urandom for every write.
+        self.bodies = [bytes(bytearray(self.rng.getrandbits(8)
+                                       for _ in range(random_len))) +
+                       b"\0" * (self.page_size - 8 - random_len)
+                       for _ in range(64)]
+        order = list(range(self.pages))
+        self.rng.shuffle(order)
+        hot = max(int(self.pages * options.hot_ratio), 1)
+        self.hot, self.cold = order[:hot], order[hot:] or order[:hot]
+        self.next_page = self._picker()
+        self.written = 0
+        self.stopped = False
+
+    def _picker(self):
+        pattern = self.options.pattern
+        rng = self.rng
+        if pattern == "sequential":
+            state = [-1]
+
+            def pick():
+                state[0] = (state[0] + 1) % self.pages
+                return state[0]
+        elif pattern == "random":
+            def pick():
+                return rng.randrange(self.pages)
+        else:
+            hot, cold = self.hot, self.cold
+            weight = self.options.hot_weight
+
+            def pick():
+                pool = hot if rng.random() < weight else cold
+                return pool[rng.randrange(len(pool))]
+        return pick
+
+    def touch_all(self):
+        zero = b"\0" * self.page_size
+        for page in range(self.pages):
+            offset = page * self.page_size
+            self.view[offset:offset + self.page_size] = zero
+            self.view[offset] = 1
+
+    def write_page(self, page):
+        offset = page * self.page_size
+        self.written += 1
+        self.view[offset:offset + 8] = struct.pack("=Q", self.written)
+        self.view[offset + 8:offset + self.page_size] = \
+            self.bodies[self.written % len(self.bodies)]
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def report(self, tag, elapsed, pages):
+        mbytes = pages * self.page_size / float(MB)
+        result = {"seconds": round(elapsed, 3), "pages": pages,
+                  "mb": round(mbytes, 3),
+                  "mbps": round(mbytes / elapsed, 3) if elapsed else 0,
+                  "target_mbps": self.options.rate}
+        sys.stdout.write("%s %s\n" % (tag, json.dumps(result)))
+        sys.stdout.flush()
+
+    def run(self):
+        options = self.options
+        batch = max(options.batch * MB // self.page_size, 1)
+        pages_per_sec = options.rate * MB / float(self.page_size)
+        start = last_report = time.time()
+        last_written = 0
+        while not self.stopped:
+            for _ in range(batch):
+                self.write_page(self.next_page())
+            now = time.time()
+            elapsed = now - start
+            if options.duration and elapsed >= options.duration:
+                break
+            if now - last_report >= options.interval:
+                self.report("RATE:", now - last_report,
+                            self.written - last_written)
+                last_report, last_written = now, self.written
+            if pages_per_sec:
+                ahead = self.written / pages_per_sec - elapsed
+                if ahead > 0:
+                    time.sleep(ahead)
+        self.report("RESULT:", time.time() - start, self.written)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--size", type="int", default=512,
+                      help="working set in MB")
+    parser.add_option("-r", "--rate", type="float", default=0,
+                      help="dirty rate in MB/s, 0 for as fast as possible")
+    parser.add_option("-p", "--pattern", default="sequential",
+                      choices=["sequential", "random", "hotcold"])
+    parser.add_option("--hot-ratio", type="float", default=0.1,
+                      help="part of the working set that is hot")
+    parser.add_option("--hot-weight", type="float", default=0.9,
+                      help="part of the writes that go to the hot pages")
+    parser.add_option("-c", "--compressibility", type="float", default=0.5,
+                      help="zero filled part of every page, 0 to 1")
+    parser.add_option("-d", "--duration", type="float", default=0,
+                      help="seconds to run, 0 to run until killed")
+    parser.add_option("-i", "--interval", type="float", default=1,
+                      help="seconds between two RATE reports")
+    parser.add_option("-b", "--batch", type="int", default=1,
+                      help="MB written between two rate checks")
+    parser.add_option("--seed", type="int", default=0)
+    options, _ = parser.parse_args()
+    if not 0 <= options.compressibility <= 1:
+        parser.error("compressibility must be between 0 and 1")
+    dirtier = Dirtier(options)
+    signal.signal(signal.SIGTERM, dirtier.stop)
+    signal.signal(signal.SIGINT, dirtier.stop)
+    dirtier.touch_all()
+    sys.stdout.write("READY %s\n" % json.dumps(
+        {"pid": os.getpid(), "pages": dirtier.pages,
+         "page_size": dirtier.page_size}))
+    sys.stdout.flush()
+    dirtier.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
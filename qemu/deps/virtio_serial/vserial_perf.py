@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+Virtio-serial throughput harness.
+
+The same script runs on the host, attached to the chardev backing a
+virtserialport, and in the guest, on /dev/virtio-ports/<name>.  Both ends
+synchronise with a readiness handshake on the channel itself, so neither
+side has to be started first:
+
+    host  -> guest   HELLO
+    guest -> host    READY
+    sender           DATA <size> <hash>, followed by <size> payload bytes
+    receiver         DIGEST <hexdigest>
+
+Payload is taken from a pool of random bytes (incompressible) or from a
+file, and both ends hash it incrementally while it streams.  Each end
+prints one line 'RESULT: <json>' with throughput, per-chunk latency and
+stall statistics.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import select
+import hashlib
+import optparse
+
+
+HELLO = b"HELLO"
+READY = b"READY"
+DATA = b"DATA"
+DIGEST = b"DIGEST"
+
+
+class ChannelError(Exception):
+    pass
+
+
+class Channel(object):
+
+    """
+    Byte stream over a socket or a character device with line support.
+    """
+
+    def __init__(self, transport, path, timeout, buffer_size):
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self._pending = b""
+        self._sock = None
+        self._fd = None
+        if transport == "unix_socket":
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._connect(path)
+        elif transport == "tcp_socket":
+            host, port = path.rsplit(":", 1)
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._connect((host, int(port)))
+        else:
+            self._fd = os.open(path, os.O_RDWR)
+            if transport == "pty":
+                import tty
+                tty.setraw(self._fd)
+        if self._sock:
+            for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                self._sock.setsockopt(socket.SOL_SOCKET, opt, buffer_size)
+
+    def _connect(self, address):
+        end_time = time.time() + self.timeout
+        while True:
+            try:
+                self._sock.connect(address)
+                return
+            except socket.error:
+                if time.time() > end_time:
+                    raise
+                time.sleep(0.1)
+
+    def fileno(self):
+        if self._sock:
+            return self._sock.fileno()
+        return self._fd
+
+    def _wait(self, readable):
+        rlist, wlist = ([self], []) if readable else ([], [self])
+        if not any(select.select(rlist, wlist, [], self.timeout)):
+            raise ChannelError("Channel idle for more than %ss" %
+                               self.timeout)
+
+    def send(self, data):
+        view = memoryview(data)
+        while len(view):
+            self._wait(readable=False)
+            try:
+                if self._sock:
+                    sent = self._sock.send(view)
+                else:
+                    sent = os.write(self._fd, view)
+            except (OSError, socket.error) as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            view = view[sent:]
+
+    def _read(self, size):
+        self._wait(readable=True)
+        if self._sock:
+            data = self._sock.recv(size)
+        else:
+            data = os.read(self._fd, size)
+        if not data:
+            raise ChannelError("Channel closed by peer")
+        return data
+
+    def recv(self, size):
+        if self._pending:
+            data, self._pending = self._pending[:size], self._pending[size:]
+            return data
+        return self._read(size)
+
+    def send_line(self, *words):
+        self.send(b" ".join(words) + b"\n")
+
+    def recv_line(self):
+        while b"\n" not in self._pending:
+            self._pending += self._read(self.buffer_size)
+        line, self._pending = self._pending.split(b"\n", 1)
+        return line.split()
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+        else:
+            os.close(self._fd)
+
+
+class Payload(object):
+
+    """
+    Chunk generator for the sender side.
+    """
+
+    def __init__(self, chunk_size, pool_size, data_file=None):
+        self._file = open(data_file, "rb") if data_file else None
+        if not self._file:
+            pool = os.urandom(max(pool_size, chunk_size))
+            self._pool = memoryview(pool + pool)
+            self._pool_size = len(pool)
+            self._offset = 0
+        self.chunk_size = chunk_size
+
+    def next_chunk(self, size):
+        if self._file:
+            return self._file.read(size)
+        chunk = self._pool[self._offset:self._offset + size]
+        # Advance by an odd stride so consecutive chunks never line up
+        # on identical pool content.
+        self._offset = (self._offset + size + 4093) % self._pool_size
+        return chunk
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = int(round((len(sorted_values) - 1) * pct / 100.0))
+    return sorted_values[index]
+
+
+def summarize(role, size, elapsed, latencies, stall_threshold, digest):
+    latencies.sort()
+    stalls = [lat for lat in latencies if lat >= stall_threshold]
+    result = {"role": role,
+              "bytes": size,
+              "seconds": elapsed,
+              "mbps": size / 1048576.0 / elapsed if elapsed else 0.0,
+              "chunks": len(latencies),
+              "digest": digest,
+              "latency": {"min": latencies[0] if latencies else 0.0,
+                          "avg": (sum(latencies) / len(latencies)
+                                  if latencies else 0.0),
+                          "p50": percentile(latencies, 50),
+                          "p90": percentile(latencies, 90),
+                          "p99": percentile(latencies, 99),
+                          "max": latencies[-1] if latencies else 0.0},
+              "stalls": len(stalls),
+              "stall_seconds": sum(stalls)}
+    return result
+
+
+def send_data(channel, options):
+    size = options.size
+    if options.data_file:
+        size = os.path.getsize(options.data_file)
+    payload = Payload(options.chunk_size, options.pool_size,
+                      options.data_file)
+    hasher = hashlib.new(options.hash)
+    channel.send_line(DATA, str(size).encode(), options.hash.encode())
+    latencies = []
+    remaining = size
+    start = time.time()
+    try:
+        while remaining:
+            chunk = payload.next_chunk(min(options.chunk_size, remaining))
+            if not chunk:
+                raise ChannelError("Data file shrank during transfer")
+            chunk_start = time.time()
+            channel.send(chunk)
+            latencies.append(time.time() - chunk_start)
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    finally:
+        payload.close()
+    reply = channel.recv_line()
+    elapsed = time.time() - start
+    if reply[0] != DIGEST:
+        raise ChannelError("Unexpected reply %r" % reply)
+    result = summarize("sender", size, elapsed, latencies,
+                       options.stall_threshold, hasher.hexdigest())
+    result["peer_digest"] = reply[1].decode()
+    return result
+
+
+def receive_data(channel, options):
+    header = channel.recv_line()
+    if header[0] != DATA:
+        raise ChannelError("Unexpected header %r" % header)
+    size = int(header[1])
+    hasher = hashlib.new(header[2].decode())
+    out = open(options.data_file, "wb") if options.data_file else None
+    latencies = []
+    remaining = size
+    chunk_left = options.chunk_size
+    start = chunk_start = time.time()
+    try:
+        while remaining:
+            data = channel.recv(min(options.buffer_size, remaining))
+            hasher.update(data)
+            if out:
+                out.write(data)
+            remaining -= len(data)
+            chunk_left -= len(data)
+            if chunk_left <= 0 or not remaining:
+                now = time.time()
+                latencies.append(now - chunk_start)
+                chunk_start = now
+                chunk_left += options.chunk_size
+    finally:
+        if out:
+            out.close()
+    elapsed = time.time() - start
+    digest = hasher.hexdigest()
+    channel.send_line(DIGEST, digest.encode())
+    return summarize("receiver", size, elapsed, latencies,
+                     options.stall_threshold, digest)
+
+
+def handshake(channel, side):
+    if side == "host":
+        channel.send_line(HELLO)
+        expected = READY
+    else:
+        expected = HELLO
+    line = channel.recv_line()
+    if not line or line[0] != expected:
+        raise ChannelError("Handshake failed, got %r" % line)
+    if side == "guest":
+        channel.send_line(READY)
+
+
+def parse_size(value):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--side", choices=["host", "guest"], default="guest")
+    parser.add_option("-t", "--transport", default="device",
+                      help="unix_socket, tcp_socket, pty or device")
+    parser.add_option("-p", "--path",
+                      help="socket path, host:port or device node")
+    parser.add_option("-a", "--action", choices=["send", "receive"])
+    parser.add_option("-s", "--size", default="100M")
+    parser.add_option("-c", "--chunk-size", default="64K")
+    parser.add_option("-b", "--buffer-size", default="64K")
+    parser.add_option("--pool-size", default="16M")
+    parser.add_option("-f", "--data-file",
+                      help="send this file / store received data here")
+    parser.add_option("--hash", default="sha256")
+    parser.add_option("--stall-threshold", type="float", default=0.1)
+    parser.add_option("--timeout", type="float", default=60)
+    options, _ = parser.parse_args()
+    for name in ("size", "chunk_size", "buffer_size", "pool_size"):
+        setattr(options, name, parse_size(getattr(options, name)))
+    if options.side == "guest" and options.transport == "device":
+        if not options.path.startswith("/"):
+            options.path = "/dev/virtio-ports/%s" % options.path
+
+    channel = Channel(options.transport, options.path, options.timeout,
+                      options.buffer_size)
+    try:
+        handshake(channel, options.side)
+        if options.action == "send":
+            result = send_data(channel, options)
+        else:
+            result = receive_data(channel, options)
+    except (ChannelError, OSError, socket.error) as err:
+        result = {"error": str(err)}
+    finally:
+        channel.close()
+    result["side"] = options.side
+    sys.stdout.write("RESULT: %s\n" % json.dumps(result))
+    sys.stdout.flush()
+    return 1 if "error" in result else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
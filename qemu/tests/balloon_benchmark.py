@@ -0,0 +1,247 @@
+import os
+import json
+import logging
+
+from virttest import error_context
+from virttest import utils_misc
+
+from provider.dirty_pages import DirtyPageWorkload
+from provider.host_stats import Sampler
+from provider.host_stats import process_memory
+from qemu.tests.balloon_check import BallooningTestWin
+from qemu.tests.balloon_check import BallooningTestLinux
+
+
+class RssSampler(Sampler):
+
+    """
+    Memory of the QEMU process sampled from a thread.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        """
+        :param pid: QEMU process id
+        :param interval: seconds between two samples
+        """
+        super(RssSampler, self).__init__(interval)
+        self.pid = pid
+
+    def sample(self):
+        """Append the current memory of the process to the samples."""
+        memory = process_memory(self.pid)
+        with self._lock:
+            self.samples.append((self.elapsed(), memory))
+
+    def settled(self, settle_time, threshold):
+        """
+        Whether the RSS moved less than threshold MB in the last
+        settle_time seconds.
+        """
+        with self._lock:
+            samples = list(self.samples)
+        if not samples or samples[-1][0] < settle_time:
+            return False
+        last = samples[-1][0]
+        window = [s["rss"] for t, s in samples
+                  if t >= last - settle_time and "rss" in s]
+        return bool(window) and max(window) - min(window) < threshold
+
+    def summary(self, threshold):
+        """
+        Summarize how the RSS changed over the sampling.
+
+        :param threshold: MB from the final RSS to consider it reached
+        :return: dict with the RSS/PSS before and after, the reclaimed MB
+                 and the seconds until the RSS got within threshold of
+                 its final value
+        """
+        samples = [(t, s) for t, s in self.samples if "rss" in s]
+        if not samples:
+            return {}
+        first, last = samples[0][1], samples[-1][1]
+        latency = 0.0
+        for t, memory in reversed(samples):
+            if abs(memory["rss"] - last["rss"]) >= threshold:
+                break
+            latency = t
+        return {"rss_before_mb": first["rss"], "rss_after_mb": last["rss"],
+                "pss_after_mb": last.get("pss"),
+                "anon_huge_after_mb": last.get("anon_huge"),
+                "rss_reclaimed_mb": first["rss"] - last["rss"],
+                "rss_latency_s": latency}
+
+
+def ballooned_mb(record):
+    """
+    Guest memory taken by a balloon operation: guest memory before minus
+    guest memory after, positive when the balloon inflates and negative
+    when it deflates.
+
+    :param record: balloon tracker record
+    """
+    return record["start_mb"] - record["end_mb"]
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Balloon inflate/deflate and host memory reclaim benchmark:
+    1) Boot a guest with a balloon device, with free-page-reporting and
+       deflate-on-oom as configured, and start a memory dirtier in the
+       guest (optional).
+    2) inflate_deflate: balloon the guest to every ratio of
+       'balloon_bench_ratios', recording the balloon rate from the monitor
+       and how much and how fast the QEMU RSS follows.
+    3) free_page_reporting: let the guest dirty memory, stop the dirtier
+       and record how much and how fast the freed memory leaves the QEMU
+       RSS without any balloon operation.
+    4) deflate_on_oom: inflate the balloon, put the guest under memory
+       pressure and record how far and how fast the balloon deflates.
+    5) Write the results to balloon_benchmark.json/.RHS, 'balloon_mb'
+       being the guest memory before minus after every balloon operation.
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    if params['os_type'] == 'windows':
+        balloon_test = BallooningTestWin(test, params, env)
+    else:
+        balloon_test = BallooningTestLinux(test, params, env)
+    vm = balloon_test.vm
+    pid = vm.get_pid()
+    balloon_timeout = float(params.get("balloon_timeout", 480))
+    rss_interval = float(params.get("balloon_bench_rss_interval", 0.2))
+    rss_settle_time = float(params.get("balloon_bench_rss_settle_time", 5))
+    rss_threshold = float(params.get("balloon_bench_rss_threshold", 32))
+    rss_timeout = float(params.get("balloon_bench_rss_timeout", 120))
+    repeats = int(params.get("balloon_bench_repeats", 1))
+
+    def measure(action):
+        """Run a balloon action and follow the QEMU RSS until it settles"""
+        sampler = RssSampler(pid, rss_interval)
+        sampler.start()
+        try:
+            result = action() or {}
+            utils_misc.wait_for(lambda: sampler.settled(rss_settle_time,
+                                                        rss_threshold),
+                                rss_timeout, step=rss_interval)
+        finally:
+            sampler.stop()
+        result.update(sampler.summary(rss_threshold))
+        return result
+
+    def balloon_to(target):
+        """Balloon the guest and get the tracked balloon operation"""
+        balloon_test.balloon_memory(target)
+        balloon_test.current_mmem = balloon_test.get_ballooned_memory()
+        record = balloon_test.tracker.records[-1]
+        return {"target_mb": target, "direction": record["direction"],
+                "balloon_mb": ballooned_mb(record),
+                "balloon_time_s": record["duration"],
+                "rate_mbps": record["rate_mbps"]}
+
+    def inflate_deflate():
+        workload = None
+        if params.get("balloon_bench_workload", "yes") == "yes":
+            workload = DirtyPageWorkload(vm, params, "balloon_bench")
+            workload.start()
+        min_sz, max_sz = balloon_test.get_memory_boundary()
+        results = []
+        try:
+            for _ in range(repeats):
+                for ratio in params.objects("balloon_bench_ratios"):
+                    target = int(min(max(balloon_test.ori_mem * float(ratio),
+                                         min_sz), max_sz))
+                    result = measure(lambda: balloon_to(target))
+                    result["ratio"] = float(ratio)
+                    results.append(result)
+        finally:
+            if workload:
+                workload.stop()
+        return results
+
+    def free_page_reporting():
+        workload = DirtyPageWorkload(vm, params.object_params(
+            "free_page_reporting"), "balloon_bench_fpr")
+        results = []
+        for _ in range(repeats):
+            workload.start()
+            # The dirtier frees its working set when it exits
+            result = measure(lambda: {"workload": workload.stop()})
+            result["direction"] = "free_page_reporting"
+            results.append(result)
+        return results
+
+    def deflate_on_oom():
+        pressure = DirtyPageWorkload(vm, params.object_params(
+            "deflate_on_oom"), "balloon_bench_oom")
+        ratio = float(params.get("balloon_bench_oom_ratio", 0.5))
+        results = []
+        for _ in range(repeats):
+            balloon_to(int(balloon_test.ori_mem * ratio))
+
+            def pressurize():
+                balloon_test.tracker.mark()
+                try:
+                    pressure.start()
+                except RuntimeError as details:
+                    # Without deflate-on-oom the guest may kill the dirtier
+                    logging.warning("%s", details)
+                    pressure.info = None
+                record = balloon_test.tracker.wait(balloon_timeout)
+                return {"direction": record["direction"],
+                        "balloon_mb": ballooned_mb(record),
+                        "balloon_time_s": record["duration"],
+                        "rate_mbps": record["rate_mbps"],
+                        "workload_started": pressure.info is not None}
+            try:
+                result = measure(pressurize)
+            finally:
+                pressure.stop()
+            results.append(result)
+            balloon_to(balloon_test.ori_mem)
+        return results
+
+    phases = {"inflate_deflate": inflate_deflate,
+              "free_page_reporting": free_page_reporting,
+              "deflate_on_oom": deflate_on_oom}
+    results = {}
+    try:
+        for phase in params.objects("balloon_bench_phases"):
+            error_context.context("Benchmark balloon %s" % phase,
+                                  logging.info)
+            results[phase] = phases[phase]()
+            if vm.is_alive():
+                balloon_test.reset_memory()
+    finally:
+        balloon_test.save_balloon_records("balloon_benchmark_rates")
+        balloon_test.close_sessions()
+        with open(os.path.join(test.resultsdir,
+                               "balloon_benchmark.json"), "w") as f:
+            json.dump({"free_page_reporting": params.get(
+                           "balloon_opt_free_page_reporting", "no"),
+                       "deflate_on_oom": params.get(
+                           "balloon_opt_deflate_on_oom", "no"),
+                       "ori_mem_mb": balloon_test.ori_mem,
+                       "phases": results}, f, indent=2)
+        with open(os.path.join(test.resultsdir,
+                               "balloon_benchmark.RHS"), "w") as f:
+            f.write("Phase|Direction|Target(MB)|Ballooned(MB)|Balloon(s)|"
+                    "Rate(MB/s)|Reclaimed(MB)|RSS latency(s)\n")
+            for phase, records in results.items():
+                for r in records:
+                    f.write("%s|%s|%s\n" % (phase, r.get("direction"), "|".join(
+                        "-" if r.get(key) is None else "%.2f" % r[key]
+                        for key in ("target_mb", "balloon_mb",
+                                    "balloon_time_s", "rate_mbps",
+                                    "rss_reclaimed_mb", "rss_latency_s"))))
+
+    min_reclaim = params.get("balloon_bench_fpr_min_reclaim")
+    if min_reclaim and "free_page_reporting" in results:
+        low = [r.get("rss_reclaimed_mb", 0) for r in
+               results["free_page_reporting"]
+               if r.get("rss_reclaimed_mb", 0) < float(min_reclaim)]
+        if low:
+            test.fail("Free page reporting only gave back %s MB to the host, "
+                      "expected %s MB" % (low, min_reclaim))
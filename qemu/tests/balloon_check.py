@@ -1,5 +1,7 @@
+import os
 import time
 import re
+import json
 import logging
 import random
 
@@ -11,6 +13,8 @@ from virttest import utils_misc
 from virttest import error_context
 from virttest.utils_test.qemu import MemoryBaseTest
 
+from provider.balloon_tracker import BalloonTracker
+
 
 class BallooningTest(MemoryBaseTest):
 
@@ -23,6 +27,16 @@ class BallooningTest(MemoryBaseTest):
         super(BallooningTest, self).__init__(test, params, env)
 
         self.vm = env.get_vm(params["main_vm"])
+        stats_path = None
+        if (params.get("balloon_stats_polling", "no") == "yes" and
+                params.get("balloon")):
+            stats_path = (params.get("base_path", "/machine/peripheral/") +
+                          params["balloon"])
+        self.tracker = BalloonTracker(
+            self.vm, float(params.get("balloon_track_interval", 0.5)),
+            float(params.get("balloon_settle_time", 3)), stats_path,
+            int(params.get("balloon_track_polling_interval", 2)),
+            int(params.get("guest_stable_threshold", 100)))
         if params.get("paused_after_start_vm") != "yes":
             self.params["balloon_test_setup_ready"] = False
             if self.params.get('os_type') == 'windows':
@@ -180,6 +194,7 @@ class BallooningTest(MemoryBaseTest):
         """
         self.env["balloon_test"] = 0
         error_context.context("Change VM memory to %s" % new_mem, logging.info)
+        self.tracker.mark()
         try:
             self.vm.balloon(new_mem)
             self.env["balloon_test"] = 1
@@ -200,10 +215,8 @@ class BallooningTest(MemoryBaseTest):
             compare_mem = new_mem
 
         balloon_timeout = float(self.params.get("balloon_timeout", 480))
-        status = utils_misc.wait_for((
-            lambda: compare_mem == self.get_ballooned_memory()),
-            balloon_timeout)
-        if status is None:
+        record = self.tracker.wait(balloon_timeout, target=compare_mem)
+        if not record["settled"]:
             raise exceptions.TestFail("Failed to balloon memory to expect"
                                       " value during %ss" % balloon_timeout)
 
@@ -252,10 +265,21 @@ class BallooningTest(MemoryBaseTest):
 
     def wait_for_balloon_complete(self, timeout):
         """
-        Wait until guest memory don't change
+        Wait until the balloon size and guest memory don't change.
+
+        The balloon size is followed from the host, the guest memory through
+        the balloon statistics, and only without them through the guest.
         """
+        timeout = float(timeout)
+        record = self.tracker.wait(timeout)
+        if not record["settled"]:
+            logging.warning("balloon is not stable after %ss", timeout)
+            return
+        if self.tracker.stats_enabled:
+            return
         logging.info("Wait until guest memory don't change")
         threshold = int(self.params.get("guest_stable_threshold", 100))
+        timeout = max(timeout - record["elapsed"], 0)
         is_stable = self._mem_state(threshold)
         ret = utils_misc.wait_for(lambda: next(is_stable), timeout,
                                   step=float(self.params.get("guest_check_step",
@@ -278,11 +302,13 @@ class BallooningTest(MemoryBaseTest):
         balloon_buffer = int(self.params.get("balloon_buffer", 300))
         if self.params.get('os_type') == 'windows':
             logging.info("Get windows miminum balloon value:")
+            self.tracker.mark()
             self.vm.balloon(1)
             balloon_timeout = self.params.get("balloon_timeout", 900)
             self.wait_for_balloon_complete(balloon_timeout)
             used_size = min((self.get_ballooned_memory() + balloon_buffer),
                             max_size)
+            self.tracker.mark()
             self.vm.balloon(max_size)
             self.wait_for_balloon_complete(balloon_timeout)
             self.ori_gmem = self.get_memory_status()
@@ -362,6 +388,19 @@ class BallooningTest(MemoryBaseTest):
         if self.vm.is_alive():
             self.balloon_memory(self.ori_mem)
 
+    def save_balloon_records(self, name="balloon_rates"):
+        """
+        Write the balloon operations tracked so far, with their inflate and
+        deflate rates, to the results dir.
+
+        :param name: file name without extension
+        :return: path of the file
+        """
+        path = os.path.join(self.test.resultsdir, "%s.json" % name)
+        with open(path, "w") as records_file:
+            json.dump(self.tracker.records, records_file, indent=2)
+        return path
+
     def get_free_mem(self):
         """
         Report free memory detect by OS.
@@ -615,4 +654,5 @@ def run(test, params, env):
     try:
         balloon_test.reset_memory()
     finally:
+        balloon_test.save_balloon_records()
         balloon_test.close_sessions()
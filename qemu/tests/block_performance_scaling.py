@@ -0,0 +1,153 @@
+import os
+import json
+import logging
+import threading
+
+from virttest import error_context
+from virttest import utils_misc
+
+from provider.host_stats import CpuSnapshot
+from provider.storage_benchmark import generate_instance
+
+
+def parse_fio_jobs(output):
+    """
+    Get per job IOPS and latency from fio json output
+
+    :param output: fio output with --output-format=json
+    :return: dict of job name: {"iops": x, "lat_us": y, "p99_us": z}
+    """
+    data = json.loads(output[output.index("{"):])
+    jobs = {}
+    for job in data["jobs"]:
+        iops = 0.0
+        lat = []
+        p99 = 0.0
+        for direction in ("read", "write"):
+            stats = job[direction]
+            if not stats["io_bytes"]:
+                continue
+            iops += stats["iops"]
+            lat.append(stats["lat_ns"]["mean"] / 1000.0)
+            percentiles = stats["clat_ns"].get("percentile", {})
+            p99 = max(p99, percentiles.get("99.000000", 0) / 1000.0)
+        jobs[job["jobname"]] = {"iops": iops,
+                                "lat_us": sum(lat) / len(lat) if lat else 0,
+                                "p99_us": p99}
+    return jobs
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Block performance scaling sweep.
+
+    1) Boot all VMs in 'vms', each with the data disks in 'scaling_disks'.
+    2) For every VM count in 'scaling_vm_counts' and disk count in
+       'scaling_disk_counts', run the same fio job on that many disks of
+       that many VMs at the same time, all fio processes released by one
+       start gate.
+    3) Collect per disk and aggregate IOPS/latency, plus host CPU time per
+       I/O, and write the scaling curve to the results dir.
+
+    Iothread and queue settings are varied through the cfg variants.
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    vms = [env.get_vm(name) for name in params.objects("vms")]
+    disks = params.objects("scaling_disks")
+    vm_counts = [int(n) for n in params.objects("scaling_vm_counts")] or \
+        [len(vms)]
+    disk_counts = [int(n) for n in params.objects("scaling_disk_counts")] or \
+        [len(disks)]
+    runtime = int(params.get("fio_runtime", 60))
+    fio_options = params["fio_options"]
+    cmd_timeout = runtime + int(params.get("fio_timeout_margin", 300))
+
+    fios = []
+    for vm in vms:
+        vm.verify_alive()
+        error_context.context("Install fio in %s" % vm.name, logging.info)
+        fios.append(generate_instance(params, vm, "fio"))
+
+    def disk_path(tag):
+        serial = params.object_params(tag)["drive_serial"]
+        return "$(ls /dev/disk/by-id/*%s | head -n 1)" % serial
+
+    def fio_job(fio, tags, gate, outputs, index):
+        jobs = " ".join("--name=%s --filename=%s" % (tag, disk_path(tag))
+                        for tag in tags)
+        cmd = ("%s --runtime=%d --time_based --output-format=json %s" %
+               (fio_options, runtime, jobs))
+        gate.wait(cmd_timeout)
+        outputs[index] = fio.run(cmd, cmd_timeout)
+
+    curve = []
+    try:
+        for vm_count in vm_counts:
+            for disk_count in disk_counts:
+                active = fios[:vm_count]
+                tags = disks[:disk_count]
+                error_context.context("Run fio on %d disk(s) of %d VM(s)" %
+                                      (disk_count, vm_count), logging.info)
+                # Start gate, opened once every thread is started or one
+                # failed to start, so a failure never leaves others waiting
+                gate = threading.Event()
+                outputs = [None] * vm_count
+                threads = [utils_misc.InterruptedThread(
+                    fio_job, (fio, tags, gate, outputs, i))
+                    for i, fio in enumerate(active)]
+                pids = [vm.get_pid() for vm in vms[:vm_count]]
+                before = CpuSnapshot(pids)
+                try:
+                    for thread in threads:
+                        thread.start()
+                finally:
+                    gate.set()
+                for thread in threads:
+                    thread.join(cmd_timeout)
+                cpu = CpuSnapshot(pids) - before
+
+                per_disk = {}
+                for vm, output in zip(vms, outputs):
+                    for tag, job in parse_fio_jobs(output).items():
+                        per_disk["%s:%s" % (vm.name, tag)] = job
+                total_iops = sum(job["iops"] for job in per_disk.values())
+                total_ios = total_iops * runtime
+                point = {
+                    "vms": vm_count, "disks_per_vm": disk_count,
+                    "iops": total_iops,
+                    "lat_us": (sum(job["lat_us"] for job in per_disk.values())
+                               / len(per_disk)),
+                    "p99_us": max(job["p99_us"] for job in per_disk.values()),
+                    "host_cpu_s": cpu["host_busy"],
+                    "qemu_cpu_s": cpu["processes"],
+                    "host_cpu_us_per_io": (cpu["host_busy"] * 1000000 /
+                                           total_ios if total_ios else 0),
+                    "qemu_cpu_us_per_io": (cpu["processes"] * 1000000 /
+                                           total_ios if total_ios else 0),
+                    "per_disk": per_disk}
+                logging.info("%d VM(s) x %d disk(s): %.0f IOPS, avg lat "
+                             "%.1fus, p99 %.1fus, host CPU %.2fus/IO",
+                             vm_count, disk_count, total_iops,
+                             point["lat_us"], point["p99_us"],
+                             point["host_cpu_us_per_io"])
+                curve.append(point)
+    finally:
+        for fio in fios:
+            fio.clean()
+
+    with open(os.path.join(test.resultsdir, "block_scaling.json"), "w") as f:
+        json.dump({"fio_options": fio_options, "runtime": runtime,
+                   "curve": curve}, f, indent=2)
+    with open(os.path.join(test.resultsdir, "block_scaling.RHS"), "w") as f:
+        f.write("VMs|Disks/VM|IOPS|IOPS/disk|Lat(us)|P99(us)|"
+                "HostCPU(us/IO)|QemuCPU(us/IO)\n")
+        for p in curve:
+            f.write("%d|%d|%.0f|%.0f|%.1f|%.1f|%.2f|%.2f\n" %
+                    (p["vms"], p["disks_per_vm"], p["iops"],
+                     p["iops"] / (p["vms"] * p["disks_per_vm"]),
+                     p["lat_us"], p["p99_us"], p["host_cpu_us_per_io"],
+                     p["qemu_cpu_us_per_io"]))
@@ -0,0 +1,109 @@
+import logging
+import random
+
+from virttest import error_context
+from virttest.utils_numeric import normalize_data_size
+
+from provider import block_dirty_bitmap
+from provider.bitmap_model import DirtyBitmap
+from provider.bitmap_model import pull_bitmaps
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Check exactly which clusters bitmaps mark dirty:
+
+    1) boot VM with an unused data disk
+    2) for every bitmap in 'bitmaps': add the bitmap with its granularity,
+       then write random ranges of the data disk with qemu-io and record
+       them, so a bitmap sees the writes done after it was added
+    3) add a disabled bitmap and merge all bitmaps into it
+    4) disable all bitmaps, read them through an nbd export
+    5) check every bitmap against the recorded writes, the merged bitmap
+       against the union of the bitmaps, the difference of the first two
+       bitmaps against the recorded writes, and the dirty bytes against
+       query-block
+
+    :param test: test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    def write(offset, length):
+        output = vm.monitor.human_monitor_cmd(
+            'qemu-io %s "write -P 0x5a %d %d"' % (node, offset, length))
+        if "wrote" not in output:
+            test.fail("Failed to write %d bytes at %d: %s" %
+                      (length, offset, output))
+
+    def add_bitmap(name, **kwargs):
+        bitmap_params = {"bitmap_name": name, "target_device": node,
+                         "bitmap_granularity": int(params.object_params(
+                             name)["bitmap_granularity"])}
+        bitmap_params.update(kwargs)
+        block_dirty_bitmap.block_dirty_bitmap_add(vm, bitmap_params)
+
+    def expected(name, writes):
+        granularity = int(params.object_params(name)["bitmap_granularity"])
+        return DirtyBitmap.from_extents(size, granularity, writes)
+
+    def check(name, bitmap, expected_bitmap):
+        logging.info("%s: %s", name, bitmap)
+        if bitmap != expected_bitmap:
+            missing, extra = bitmap.diff(expected_bitmap)
+            test.fail("%s is not dirty where expected, missing %s, "
+                      "unexpected %s" % (name, missing, extra))
+
+    vm = env.get_vm(params["main_vm"])
+    vm.verify_alive()
+    source_image = params["source_image"]
+    node = "drive_%s" % source_image
+    size = int(normalize_data_size(
+        params.object_params(source_image)["image_size"], "B"))
+    max_length = int(normalize_data_size(params.get("write_max_size", "1M"),
+                                         "B"))
+    names = params.objects("bitmaps")
+    target = params["bitmap_merge_target"]
+
+    writes = {}
+    for name in names:
+        error_context.context("Add %s and write the data disk" % name,
+                              logging.info)
+        add_bitmap(name)
+        writes[name] = []
+        for _ in range(params.get_numeric("writes_per_phase", 64)):
+            length = random.randrange(512, max_length + 1, 512)
+            offset = random.randrange(0, size - length + 1, 512)
+            write(offset, length)
+            for recorded in writes.values():
+                recorded.append((offset, length))
+
+    error_context.context("Merge all bitmaps into %s" % target, logging.info)
+    add_bitmap(target, disabled="on")
+    block_dirty_bitmap.block_dirty_bitmap_merge(vm, node, names, target)
+    for name in names:
+        block_dirty_bitmap.block_dirty_bitmap_disable(vm, node, name)
+
+    error_context.context("Read the bitmaps through an nbd export",
+                          logging.info)
+    bitmaps = pull_bitmaps(vm, params, node, names + [target], source_image)
+    counts = dict((b["name"], b["count"]) for b in
+                  block_dirty_bitmap.get_bitmaps_in_device(vm, node))
+    for name, bitmap in bitmaps.items():
+        if bitmap.dirty_bytes() != counts[name]:
+            test.fail("%s has %d dirty bytes, query-block reports %d" %
+                      (name, bitmap.dirty_bytes(), counts[name]))
+
+    error_context.context("Check the bitmaps against the recorded writes",
+                          logging.info)
+    for name in names:
+        check(name, bitmaps[name], expected(name, writes[name]))
+    union = DirtyBitmap(size, bitmaps[target].granularity)
+    for name in names:
+        union = union | bitmaps[name]
+    check(target, bitmaps[target], union)
+    if len(names) > 1:
+        first, second = names[:2]
+        check("%s - %s" % (first, second),
+              bitmaps[first] - bitmaps[second],
+              expected(first, writes[first]) - expected(first, writes[second]))
@@ -2,6 +2,8 @@ import random
 
 from virttest.utils_numeric import normalize_data_size
 
+from provider.bitmap_model import DirtyBitmap
+from provider.bitmap_model import pull_bitmaps
 from provider.block_dirty_bitmap import get_bitmaps_in_device
 from provider.blockdev_live_backup_base import BlockdevLiveBackupBaseTest
 
@@ -48,11 +50,42 @@ class BlockdevIncbkMergeBitmapsDiffGranularityTest(BlockdevLiveBackupBaseTest):
         ]
         self.main_vm.monitor.transaction(job_list)
 
+    def check_merged_bitmap(self):
+        """
+        The merged bitmap should be the union of both bitmaps, converted to
+        its own granularity
+        """
+        job_list = [{'type': 'block-dirty-bitmap-disable',
+                     'data': {'node': self._source_nodes[0], 'name': b}}
+                    for b in self._merged_bitmaps]
+        self.main_vm.monitor.transaction(job_list)
+        names = self._merged_bitmaps + [self._merged_target]
+        bitmaps = pull_bitmaps(self.main_vm, self.params,
+                               self._source_nodes[0], names,
+                               self._source_images[0])
+        counts = dict((b['name'], b['count']) for b in self._get_bitmaps())
+        for name, bitmap in bitmaps.items():
+            if bitmap.dirty_bytes() != counts[name]:
+                self.test.fail('%s has %d dirty bytes, query-block reports '
+                               '%d' % (name, bitmap.dirty_bytes(),
+                                       counts[name]))
+        target = bitmaps[self._merged_target]
+        expected = DirtyBitmap(target.size, target.granularity)
+        for name in self._merged_bitmaps:
+            expected = expected | bitmaps[name]
+        if target != expected:
+            missing, extra = target.diff(expected)
+            self.test.fail('%s is not the union of %s, missing %s, '
+                           'unexpected %s' % (self._merged_target,
+                                              self._merged_bitmaps,
+                                              missing, extra))
+
     def do_test(self):
         self.add_two_bitmaps()
         self.generate_inc_files()
         self.check_bitmaps_count()
         self.merge_two_bitmaps()
+        self.check_merged_bitmap()
 
 
 def run(test, params, env):
@@ -67,6 +100,8 @@ def run(test, params, env):
         5. create a new file
         6. check bitmap count > 0
         7. add a new disabled bitmap and merge the two bitmaps
+        8. disable the two bitmaps, read all bitmaps through an nbd export
+           and check the merged bitmap is the union of the two bitmaps
 
     :param test: test object
     :param params: test configuration dict
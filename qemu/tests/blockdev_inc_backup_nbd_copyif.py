@@ -0,0 +1,101 @@
+import logging
+
+from avocado.utils import process
+
+from virttest import data_dir
+from virttest import error_context
+from virttest import qemu_storage
+from virttest import utils_misc
+from virttest.utils_numeric import normalize_data_size
+
+from provider import backup_utils
+from provider.nbd_image_export import QemuNBDExportImage
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Copy an exported image into qcow2 images with backup_utils.nbd_copyif:
+
+    1) create the source image and the qcow2 targets
+    2) write 'ranges_before' into the source with qemu-io, add a
+       persistent bitmap, then write 'ranges_after'
+    3) export the source read-only with qemu-nbd, with the bitmap
+    4) copy all the allocated data into the full target, and only the
+       ranges dirty in the bitmap into the inc target
+    5) check the full target has the same data as the source, and the inc
+       target has the data of 'ranges_after' only
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    def _image(tag):
+        return qemu_storage.QemuImg(params.object_params(tag),
+                                    data_dir.get_data_dir(), tag)
+
+    def _ranges(name):
+        for item in params.objects(name):
+            offset, length = item.split(":")
+            yield (int(normalize_data_size(offset, "B")),
+                   int(normalize_data_size(length, "B")))
+
+    def _qemu_io(img, cmd):
+        output = process.run("%s -f %s -c '%s' %s" % (
+            qemu_io, img.image_format, cmd, img.image_filename),
+            shell=True).stdout_text
+        if "Pattern verification failed" in output or "error" in output:
+            test.fail("qemu-io '%s' on %s failed: %s" %
+                      (cmd, img.tag, output))
+
+    qemu_io = utils_misc.get_qemu_io_binary(params)
+    qemu_img = utils_misc.get_qemu_img_binary(params)
+    source_tag = params["source_image"]
+    full_tag, inc_tag = params.objects("copy_targets")
+    bitmap = params["bitmap_name"]
+    source = _image(source_tag)
+    images = [source] + [_image(tag) for tag in (full_tag, inc_tag)]
+    for img in images:
+        img.create(img.params)
+
+    exporter = QemuNBDExportImage(params, source_tag)
+    try:
+        error_context.context("Write the source image", logging.info)
+        for offset, length in _ranges("ranges_before"):
+            _qemu_io(source, "write -P %s %d %d" % (
+                params["pattern_before"], offset, length))
+        process.run("%s bitmap --add %s %s" % (
+            qemu_img, source.image_filename, bitmap), shell=True)
+        for offset, length in _ranges("ranges_after"):
+            _qemu_io(source, "write -P %s %d %d" % (
+                params["pattern_after"], offset, length))
+
+        error_context.context("Copy the exported source into %s and %s"
+                              % (full_tag, inc_tag), logging.info)
+        exporter.export_image()
+        nbd_image = params["nbd_image_tag"]
+        full = backup_utils.nbd_copyif(params, nbd_image, full_tag)
+        inc = backup_utils.nbd_copyif(params, nbd_image, inc_tag, bitmap)
+        exporter.stop_export()
+        exporter = None
+        logging.info("Copied %d bytes into %s, %d bytes into %s",
+                     full["copied"], full_tag, inc["copied"], inc_tag)
+
+        error_context.context("Check the copied data", logging.info)
+        result = process.run("%s compare -f %s -F %s %s %s" % (
+            qemu_img, source.image_format, images[1].image_format,
+            source.image_filename, images[1].image_filename),
+            ignore_status=True, shell=True)
+        if result.exit_status:
+            test.fail("%s differs from %s: %s" % (
+                full_tag, source_tag, result.stdout_text))
+        for offset, length in _ranges("ranges_after"):
+            _qemu_io(images[2], "read -P %s %d %d" % (
+                params["pattern_after"], offset, length))
+        for offset, length in _ranges("ranges_before_only"):
+            _qemu_io(images[2], "read -P 0 %d %d" % (offset, length))
+    finally:
+        if exporter is not None:
+            exporter.stop_export()
+        for img in images:
+            img.remove()
@@ -5,6 +5,8 @@ from virttest import error_context
 from virttest import utils_misc
 from virttest import utils_test
 
+from provider.cpu_capabilities import get_capabilities
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -19,7 +21,7 @@ def run(test, params, env):
 
     """
     cpu_vendor = utils_misc.get_cpu_vendor()
-    host_model = utils_misc.get_host_cpu_models()
+    host_model = get_capabilities(params).host_cpu_models()
 
     model_list = params.get("cpu_model")
     if not model_list:
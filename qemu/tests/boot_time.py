@@ -5,6 +5,8 @@ from virttest import utils_misc
 from virttest import env_process
 from virttest.staging import utils_memory
 
+from provider.boot_profiler import BootProfiler
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -14,7 +16,8 @@ def run(test, params, env):
     2) Send a shutdown command to the guest, or issue a system_powerdown
        monitor command (depending on the value of shutdown_method)
     3) Boot up the guest and measure the boot time
-    4) set init run level back to the old one
+    4) Break the boot time down into phases from the serial console
+    5) set init run level back to the old one
 
     :param test: QEMU test object
     :param params: Dictionary with the test parameters
@@ -38,11 +41,15 @@ def run(test, params, env):
         error_context.context("Boot up guest and measure the boot time",
                               logging.info)
         utils_memory.drop_caches()
+        profiler = BootProfiler(vm, params)
         vm.create()
+        profiler.start()
         vm.verify_alive()
         session = vm.wait_for_serial_login(timeout=timeout)
-        boot_time = utils_misc.monotonic_time() - vm.start_monotonic_time
+        login_time = utils_misc.monotonic_time()
+        boot_time = login_time - vm.start_monotonic_time
         test.write_test_keyval({'result': "%ss" % boot_time})
+        profiler.save(test, profiler.stop(login_time), "boot")
         expect_time = int(params.get("expect_bootup_time", "17"))
         logging.info("Boot up time: %ss", boot_time)
 
@@ -29,6 +29,8 @@ from virttest.staging.utils_cgroup import CgroupModules
 from virttest.staging.utils_cgroup import get_load_per_cpu
 from virttest.utils_test import VMStress
 
+from provider.cgroup_sampler import CgroupSampler, jain_index
+
 
 # Serial ID of the attached disk
 RANDOM_DISK_NAME = "RANDOM46464634164145"
@@ -257,42 +259,40 @@ def run(test, params, env):
         def _test(direction):
             """
             Executes loop of dd commands, kills it after $test_time and
-            verifies the speeds using median.
+            verifies the speeds accounted by the blkio cgroups.
             :param direction: "read" / "write"
             :return: "" on success or err message when fails
             """
-            out = []
             # Initiate dd loop on all VMs (2 sessions per VM)
             # can't set bs for scsi_debug, default is 512b
             dd_cmd = get_dd_cmd(direction, count=3)
+            sampler = CgroupSampler(dict((vm.name, vm.get_pid())
+                                         for vm in vms), sample_interval)
             for i in range(no_vms):
                 sessions[i * 2].sendline(dd_cmd)
+            sampler.start()
             time.sleep(test_time)
-            for i in range(no_vms):
-                # Force stats in case no dd cmd finished
-                sessions[i * 2 + 1].sendline(stat_cmd)
-            for i in range(no_vms):
-                out.append(sessions[i * 2].read_until_output_matches(
-                    [re_dd])[1])
+            sampler.stop()
             # Stop all transfers (on 2nd sessions)
             for i in range(no_vms):
                 sessions[i * 2 + 1].sendline(kill_cmd)
-            # Read the rest of the stats
-            for i in range(no_vms):
-                out[-1] = out[-1] + sessions[i * 2].read_up_to_prompt(
-                    timeout=120 + test_time)
-
             for i in range(no_vms):
-                # Get all dd loops' statistics
-                # calculate avg from duration and data
-                duration = 0
-                data = 0
-                if len(out[i]) > 5:
-                    out[i] = out[i][1:-1]
-                for _ in re.findall(re_dd, out[i])[1:-1]:
-                    data += int(_[0])
-                    duration += float(_[2])
-                out[i] = int(data / duration)
+                sessions[i * 2].read_up_to_prompt(timeout=120 + test_time)
+            sampler.save(test.resultsdir, "blkio_bandwidth_%s" % direction)
+
+            counter = "%s_bytes" % direction
+            deltas = sampler.deltas(counter)
+            if len(deltas) != no_vms or not sum(deltas.values()):
+                return ("blkio_bandwidth_%s: no I/O accounted by the blkio "
+                        "cgroups: %s\n" % (direction, deltas))
+            elapsed = sampler.samples[-1]["t"] - sampler.samples[0]["t"]
+            out = [int(deltas[vm.name] / elapsed) for vm in vms]
+            fairness = sampler.summary(counter, dict(
+                (vm.name, weight) for vm, weight in zip(vms, weights)))
+            logging.info("blkio_bandwidth_%s: weighted Jain's fairness index"
+                         " %.3f (min %.3f over %ss intervals)", direction,
+                         fairness["jain_index"], fairness.get("jain_min", 0),
+                         sample_interval)
 
             # normalize each output according to cgroup_weights
             # Calculate the averages from medians / weights
@@ -313,7 +313,7 @@ def run(test, params, env):
                     out[i][0] = 'FAIL'
                     err += "%d, " % i
 
-            logging.info("blkio_bandwidth_%s: dd statistics\n%s", direction,
+            logging.info("blkio_bandwidth_%s: cgroup statistics\n%s", direction,
                          astring.tabular_output(out, ['status', 'norm_weights',
                                                       'norm_out', 'actual']))
 
@@ -333,6 +333,7 @@ def run(test, params, env):
             raise exceptions.TestError("Incorrect configuration: param "
                                        "cgroup_weights have to be list-like string '[1, 2]'")
         test_time = int(params.get("cgroup_test_time", 60))
+        sample_interval = float(params.get("cgroup_sample_interval", 1))
         logging.info("Prepare VMs")
         # Prepare enough VMs each with 1 disk for testing
         no_vms = len(weights)
@@ -363,9 +364,6 @@ def run(test, params, env):
         # Fails only when the session is occupied (Timeout)
         # ; true is necessarily when there is no dd present at the time
         kill_cmd = "rm -f /tmp/cgroup_lock; killall -9 dd; true"
-        stat_cmd = "killall -SIGUSR1 dd; true"
-        re_dd = (r'(\d+) bytes \(\d+\.*\d* \w*(, \d+\.*\d* \w*)?\) copied, '
-                 r'(\d+\.*\d*) s, \d+\.*\d* \w./s')
         err = ""
         try:
             logging.info("Read test")
@@ -813,17 +811,16 @@ def run(test, params, env):
         :param cfg: cgroup_speeds - list of speeds of each vms [vm0, vm1,..].
                     List is sorted in test! '[10000, 100000]'
         """
-        def _get_stat(f_stats, _stats=None):
-            """ Reads CPU times from f_stats[] files and sumarize them. """
-            if _stats is None:
-                _stats = []
-                for i in range(len(f_stats)):
-                    _stats.append(0)
-            stats = []
-            for i in range(len(f_stats)):
-                f_stats[i].seek(0)
-                stats.append(f_stats[i].read().split()[13:17])
-                stats[i] = sum([int(_) for _ in stats[i]]) - _stats[i]
+        def _get_stat(sampler, _stats=None):
+            """
+            Reads the schedstat run time of every VM (all its threads).
+            :param sampler: CgroupSampler of the VMs
+            :param _stats: previous stats to subtract
+            """
+            groups = sampler.sample()["groups"]
+            stats = [groups[vm.name]["run_ns"] for vm in vms]
+            if _stats is not None:
+                stats = [stat - _stat for stat, _stat in zip(stats, _stats)]
             return stats
 
         logging.info("Init")
@@ -878,11 +875,10 @@ def run(test, params, env):
 
         logging.info("Test")
         try:
-            f_stats = []
             err = []
             # Time 0
-            for vm in vms:
-                f_stats.append(open("/proc/%d/stat" % vm.get_pid(), 'r'))
+            sampler = CgroupSampler(dict((vm.name, vm.get_pid())
+                                         for vm in vms))
 
             time_init = 2
             # there are 6 tests
@@ -895,28 +891,28 @@ def run(test, params, env):
             for thread_count in range(0, host_cpus):
                 sessions[thread_count].sendline(cmd)
             time.sleep(time_init)
-            _stats = _get_stat(f_stats)
+            _stats = _get_stat(sampler)
             time.sleep(time_test)
-            stats.append(_get_stat(f_stats, _stats))
+            stats.append(_get_stat(sampler, _stats))
 
             # Overcommit on 1 cpu
             thread_count += 1
             sessions[thread_count].sendline(cmd)
             time.sleep(time_init)
-            _stats = _get_stat(f_stats)
+            _stats = _get_stat(sampler)
             time.sleep(time_test)
-            stats.append(_get_stat(f_stats, _stats))
+            stats.append(_get_stat(sampler, _stats))
 
             # no_speeds overcommit on all CPUs
             for i in range(thread_count + 1, no_threads):
                 sessions[i].sendline(cmd)
             time.sleep(time_init)
-            _stats = _get_stat(f_stats)
+            _stats = _get_stat(sampler)
             for j in range(3):
-                __stats = _get_stat(f_stats)
+                __stats = _get_stat(sampler)
                 time.sleep(time_test)
-                stats.append(_get_stat(f_stats, __stats))
-            stats.append(_get_stat(f_stats, _stats))
+                stats.append(_get_stat(sampler, __stats))
+            stats.append(_get_stat(sampler, _stats))
 
             # Verify results
             err = ""
@@ -960,6 +956,8 @@ def run(test, params, env):
                 norm_stats = [float(stats[i][_]) / speeds[_]
                               for _ in range(len(stats[i]))]
                 dist = distance(min(norm_stats), max(norm_stats))
+                logging.info("3rd part's weighted Jain's fairness index = %s",
+                             jain_index(stats[i], speeds))
                 if dist > min(0.15 + 0.02 * len(vms), 0.25):
                     err += "3, "
                     logging.error("3rd part's limits broken; utilisation "
@@ -970,6 +968,7 @@ def run(test, params, env):
                 else:
                     logging.info("3rd part's norm_dist = %s", dist)
 
+            sampler.save(test.resultsdir, "cpu_share")
             if err:
                 err = "[%s] parts broke their limits" % err[:-2]
                 logging.error(err)
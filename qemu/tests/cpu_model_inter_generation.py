@@ -1,10 +1,11 @@
 import logging
 
 from virttest import cpu
-from virttest import utils_misc
 from virttest import env_process
 from virttest import error_context
 
+from provider.cpu_capabilities import get_capabilities
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -53,13 +54,13 @@ def run(test, params, env):
     vendor = cpu.get_cpu_vendor(cpu_info)
     cpu_model_list = cpu.CPU_TYPES.get(vendor)
     latest_cpu_model = cpu_model_list[-1]
+    caps = get_capabilities(params)
     for cpu_model in cpu_model_list:
-        qemu_binary = utils_misc.get_qemu_binary(params)
-        if cpu_model in cpu.get_qemu_cpu_models(qemu_binary):
+        if cpu_model in caps.qemu_cpu_models():
             latest_cpu_model = cpu_model
             break
 
-    host_cpu_model = cpu.get_qemu_best_cpu_model(params)
+    host_cpu_model = caps.best_model(params.get("default_cpu_model"))
     if host_cpu_model.startswith(latest_cpu_model):
         test.cancel('The host cpu is not old enough for this test.')
 
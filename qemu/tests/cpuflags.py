@@ -6,7 +6,6 @@ import time
 import pickle
 import sys
 import traceback
-from xml.parsers import expat
 
 import aexpect
 
@@ -20,6 +19,8 @@ from virttest import utils_misc
 from virttest import cpu
 from virttest.utils_test.qemu import migration
 
+from provider.cpu_capabilities import get_capabilities
+
 
 def run(test, params, env):
     """
@@ -33,8 +34,7 @@ def run(test, params, env):
     qemu_binary = utils_misc.get_qemu_binary(params)
 
     cpuflags_src = os.path.join(data_dir.get_deps_dir("cpu_flags"), "src")
-    cpuflags_def = os.path.join(data_dir.get_deps_dir("cpu_flags"),
-                                "cpu_map.xml")
+    caps = get_capabilities(params)
     smp = int(params.get("smp", 1))
 
     all_host_supported_flags = params.get("all_host_supported_flags", "no")
@@ -55,8 +55,7 @@ def run(test, params, env):
             self.hw_flags = set(map(utils_misc.Flag,
                                     params.get("host_spec_flags", "").split()))
             self.qemu_support_flags = get_all_qemu_flags()
-            self.host_support_flags = set(map(cpu.Flag,
-                                              cpu.get_cpu_flags()))
+            self.host_support_flags = set(map(cpu.Flag, caps.host_flags()))
             self.quest_cpu_model_flags = (get_guest_host_cpuflags(cpu_model) -
                                           virtual_flags)
 
@@ -131,8 +130,7 @@ def run(test, params, env):
         :param cpumodel: Cpumodel parameter sended to <qemu-kvm-cmd>.
         :return: [corespond flags]
         """
-        cmd = qemu_binary + " -cpu ?dump"
-        output = process.run(cmd).stdout
+        output = caps.cpu_help("?dump")
         re.escape(cpumodel)
         pattern = (r".+%s.*\n.*\n +feature_edx .+ \((.*)\)\n +feature_"
                    r"ecx .+ \((.*)\)\n +extfeature_edx .+ \((.*)\)\n +"
@@ -145,48 +143,6 @@ def run(test, params, env):
             flags += flag_group.split()
         return set(map(cpu.Flag, flags))
 
-    class ParseCpuFlags(object):
-
-        def __init__(self, encoding=None):
-            self.cpus = {}
-            self.parser = expat.ParserCreate(encoding)
-            self.parser.StartElementHandler = self.start_element
-            self.parser.EndElementHandler = self.end_element
-            self.last_arch = None
-            self.last_model = None
-            self.sub_model = False
-            self.all_flags = []
-
-        def start_element(self, name, attrs):
-            if name == "cpus":
-                self.cpus = {}
-            elif name == "arch":
-                self.last_arch = self.cpus[attrs['name']] = {}
-            elif name == "model":
-                if self.last_model is None:
-                    self.last_model = self.last_arch[attrs['name']] = []
-                else:
-                    self.last_model += self.last_arch[attrs['name']]
-                    self.sub_model = True
-            elif name == "feature":
-                if self.last_model is not None:
-                    self.last_model.append(attrs['name'])
-                else:
-                    self.all_flags.append(attrs['name'])
-
-        def end_element(self, name):
-            if name == "arch":
-                self.last_arch = None
-            elif name == "model":
-                if self.sub_model is False:
-                    self.last_model = None
-                else:
-                    self.sub_model = False
-
-        def parse_file(self, file_path):
-            self.parser.ParseFile(open(file_path, 'r'))
-            return self.cpus
-
     def get_guest_host_cpuflags_1350(cpumodel):
         """
         Get cpu flags correspond with cpumodel parameters.
@@ -194,19 +150,13 @@ def run(test, params, env):
         :param cpumodel: Cpumodel parameter sended to <qemu-kvm-cmd>.
         :return: [corespond flags]
         """
-        p = ParseCpuFlags()
-        cpus = p.parse_file(cpuflags_def)
-        flags = []
-        for arch in cpus.values():
-            if cpumodel in arch.keys():
-                flags = arch[cpumodel]
+        flags = caps.cpu_map_models().get(cpumodel, [])
         return set(map(cpu.Flag, flags))
 
     get_guest_host_cpuflags_BAD = get_guest_host_cpuflags_1350
 
     def get_all_qemu_flags_legacy():
-        cmd = qemu_binary + " -cpu ?cpuid"
-        output = process.run(cmd).stdout
+        output = caps.cpu_help("?cpuid")
 
         flags_re = re.compile(r".*\n.*f_edx:(.*)\n.*f_ecx:(.*)\n"
                               ".*extf_edx:(.*)\n.*extf_ecx:(.*)")
@@ -218,8 +168,7 @@ def run(test, params, env):
         return set(map(cpu.Flag, flags))
 
     def get_all_qemu_flags_1350():
-        cmd = qemu_binary + " -cpu ?"
-        output = process.run(cmd).stdout
+        output = caps.cpu_help("?")
 
         flags_re = re.compile(r".*Recognized CPUID flags:\n(.*)", re.DOTALL)
         m = flags_re.search(output)
@@ -236,9 +185,7 @@ def run(test, params, env):
         :param cpumodel: Cpumodel parameter sended to <qemu-kvm-cmd>.
         :return: [corespond flags]
         """
-        p = ParseCpuFlags()
-        p.parse_file(cpuflags_def)
-        return set(map(cpu.Flag, p.all_flags))
+        return set(map(cpu.Flag, caps.cpu_map_features()))
 
     def get_cpu_models_legacy():
         """
@@ -246,8 +193,7 @@ def run(test, params, env):
 
         :return: cpu models.
         """
-        cmd = qemu_binary + " -cpu ?"
-        output = process.run(cmd).stdout
+        output = caps.cpu_help("?")
 
         cpu_re = re.compile(r"\w+\s+\[?(\w+)\]?")
         return cpu_re.findall(output)
@@ -258,8 +204,7 @@ def run(test, params, env):
 
         :return: cpu models.
         """
-        cmd = qemu_binary + " -cpu ?"
-        output = process.run(cmd).stdout
+        output = caps.cpu_help("?")
 
         cpu_re = re.compile(r"x86\s+\[?(\w+)\]?")
         return cpu_re.findall(output)
@@ -267,17 +212,12 @@ def run(test, params, env):
     get_cpu_models_BAD = get_cpu_models_1350
 
     def get_qemu_cpu_cmd_version():
-        cmd = qemu_binary + " -cpu ?cpuid"
-        try:
-            process.run(cmd).stdout
+        if caps.cpu_help("?cpuid") is not None:
             return "legacy"
-        except:
-            cmd = qemu_binary + " -cpu ?"
-            output = process.run(cmd).stdout
-            if "CPUID" in output:
-                return "1350"
-            else:
-                return "BAD"
+        if "CPUID" in caps.cpu_help("?"):
+            return "1350"
+        else:
+            return "BAD"
 
     qcver = get_qemu_cpu_cmd_version()
 
@@ -309,8 +249,7 @@ def run(test, params, env):
         cpumodel = flags[0]
 
         qemu_model_flag = get_guest_host_cpuflags(cpumodel)
-        host_support_flag = set(map(cpu.Flag,
-                                    cpu.get_cpu_flags()))
+        host_support_flag = set(map(cpu.Flag, caps.host_flags()))
         real_flags = qemu_model_flag & host_support_flag
 
         for f in flags[1:]:
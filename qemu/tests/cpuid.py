@@ -1,11 +1,10 @@
 """
 Group of cpuid tests for X86 CPU
 """
-import re
 import os
+import json
 import logging
 
-from avocado.utils import build
 from avocado.utils import process
 
 from virttest import utils_misc
@@ -14,6 +13,9 @@ from virttest import env_process
 from virttest import virt_vm
 from virttest import data_dir
 
+from provider import cpuid_sweep
+from provider.cpuid_sweep import parse_cpuid_dump
+
 logger = logging.getLogger(__name__)
 dbg = logger.debug
 info = logger.info
@@ -40,6 +42,7 @@ def run(test, params, env):
     qemu_binary = utils_misc.get_qemu_binary(params)
 
     cpu_model = params.get("cpu_model", "qemu64")
+    test_kernel_dir = os.path.join(data_dir.get_deps_dir(), "cpuid", "src")
 
     xfail = False
     if (params.get("xfail") is not None) and (params.get("xfail") == "yes"):
@@ -104,49 +107,18 @@ def run(test, params, env):
             if ba != bb:
                 yield (bit, ba, bb)
 
-    def parse_cpuid_dump(output):
-        dbg("parsing cpuid dump: %r", output)
-        cpuid_re = re.compile(
-            "^ *(0x[0-9a-f]+) +0x([0-9a-f]+): +eax=0x([0-9a-f]+) ebx=0x([0-9a-f]+) ecx=0x([0-9a-f]+) edx=0x([0-9a-f]+)$")
-        output_match = re.search('(==START TEST==.*==END TEST==)', output, re.M | re.DOTALL)
-        if output_match is None:
-            dbg("cpuid dump doesn't follow expected pattern")
-            return None
-        output = output_match.group(1)
-        out_lines = output.splitlines()
-        if out_lines[0] != '==START TEST==' or out_lines[-1] != '==END TEST==':
-            dbg("cpuid dump doesn't have expected delimiters")
-            return None
-        if out_lines[1] != 'CPU:':
-            dbg("cpuid dump doesn't start with 'CPU:' line")
-            return None
-        result = {}
-        for l in out_lines[2:-1]:
-            m = cpuid_re.match(l)
-            if m is None:
-                dbg("invalid cpuid dump line: %r", l)
-                return None
-            in_eax = int(m.group(1), 16)
-            in_ecx = int(m.group(2), 16)
-            result[in_eax, in_ecx, 'eax'] = int(m.group(3), 16)
-            result[in_eax, in_ecx, 'ebx'] = int(m.group(4), 16)
-            result[in_eax, in_ecx, 'ecx'] = int(m.group(5), 16)
-            result[in_eax, in_ecx, 'edx'] = int(m.group(6), 16)
-        return result
-
     def get_test_kernel_cpuid(self, vm):
         vm.resume()
 
         timeout = float(params.get("login_timeout", 240))
         logging.debug("Will wait for CPUID serial output at %r",
                       vm.serial_console)
-        if not utils_misc.wait_for(lambda:
-                                   re.search("==END TEST==",
-                                             vm.serial_console.get_output()),
-                                   timeout, 1):
+        output = cpuid_sweep.wait_for_serial(vm, cpuid_sweep.END_MARKER,
+                                             timeout)
+        if output is None:
             test.fail("Could not get test complete message.")
 
-        test_output = parse_cpuid_dump(vm.serial_console.get_output())
+        test_output = parse_cpuid_dump(output)
         logging.debug("Got CPUID serial output: %r", test_output)
         if test_output is None:
             test.fail("Test output signature not found in "
@@ -180,14 +152,12 @@ def run(test, params, env):
 
     def get_guest_cpuid(self, cpu_model, feature=None, extra_params=None, qom_mode=False):
         if not qom_mode:
-            test_kernel_dir = os.path.join(data_dir.get_deps_dir(), "cpuid", "src")
-            build.make(test_kernel_dir, extra_args="cpuid_dump_kernel.bin")
+            test_kernel = cpuid_sweep.build_test_kernel(test_kernel_dir)
 
         vm_name = params['main_vm']
         params_b = params.copy()
         if not qom_mode:
-            params_b["kernel"] = os.path.join(
-                test_kernel_dir, "cpuid_dump_kernel.bin")
+            params_b["kernel"] = test_kernel
         params_b["cpu_model"] = cpu_model
         params_b["cpu_model_flags"] = feature
         del params_b["images"]
@@ -534,17 +504,9 @@ def run(test, params, env):
         if (has_error is False) and (xfail is True):
             test.fail("Test was expected to fail, but it didn't")
 
-    def check_cpuid_dump(self):
-        """
-        Compare full CPUID dump data
-        """
-        machine_type = params.get("machine_type_to_check", "")
-        kvm_enabled = params.get("enable_kvm", "yes") == "yes"
-
-        ignore_cpuid_leaves = params.get("ignore_cpuid_leaves", "")
-        ignore_cpuid_leaves = ignore_cpuid_leaves.split()
+    def cpuid_whitelist(ignore_cpuid_leaves):
         whitelist = []
-        for leaf in ignore_cpuid_leaves:
+        for leaf in ignore_cpuid_leaves.split():
             leaf = leaf.split(',')
             # syntax of ignore_cpuid_leaves:
             # <in_eax>[,<in_ecx>[,<register>[ ,<bit>]]] ...
@@ -552,18 +514,72 @@ def run(test, params, env):
                 if len(leaf) > i:
                     leaf[i] = int(leaf[i], 0)
             whitelist.append(tuple(leaf))
+        return whitelist
+
+    def full_cpu_model_name(cpu_model, cpu_model_flags):
+        if cpu_model_flags:
+            return cpu_model + ',' + cpu_model_flags.lstrip(',')
+        return cpu_model
+
+    def cpuid_reference_file(machine_type, full_name):
+        kvm_enabled = params.get("enable_kvm", "yes") == "yes"
+        return os.path.join(data_dir.get_deps_dir(), 'cpuid',
+                            "cpuid_dumps",
+                            kvm_enabled and "kvm" or "nokvm",
+                            machine_type, '%s-dump.txt' % (full_name))
+
+    def compare_cpuid_dump(reference, out, whitelist, ok_missing,
+                           masks=None):
+        """
+        Log the bits of out not matching reference.
+
+        :param masks: dict of (in_eax, in_ecx, register): mask of the bits
+                      to compare, all bits if None
+        :return: number of non-matching bits not whitelisted
+        """
+        errors = 0
+        for k in reference.keys():
+            in_eax, in_ecx, reg = k
+            if masks is not None and k not in masks:
+                continue
+            diffs = compare_cpuid_output(reference[k], out.get(k))
+            for d in diffs:
+                bit, vreference, vout = d
+                if masks is not None and not masks[k] & (1 << bit):
+                    continue
+                whitelisted = (in_eax,) in whitelist \
+                    or (in_eax, in_ecx) in whitelist \
+                    or (in_eax, in_ecx, reg) in whitelist \
+                    or (in_eax, in_ecx, reg, bit) in whitelist
+                silent = False
+
+                if vout is None and ok_missing:
+                    whitelisted = True
+                    silent = True
+
+                if not silent:
+                    info(
+                        "Non-matching bit: CPUID[0x%x,0x%x].%s[%d]: found %s instead of %s%s",
+                        in_eax, in_ecx, reg, bit, vout, vreference,
+                        whitelisted and " (whitelisted)" or "")
+
+                if not whitelisted:
+                    errors += 1
+        return errors
+
+    def check_cpuid_dump(self):
+        """
+        Compare full CPUID dump data
+        """
+        machine_type = params.get("machine_type_to_check", "")
+
+        whitelist = cpuid_whitelist(params.get("ignore_cpuid_leaves", ""))
 
         if not machine_type:
             test.cancel("No machine_type_to_check defined")
         cpu_model_flags = params.get('cpu_model_flags', '')
-        full_cpu_model_name = cpu_model
-        if cpu_model_flags:
-            full_cpu_model_name += ','
-            full_cpu_model_name += cpu_model_flags.lstrip(',')
-        ref_file = os.path.join(data_dir.get_deps_dir(), 'cpuid',
-                                "cpuid_dumps",
-                                kvm_enabled and "kvm" or "nokvm",
-                                machine_type, '%s-dump.txt' % (full_cpu_model_name))
+        full_name = full_cpu_model_name(cpu_model, cpu_model_flags)
+        ref_file = cpuid_reference_file(machine_type, full_name)
         if not os.path.exists(ref_file):
             test.cancel("no cpuid dump file: %s" % (ref_file))
         reference = open(ref_file, 'r').read()
@@ -589,38 +605,112 @@ def run(test, params, env):
                      "flag restricted to guest" in output)) \
                     or ("Unable to find CPU definition:" in output):
                 test.cancel(
-                    "Can't run CPU model %s on this host" % (full_cpu_model_name))
+                    "Can't run CPU model %s on this host" % (full_name))
             else:
                 raise
         dbg('ref_file: %r', ref_file)
         dbg('ref: %r', reference)
         dbg('out: %r', out)
-        ok = True
-        for k in reference.keys():
-            in_eax, in_ecx, reg = k
-            diffs = compare_cpuid_output(reference[k], out.get(k))
-            for d in diffs:
-                bit, vreference, vout = d
-                whitelisted = (in_eax,) in whitelist \
-                    or (in_eax, in_ecx) in whitelist \
-                    or (in_eax, in_ecx, reg) in whitelist \
-                    or (in_eax, in_ecx, reg, bit) in whitelist
-                silent = False
-
-                if vout is None and params.get('ok_missing', 'no') == 'yes':
-                    whitelisted = True
-                    silent = True
+        ok_missing = params.get('ok_missing', 'no') == 'yes'
+        if compare_cpuid_dump(reference, out, whitelist, ok_missing):
+            test.fail("Unexpected CPUID data")
 
-                if not silent:
-                    info(
-                        "Non-matching bit: CPUID[0x%x,0x%x].%s[%d]: found %s instead of %s%s",
-                        in_eax, in_ecx, reg, bit, vout, vreference,
-                        whitelisted and " (whitelisted)" or "")
+    def sweep_cpuid_dump(self):
+        """
+        Compare full CPUID dump data of every model in cpu_models with
+        every machine type in machine_types_to_check, in one test.
+
+        In QOM mode the models are expanded through QMP on one paused
+        QEMU per machine type, only the feature bits known by cpu_map.xml
+        are compared. Otherwise the test kernel runs in
+        cpuid_sweep_concurrency VMs at a time. cpu_model_flags and
+        ignore_cpuid_leaves can be set per model with a _<model> suffix.
+        """
+        qom_mode = params.get('qom_mode', "no").lower() == 'yes'
+        ok_missing = params.get('ok_missing', 'no') == 'yes'
+        machine_types = params.objects("machine_types_to_check")
+        if not machine_types:
+            test.cancel("No machine_types_to_check defined")
+
+        cpu_map = os.path.join(data_dir.get_deps_dir("cpu_flags"),
+                               "cpu_map.xml")
+        sweep = cpuid_sweep.CpuidSweep(test, params, env,
+                                       cpu_map=qom_mode and cpu_map or None)
+        jobs = []
+        report = []
+        for machine_type in machine_types:
+            for model in sorted(cpu_models_to_test()):
+                model_params = params.object_params(model)
+                flags = model_params.get("cpu_model_flags", "")
+                full_name = full_cpu_model_name(model, flags)
+                ref_file = cpuid_reference_file(machine_type, full_name)
+                reference = None
+                if os.path.exists(ref_file):
+                    with open(ref_file) as dump_file:
+                        reference = parse_cpuid_dump(dump_file.read())
+                result = {"machine_type": machine_type, "cpu_model": full_name,
+                          "result": "skipped", "reason": None}
+                report.append(result)
+                if reference is None:
+                    result["reason"] = "no valid cpuid dump file: %s" % ref_file
+                    continue
+                jobs.append((machine_type, model, flags, reference,
+                             cpuid_whitelist(model_params.get(
+                                 "ignore_cpuid_leaves", "")), result))
+
+        def _check(out, job, masks=None):
+            machine_type, model, flags, reference, whitelist, result = job
+            info("Checking %s with machine type %s", result["cpu_model"],
+                 machine_type)
+            errors = compare_cpuid_dump(reference, out, whitelist,
+                                        ok_missing, masks)
+            result["result"] = errors and "fail" or "pass"
+            if errors:
+                result["reason"] = "%d unexpected bits" % errors
 
-                if not whitelisted:
-                    ok = False
-        if not ok:
-            test.fail("Unexpected CPUID data")
+        try:
+            if qom_mode:
+                for job in jobs:
+                    if job[1] not in sweep.definitions(job[0]):
+                        job[-1]["reason"] = ("Unable to find CPU definition: "
+                                             "%s" % job[1])
+                        continue
+                    out, masks = sweep.expand(job[0], job[1], job[2])
+                    _check(out, job, masks)
+            else:
+                kernel_jobs = []
+                for job in jobs:
+                    runnable, reason = sweep.runnable(job[0], job[1],
+                                                      job[2])
+                    if runnable:
+                        kernel_jobs.append(job)
+                    else:
+                        job[-1]["reason"] = reason
+                sweep.close()
+                kernel = cpuid_sweep.build_test_kernel(test_kernel_dir)
+                outputs = sweep.run_kernel(kernel, [
+                    (job[0], job[1], job[2] + ",enforce")
+                    for job in kernel_jobs])
+                for job, output in zip(kernel_jobs, outputs):
+                    if output["cpuid"] is None:
+                        job[-1]["reason"] = output["error"]
+                        if not output["skipped"]:
+                            job[-1]["result"] = "error"
+                        continue
+                    _check(output["cpuid"], job)
+        finally:
+            sweep.close()
+
+        with open(os.path.join(test.resultsdir, "cpuid_sweep.json"),
+                  "w") as result_file:
+            json.dump(report, result_file, indent=2)
+        failed = ["%s/%s: %s" % (result["machine_type"], result["cpu_model"],
+                                 result["reason"])
+                  for result in report if result["result"] in ("fail", "error")]
+        if failed:
+            test.fail("Unexpected CPUID data: %s" % "; ".join(failed))
+        if not [result for result in report if result["result"] == "pass"]:
+            test.cancel("No CPU model could be checked on this host")
 
     # subtests runner
     test_type = params["test_type"]
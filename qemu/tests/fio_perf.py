@@ -1,5 +1,6 @@
 import os
 import re
+import json
 import six
 import time
 import threading
@@ -7,9 +8,12 @@ import logging
 
 from avocado.utils import process
 
-from virttest import utils_misc, utils_test, utils_numeric
+from virttest import utils_misc, utils_numeric
 from virttest import data_dir
 
+from provider.kvm_stats import KvmStats
+from provider.thread_pinning import ThreadPinner
+
 
 def format_result(result, base="12", fbase="2"):
     """
@@ -142,9 +146,7 @@ def run(test, params, env):
         :param node: which numa node to pin
         """
         if node:
-            if not isinstance(node, utils_misc.NumaNode):
-                node = utils_misc.NumaNode(int(node))
-            utils_test.qemu.pin_vm_threads(vm, node)
+            ThreadPinner(vm).pin_to_node(node)
 
     def fio_install(tarball):
         """
@@ -223,6 +225,10 @@ def run(test, params, env):
     if format == "True":
         session.cmd(pre_cmd, cmd_timeout)
 
+    # KVM exits by reason of every scenario
+    kvm_stats = KvmStats(vm)
+    exits = {}
+
     # get order_list
     order_line = ""
     for order in order_list.split():
@@ -253,16 +259,16 @@ def run(test, params, env):
                         if s:
                             test.fail("Failed to free memory: %s" % o)
                     cpu_file = os.path.join(data_dir.get_tmp_dir(), "cpus")
-                    io_exits_b = int(process.system_output(
-                        "cat /sys/kernel/debug/kvm/exits"))
+                    scenario = "%s_%s_%s_%s" % (io_pattern, bs, io_depth,
+                                                numjobs)
+                    kvm_stats.mark("%s_begin" % scenario)
                     fio_t = threading.Thread(target=fio_thread)
                     fio_t.start()
                     process.system_output("mpstat 1 60 > %s" % cpu_file,
                                           shell=True)
                     fio_t.join()
 
-                    io_exits_a = int(process.system_output(
-                        "cat /sys/kernel/debug/kvm/exits"))
+                    kvm_stats.mark("%s_end" % scenario)
                     vm.copy_files_from(guest_result_file,
                                        data_dir.get_tmp_dir())
                     fio_result_file = os.path.join(data_dir.get_tmp_dir(),
@@ -302,7 +308,9 @@ def run(test, params, env):
                     iowait = float(ret.split()[5])
                     cpu = 100 - idle - iowait
                     normal = bw / cpu
-                    io_exits = io_exits_a - io_exits_b
+                    exits[scenario] = kvm_stats.exits("%s_begin" % scenario,
+                                                      "%s_end" % scenario)
+                    io_exits = exits[scenario].get("exits", 0)
                     for result in bw, iops, lat, cpu, normal:
                         line += "%s|" % format_result(result)
                     if os_type == "windows":
@@ -317,4 +325,8 @@ def run(test, params, env):
                     guest_result_file, fio_path, cmd_timeout)
 
     result_file.close()
+    kvm_stats.save(test.resultsdir, "fio_perf")
+    with open(utils_misc.get_path(test.resultsdir,
+                                  "fio_kvm_exits.json"), "w") as exits_file:
+        json.dump(exits, exits_file, indent=2)
     session.close()
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import logging
+
+from virttest import error_context
+from virttest import utils_test
+from virttest.qemu_devices import qdevices
+from virttest.utils_numeric import normalize_data_size
+from virttest.utils_test.qemu import MemoryHotplugTest
+
+from provider.latency_stats import summarize
+
+MB = 1048576
+SHRINK = ("unplug", "resize_down")
+EVENTS = ("ACPI_DEVICE_OST", "DEVICE_DELETED", "MEMORY_DEVICE_SIZE_CHANGE")
+# ACPI _OST source event codes: device check, eject request and OSPM
+# eject, and the status codes that are not errors: success and eject in
+# progress
+OST_INSERT = (1,)
+OST_EJECT = (3, 0x103)
+OST_OK = (0, 0x80)
+
+
+class MemoryHotplugStress(MemoryHotplugTest):
+
+    """
+    Plug and unplug memory devices in batches and time every operation from
+    the QMP command to the QEMU event and to the guest memory state.
+    """
+
+    def __init__(self, test, params, env):
+        super(MemoryHotplugStress, self).__init__(test, params, env)
+        self.vm = env.get_vm(params["main_vm"])
+        self.timeout = float(params.get("hotplug_stress_timeout", 120))
+        self.interval = float(params.get("hotplug_stress_interval", 0.2))
+        self.check_guest = params.get("os_type") == "linux"
+        self.ops = []
+        self.block_size = None
+
+    def _wall_time(self, event):
+        stamp = event.get("timestamp", {})
+        if "seconds" not in stamp:
+            return time.time()
+        return stamp["seconds"] + stamp.get("microseconds", 0) / 1000000.0
+
+    def memory_regions(self):
+        """
+        Get the guest physical region of every memory device.
+
+        :return: dict of device id: (address, size in bytes), the size of a
+                 virtio-mem device is its maximum size
+        """
+        regions = {}
+        for dev in self.vm.monitor.cmd("query-memory-devices"):
+            data = dev["data"]
+            addr = data.get("addr", data.get("memaddr"))
+            regions[data["id"]] = (addr, data.get("max-size", data["size"]))
+        return regions
+
+    def guest_online_mb(self, session, regions):
+        """
+        Get how much of every region the guest has online.
+
+        :param session: guest session
+        :param regions: dict of id: (address, size in bytes)
+        :return: dict of id: online MB
+        """
+        if self.block_size is None:
+            self.block_size = int(session.cmd_output(
+                "cat /sys/devices/system/memory/block_size_bytes").strip(), 16)
+        output = session.cmd_output("grep -H . /sys/devices/system/memory/"
+                                    "memory*/state", timeout=60)
+        online = set()
+        for line in output.splitlines():
+            path, _, state = line.partition(":")
+            if state.strip() == "online":
+                online.add(int(path.split("/")[-2][len("memory"):]))
+        result = {}
+        for dev_id, (addr, size) in regions.items():
+            first = addr // self.block_size
+            blocks = range(first, first + size // self.block_size)
+            result[dev_id] = (len([b for b in blocks if b in online]) *
+                              self.block_size / float(MB))
+        return result
+
+    def _start(self, kind, dev_id, size, stages, command):
+        # Plugs wait for 'size' to be online, unplugs for nothing online
+        op = {"kind": kind, "id": dev_id, "size_mb": size / float(MB),
+              "target_mb": 0 if kind == "unplug" else size / float(MB),
+              "stages": dict((stage, None) for stage in stages),
+              "error": None}
+        op["t0"] = time.time()
+        try:
+            command()
+        except Exception as details:
+            op["error"] = str(details)
+            logging.warning("%s of %s failed: %s", kind, dev_id, details)
+        op["stages"]["qmp"] = time.time() - op["t0"]
+        self.ops.append(op)
+        return op
+
+    def _record_event(self, op, event):
+        data = event.get("data", {})
+        name = event["event"]
+        latency = self._wall_time(event) - op["t0"]
+        if name == "ACPI_DEVICE_OST":
+            info = data.get("info", {})
+            sources = OST_INSERT if op["kind"] == "plug" else OST_EJECT
+            if (info.get("device") != op["id"] or
+                    info.get("source") not in sources):
+                return
+            if info.get("status") not in OST_OK:
+                op["error"] = "ACPI _OST status %s" % info.get("status")
+            # Keep the last report, the one completing the operation
+            op["stages"]["acpi"] = latency
+        elif name == "DEVICE_DELETED" and data.get("device") == op["id"]:
+            op["stages"]["deleted"] = latency
+        elif (name == "MEMORY_DEVICE_SIZE_CHANGE" and
+              data.get("id") == op["id"] and
+              data.get("size") == op["size_mb"] * MB):
+            op["stages"]["size_change"] = latency
+
+    def wait_ops(self, ops, regions):
+        """
+        Wait for operations to reach every stage.
+
+        :param ops: operations started in one batch
+        :param regions: dict of id: (address, size) of the plugged devices
+        """
+        session = self.get_session(self.vm) if self.check_guest else None
+        deadline = time.time() + self.timeout
+        pending = [op for op in ops if not op["error"]]
+        while pending:
+            events = [e for e in self.vm.monitor.get_events()
+                      if e.get("event") in EVENTS]
+            for name in EVENTS:
+                self.vm.monitor.clear_event(name)
+            for op in pending:
+                for event in events:
+                    self._record_event(op, event)
+            if session:
+                now = time.time()
+                online = self.guest_online_mb(session, regions)
+                for op in pending:
+                    if op["stages"].get("guest", 0) is not None:
+                        continue
+                    online_mb = online.get(op["id"], 0)
+                    if (online_mb <= op["target_mb"] if op["kind"] in SHRINK
+                            else online_mb >= op["target_mb"]):
+                        op["stages"]["guest"] = now - op["t0"]
+            pending = [op for op in pending if not op["error"] and
+                       None in op["stages"].values()]
+            if time.time() > deadline:
+                for op in pending:
+                    op["error"] = "timeout, missing %s" % ", ".join(
+                        stage for stage, value in op["stages"].items()
+                        if value is None)
+                break
+            time.sleep(self.interval)
+        for op in ops:
+            if op["error"]:
+                logging.warning("%s of %s: %s", op["kind"], op["id"],
+                                op["error"])
+
+    def plug_dimms(self, names):
+        """
+        Hotplug the backend and pc-dimm of every name back to back.
+
+        :return: dict of name: devices of the plugged names
+        """
+        ops = []
+        plugged = {}
+        stages = ["qmp", "acpi"] + (["guest"] if self.check_guest else [])
+        for name in names:
+            devices = self.vm.devices.memory_define_by_params(self.params,
+                                                              name)
+            backends = []
+            try:
+                for dev in devices:
+                    if not isinstance(dev, qdevices.Dimm):
+                        self.vm.devices.simple_hotplug(dev, self.vm.monitor)
+                        self.update_vm_after_hotplug(self.vm, dev)
+                        backends.append(dev)
+                        continue
+                    size = self.params.object_params(name)["size_mem"]
+                    op = self._start("plug", dev.get_qid(),
+                                     int(float(normalize_data_size(
+                                         size, order_magnitude="B"))),
+                                     stages,
+                                     lambda: self.vm.devices.simple_hotplug(
+                                         dev, self.vm.monitor))
+                    ops.append(op)
+                    if op["error"]:
+                        self.remove_backends(backends)
+                    else:
+                        self.update_vm_after_hotplug(self.vm, dev)
+                        plugged[name] = devices
+            except Exception:
+                self.remove_backends(backends)
+                raise
+        self.wait_ops(ops, self.memory_regions())
+        return plugged
+
+    def remove_backends(self, backends):
+        """
+        object-del the memory backends of a pc-dimm that failed to plug,
+        so they don't keep their host memory.
+
+        :param backends: backend devices plugged for the pc-dimm
+        """
+        for dev in reversed(backends):
+            try:
+                self.vm.devices.simple_unplug(dev, self.vm.monitor)
+                self.update_vm_after_unplug(self.vm, dev)
+            except Exception as details:
+                logging.error("Failed to remove %s: %s", dev.get_qid(),
+                              details)
+        del backends[:]
+
+    def unplug_dimms(self, plugged):
+        """
+        Send device_del for every pc-dimm back to back, then remove the
+        backends of the ones that went away.
+
+        :param plugged: dict of name: devices from plug_dimms()
+        :return: list of names that could not be unplugged
+        """
+        regions = self.memory_regions()
+        stages = ["qmp", "acpi", "deleted"] + (
+            ["guest"] if self.check_guest else [])
+        ops = {}
+        for name, devices in plugged.items():
+            dimm = [dev for dev in devices if isinstance(dev, qdevices.Dimm)]
+            dev_id = dimm[0].get_qid()
+            ops[name] = self._start("unplug", dev_id, regions[dev_id][1],
+                                    stages,
+                                    lambda: dimm[0].unplug(self.vm.monitor))
+        self.wait_ops(list(ops.values()), regions)
+        stuck = []
+        for name, devices in plugged.items():
+            if ops[name]["error"]:
+                stuck.append(name)
+                continue
+            for dev in devices:
+                if isinstance(dev, qdevices.Dimm):
+                    self.vm.devices.remove(dev, recursive=False)
+                else:
+                    self.vm.devices.simple_unplug(dev, self.vm.monitor)
+                self.update_vm_after_unplug(self.vm, dev)
+        return stuck
+
+    def resize_virtio_mem(self, dev_ids, size):
+        """
+        Set the requested size of virtio-mem devices back to back.
+
+        :param dev_ids: virtio-mem device ids
+        :param size: requested size in bytes
+        """
+        ops = []
+        stages = ["qmp", "size_change"] + (
+            ["guest"] if self.check_guest else [])
+        for dev_id in dev_ids:
+            path = "/machine/peripheral/%s" % dev_id
+            ops.append(self._start(
+                "resize_up" if size else "resize_down", dev_id, size,
+                stages, lambda: self.vm.monitor.qom_set(
+                    path, "requested-size", size)))
+        self.wait_ops(ops, self.memory_regions())
+
+    def start_test(self):
+        """
+        Run the plug/unplug rounds and report the latency of every kind of
+        operation and stage.
+        """
+        params = self.params
+        rounds = int(params.get("hotplug_stress_rounds", 10))
+        session = self.vm.wait_for_login()
+        if self.check_guest and params.get("hotplug_stress_boot_option"):
+            utils_test.update_boot_option(
+                self.vm, args_added=params["hotplug_stress_boot_option"])
+        original_mem = self.get_guest_total_mem(self.vm)
+        names = params.objects("target_mems")
+        virtio_mem = params.objects("virtio_mem_devices")
+        sizes = [int(float(normalize_data_size(size, order_magnitude="B")))
+                 for size in params.objects("virtio_mem_sizes")]
+        for i in range(rounds):
+            error_context.context("Memory hotplug stress round %d" % i,
+                                  logging.info)
+            if names:
+                plugged = self.plug_dimms(names)
+                stuck = self.unplug_dimms(plugged)
+                if stuck:
+                    # They can not be plugged again with the same ids
+                    names = [name for name in names if name not in stuck]
+            for size in sizes:
+                self.resize_virtio_mem(virtio_mem, size)
+                self.resize_virtio_mem(virtio_mem, 0)
+        self.vm.verify_kernel_crash()
+        current_mem = self.get_guest_total_mem(self.vm)
+        session.close()
+        return original_mem, current_mem
+
+    def report(self):
+        """
+        Summarize the operations per kind and stage.
+
+        :return: dict of kind: {'count', 'failed', 'failure_rate',
+                 'stages': {stage: latency summary in ms}}
+        """
+        edges = [float(edge) for edge in self.params.objects(
+            "hotplug_stress_buckets")] or None
+        report = {}
+        for kind in sorted(set(op["kind"] for op in self.ops)):
+            ops = [op for op in self.ops if op["kind"] == kind]
+            failed = [op for op in ops if op["error"]]
+            stages = {}
+            for stage in ops[0]["stages"]:
+                stages[stage] = summarize(
+                    [op["stages"][stage] * 1000 for op in ops
+                     if not op["error"] and op["stages"][stage] is not None],
+                    edges)
+            report[kind] = {"count": len(ops), "failed": len(failed),
+                            "failure_rate": len(failed) / float(len(ops)),
+                            "errors": sorted(set(op["error"]
+                                                 for op in failed)),
+                            "stages": stages}
+        return report
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Qemu memory hotplug stress test:
+    1) Boot guest with -m option, memory slots and maxmem
+    2) Hotplug the pc-dimm of every 'target_mems' back to back, then
+       unplug them all back to back, for 'hotplug_stress_rounds' rounds.
+    3) Resize every 'virtio_mem_devices' to every 'virtio_mem_sizes' and
+       back to 0 in the same rounds.
+    4) Time every operation from the QMP command to the QMP return, the
+       ACPI _OST/DEVICE_DELETED/MEMORY_DEVICE_SIZE_CHANGE event and the
+       guest memory blocks online/offline.
+    5) Report the latency histogram and the failure rate of every kind
+       of operation, fail if it is over 'hotplug_stress_max_failure_rate'.
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    stress_test = MemoryHotplugStress(test, params, env)
+    try:
+        original_mem, current_mem = stress_test.start_test()
+    finally:
+        report = stress_test.report()
+        with open(os.path.join(test.resultsdir,
+                               "hotplug_mem_stress.json"), "w") as f:
+            json.dump({"report": report, "ops": stress_test.ops}, f,
+                      indent=2)
+        with open(os.path.join(test.resultsdir,
+                               "hotplug_mem_stress.RHS"), "w") as f:
+            f.write("Operation|Stage|Count|Failed|p50(ms)|p90(ms)|p99(ms)|"
+                    "Max(ms)\n")
+            for kind, data in report.items():
+                for stage, lat in data["stages"].items():
+                    f.write("%s|%s|%d|%d|%s\n" % (
+                        kind, stage, lat["count"], data["failed"], "|".join(
+                            "-" if lat.get(key) is None else
+                            "%.1f" % lat[key]
+                            for key in ("p50", "p90", "p99", "max"))))
+        stress_test.close_sessions()
+
+    for kind, data in report.items():
+        logging.info("%s: %d operations, %d failed, guest p99 %s ms", kind,
+                     data["count"], data["failed"],
+                     data["stages"].get("guest", {}).get("p99"))
+    max_rate = float(params.get("hotplug_stress_max_failure_rate", 0))
+    failed = dict((kind, data["failure_rate"]) for kind, data in
+                  report.items() if data["failure_rate"] > max_rate)
+    if failed:
+        test.fail("Memory hotplug failure rate over %s: %s" % (max_rate,
+                                                               failed))
+    if current_mem != original_mem:
+        test.fail("Guest memory changed after the hotplug stress: %s MB "
+                  "before, %s MB after" % (original_mem, current_mem))
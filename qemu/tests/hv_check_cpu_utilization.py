@@ -4,10 +4,11 @@ import re
 import logging
 
 from virttest import utils_misc
-from virttest import utils_test
 from virttest import error_context
 from avocado.utils import process
 
+from provider.thread_pinning import ThreadPinner
+
 
 def _check_cpu_usage(session):
     """
@@ -43,8 +44,7 @@ def _pin_vm_threads(vm, node):
     param vm: a vm object
     param node: a numa node to pin to
     """
-    node = utils_misc.NumaNode(node)
-    utils_test.qemu.pin_vm_threads(vm, node)
+    ThreadPinner(vm).pin_to_node(node)
 
 
 def _stop_service(test, params, session, service):
@@ -13,6 +13,8 @@ from virttest import error_context
 from virttest import qemu_monitor     # For MonitorNotSupportedMigCapError
 from virttest import qemu_migration
 
+from provider.dirty_pages import DirtyPageWorkload
+
 
 # Define get_function-functions as global to allow importing from other tests
 def get_functions(func_names, locals_dict):
@@ -80,7 +82,8 @@ def run(test, params, env):
     """
     def guest_stress_start(guest_stress_test):
         """
-        Start a stress test in guest, Could be 'iozone', 'dd', 'stress'
+        Start a stress test in guest, Could be 'iozone', 'dd', 'stress',
+        'dirty_pages'
 
         :param type: type of stress test.
         """
@@ -104,6 +107,14 @@ def run(test, params, env):
             args = ("for((;;)) do dd if=/dev/zero of=/tmp/test bs=5M "
                     "count=100; rm -f /tmp/test; done",
                     login_timeout, logging.info)
+        elif guest_stress_test == "dirty_pages":
+            vm = env.get_vm(params["main_vm"])
+            vm.verify_alive()
+            dirtier = DirtyPageWorkload(vm, params)
+            dirtier.deploy()
+            session = vm.wait_for_login(timeout=login_timeout)
+            func = session.cmd_output
+            args = (dirtier.command(), mig_timeout, logging.info)
 
         logging.info("Start %s test in guest", guest_stress_test)
         bg = utils_test.BackgroundTest(func, args)
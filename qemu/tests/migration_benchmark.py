@@ -0,0 +1,212 @@
+import os
+import ast
+import json
+import time
+import logging
+
+from virttest import error_context
+from virttest import utils_misc
+
+from provider.dirty_pages import DirtyPageWorkload
+from provider.host_stats import CpuSnapshot, process_cpu_time
+from provider.migration_telemetry import MigrationTelemetry
+
+
+def summarize(runs):
+    """
+    Average the completed runs of one configuration.
+
+    :param runs: list of per run results
+    :return: dict of averaged metrics, with the number of completed runs
+    """
+    done = [r for r in runs if r["status"] == "completed"]
+    result = {"runs": len(runs), "completed": len(done)}
+    for key in ("total_time_ms", "downtime_ms", "setup_time_ms",
+                "transferred_mb", "speed_avg_mbps", "dirty_sync_count",
+                "guest_dirty_mbps",
+                "src_cpu_s", "dst_cpu_s", "host_cpu_s", "cpu_s_per_gb"):
+        values = [r[key] for r in done if r.get(key) is not None]
+        result[key] = sum(values) / float(len(values)) if values else None
+    return result
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Single host migration benchmark matrix.
+
+    1) Boot the VM and start the dirty page workload in the guest, the
+       memory dirtier from qemu/deps/migration or 'mig_bench_workload'.
+    2) For every configuration in 'mig_bench_configs', set its migration
+       capabilities and parameters (multifd, xbzrle, compression, postcopy,
+       max-bandwidth...) and migrate the VM to localhost over the
+       configured protocol (tcp or unix), 'mig_bench_repeats' times.
+    3) Sample query-migrate during every run, and record total time,
+       downtime, bytes sent, the dirty rate achieved by the guest and the
+       CPU time of the source QEMU, the destination QEMU and the host.
+    4) Write the per configuration results to the results dir.
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    vm = env.get_vm(params["main_vm"])
+    vm.verify_alive()
+    login_timeout = int(params.get("login_timeout", 360))
+    mig_timeout = float(params.get("mig_timeout", 600))
+    mig_protocol = params.get("migration_protocol", "tcp")
+    repeats = int(params.get("mig_bench_repeats", 1))
+    interval = float(params.get("mig_telemetry_interval", 0.1))
+    settle_time = float(params.get("mig_bench_settle_time", 10))
+    workload = params.get("mig_bench_workload")
+    workload_check = params.get("mig_bench_workload_check")
+    workload_stop = params.get("mig_bench_workload_stop")
+    base_parameters = ast.literal_eval(
+        params.get("mig_bench_base_parameters", "{}"))
+
+    session = vm.wait_for_login(timeout=login_timeout)
+    default_parameters = vm.monitor.cmd("query-migrate-parameters")
+    dirtier = None
+    if params.get("mig_bench_dirtier", "yes") == "yes":
+        error_context.context("Start the memory dirtier in guest",
+                              logging.info)
+        dirtier = DirtyPageWorkload(vm, params)
+        dirtier.start()
+        workload = "dirty_pages.py %s" % dirtier.options
+    elif workload:
+        error_context.context("Start the dirty page workload in guest",
+                              logging.info)
+        session.cmd(workload)
+        if workload_check and not utils_misc.wait_for(
+                lambda: session.cmd_status(workload_check) == 0, 60):
+            test.error("Dirty page workload failed to start in guest")
+    session.close()
+
+    def migrate_once(vm, config, capabilities, parameters, tag):
+        """Migrate the VM once, return the new VM and the run results"""
+        postcopy_delay = config.get("mig_bench_postcopy_delay")
+        telemetry = MigrationTelemetry(vm, interval)
+        src_pid = vm.get_pid()
+        reports = len(dirtier.rates(vm)) if dirtier else 0
+        before = CpuSnapshot([src_pid])
+        clone = vm.migrate(mig_timeout, mig_protocol,
+                           not_wait_for_migration=True, env=env,
+                           migrate_capabilities=capabilities,
+                           migrate_parameters=(parameters, parameters))
+        dst_pid = clone.get_pid()
+        telemetry.start()
+        if postcopy_delay:
+            time.sleep(float(postcopy_delay))
+            logging.info("Switch to postcopy")
+            vm.monitor.migrate_start_postcopy()
+        completed = utils_misc.wait_for(lambda: not telemetry.is_running(),
+                                        mig_timeout, step=interval)
+        telemetry.stop()
+        cpu = CpuSnapshot([src_pid]) - before
+        dst_cpu = process_cpu_time(dst_pid)
+        telemetry.save(test.resultsdir, tag)
+        summary = telemetry.summary()
+        status = summary.get("status") if completed else "timeout"
+        result = {"status": status, "telemetry": summary}
+        if status != "completed":
+            logging.warning("Migration with %s did not complete: %s", tag,
+                            status)
+            if vm.is_alive():
+                vm.monitor.cmd("migrate_cancel")
+            clone.destroy(gracefully=False)
+            return vm, result
+        transferred = telemetry.values("transferred")[-1][1]
+        result.update({
+            "total_time_ms": summary.get("total_time"),
+            "downtime_ms": summary.get("downtime"),
+            "setup_time_ms": summary.get("setup_time"),
+            "dirty_sync_count": summary.get("dirty_sync_count"),
+            "transferred_mb": transferred / 1048576.0,
+            "speed_avg_mbps": summary.get("speed_avg_mbps"),
+            "src_cpu_s": cpu["processes"],
+            "dst_cpu_s": dst_cpu,
+            "host_cpu_s": cpu["host_busy"],
+            "cpu_s_per_gb": ((cpu["processes"] + dst_cpu) * 1073741824.0 /
+                             transferred if transferred else None)})
+        logging.info("%s: %s ms total, %s ms downtime, %.1f MB sent, "
+                     "%.2fs source + %.2fs destination CPU", tag,
+                     result["total_time_ms"], result["downtime_ms"],
+                     result["transferred_mb"], result["src_cpu_s"],
+                     dst_cpu)
+        # The destination becomes the source of the next run
+        vm.destroy(gracefully=False, free_mac_addresses=False)
+        env.register_vm(vm.name, clone)
+        if dirtier:
+            rates = [r["mbps"] for r in dirtier.rates(clone)[reports:]]
+            result["guest_dirty_mbps"] = (sum(rates) / len(rates)
+                                          if rates else None)
+        return clone, result
+
+    results = {}
+    enabled = set()
+    changed = set()
+    try:
+        for name in params.objects("mig_bench_configs"):
+            config = params.object_params(name)
+            error_context.context("Benchmark migration with '%s'" % name,
+                                  logging.info)
+            # Capabilities and parameters stick to the source QEMU, turn
+            # off/restore whatever the previous configurations changed.
+            config_caps = ast.literal_eval(
+                config.get("mig_bench_capabilities", "{}"))
+            capabilities = dict((cap, "off") for cap in enabled)
+            capabilities.update(config_caps)
+            config_params = ast.literal_eval(
+                config.get("mig_bench_parameters", "{}"))
+            parameters = dict((key, default_parameters[key])
+                              for key in changed
+                              if key in default_parameters)
+            parameters.update(base_parameters)
+            parameters.update(config_params)
+            enabled.update(cap for cap, state in config_caps.items()
+                           if state == "on")
+            changed.update(config_params)
+            runs = []
+            for i in range(repeats):
+                time.sleep(settle_time)
+                vm, result = migrate_once(vm, config, capabilities,
+                                          parameters, "%s_%d" % (name, i))
+                runs.append(result)
+            vm.verify_alive()
+            results[name] = {"capabilities": config_caps,
+                             "parameters": config_params,
+                             "postcopy_delay": config.get(
+                                 "mig_bench_postcopy_delay"),
+                             "summary": summarize(runs), "runs": runs}
+    finally:
+        if dirtier and vm.is_alive():
+            dirtier.stop(vm)
+        elif workload_stop and vm.is_alive():
+            session = vm.wait_for_login(timeout=login_timeout)
+            session.cmd_output(workload_stop)
+            session.close()
+        with open(os.path.join(test.resultsdir,
+                               "migration_benchmark.json"), "w") as f:
+            json.dump({"protocol": mig_protocol, "workload": workload,
+                       "configs": results}, f, indent=2)
+        with open(os.path.join(test.resultsdir,
+                               "migration_benchmark.RHS"), "w") as f:
+            f.write("Config|Completed|Total(ms)|Downtime(ms)|Sent(MB)|"
+                    "Speed(MB/s)|Dirty(MB/s)|SrcCPU(s)|DstCPU(s)|"
+                    "CPU(s/GB)\n")
+            for name, data in results.items():
+                s = data["summary"]
+                f.write("%s|%d/%d|%s|%s|%s|%s|%s|%s|%s|%s\n" % (
+                    (name, s["completed"], s["runs"]) + tuple(
+                        "-" if s[key] is None else "%.2f" % s[key]
+                        for key in ("total_time_ms", "downtime_ms",
+                                    "transferred_mb", "speed_avg_mbps",
+                                    "guest_dirty_mbps", "src_cpu_s", "dst_cpu_s",
+                                    "cpu_s_per_gb"))))
+
+    failed = [name for name, data in results.items()
+              if params.object_params(name).get(
+                  "mig_bench_require_completion", "yes") == "yes" and
+              data["summary"]["completed"] != data["summary"]["runs"]]
+    if failed:
+        test.fail("Migration did not complete with: %s" % ", ".join(failed))
@@ -1,6 +1,4 @@
 import os
-import re
-import six
 import logging
 import time
 
@@ -8,43 +6,7 @@ from virttest import utils_misc
 from virttest import qemu_migration
 
 from provider import cpuflags
-
-
-class Statistic(object):
-
-    """
-    Class to display and collect average,
-    max and min values of a given data set.
-    """
-
-    def __init__(self):
-        self._sum = 0
-        self._count = 0
-        self._max = None
-        self._min = None
-
-    def get_average(self):
-        if self._count != 0:
-            return self._sum / self._count
-        else:
-            return None
-
-    def get_min(self):
-        return self._min
-
-    def get_max(self):
-        return self._max
-
-    def record(self, value):
-        """
-        Record new value to statistic.
-        """
-        self._count += 1
-        self._sum += value
-        if not self._max or self._max < value:
-            self._max = value
-        if not self._min or self._min > value:
-            self._min = value
+from provider.migration_telemetry import MigrationTelemetry
 
 
 def run(test, params, env):
@@ -77,49 +39,31 @@ def run(test, params, env):
 
     vm_mem = int(params.get("mem", "512"))
 
-    get_mig_speed = re.compile(r"^transferred ram: (\d+) kbytes$",
-                               re.MULTILINE)
-
     mig_speed = params.get("mig_speed", "1G")
     mig_speed_accuracy = float(params.get("mig_speed_accuracy", "0.2"))
+    mig_telemetry_interval = float(params.get("mig_telemetry_interval", 1))
+    mig_measure_time = float(params.get("mig_measure_time", 30))
     clonevm = None
 
     def get_migration_statistic(vm):
-        last_transfer_mem = 0
-        transfered_mem = 0
-        mig_stat = Statistic()
+        telemetry = MigrationTelemetry(vm, mig_telemetry_interval)
         while vm.monitor.get_migrate_progress() == 0:
             pass
-        for _ in range(30):
-            o = vm.monitor.info("migrate")
-            warning_msg = ("Migration already ended. Migration speed is"
-                           " probably too high and will block vm while"
-                           " filling its memory.")
-            fail_msg = ("Could not determine the transferred memory from"
-                        " monitor data: %s" % o)
-            if isinstance(o, six.string_types):
-                if "status: active" not in o:
-                    test.error(warning_msg)
-                try:
-                    transfered_mem = int(get_mig_speed.search(o).groups()[0])
-                except (IndexError, ValueError):
-                    test.fail(fail_msg)
-            else:
-                if o.get("status") != "active":
-                    test.error(warning_msg)
-                try:
-                    transfered_mem = o.get("ram").get("transferred") / (1024)
-                except (IndexError, ValueError):
-                    test.fail(fail_msg)
-
-            real_mig_speed = (transfered_mem - last_transfer_mem) / 1024
-
-            last_transfer_mem = transfered_mem
-
-            logging.debug("Migration speed: %s MB/s", real_mig_speed)
-            mig_stat.record(real_mig_speed)
-            time.sleep(1)
-
+        telemetry.start()
+        time.sleep(mig_measure_time)
+        telemetry.stop()
+        telemetry.save(test.resultsdir)
+        mig_stat = telemetry.summary()
+        if mig_stat.get("status") != "active":
+            test.error("Migration already ended. Migration speed is"
+                       " probably too high and will block vm while"
+                       " filling its memory.")
+        if "speed_avg_mbps" not in mig_stat:
+            test.fail("Could not determine the transferred memory from"
+                      " monitor data: %s" % telemetry.samples)
+        for t, speed in telemetry.values("speed"):
+            logging.debug("Migration speed at %.2fs: %s MB/s", t,
+                          speed / 1048576.0)
         return mig_stat
 
     try:
@@ -145,14 +89,15 @@ def run(test, params, env):
 
         mig_stat = get_migration_statistic(vm)
 
-        real_speed = mig_stat.get_average()
+        real_speed = mig_stat["speed_avg_mbps"]
         ack_speed = mig_speed * mig_speed_accuracy
 
         logging.info("Target migration speed: %d MB/s.", mig_speed)
-        logging.info(
-            "Average migration speed: %d MB/s", mig_stat.get_average())
-        logging.info("Minimum migration speed: %d MB/s", mig_stat.get_min())
-        logging.info("Maximum migration speed: %d MB/s", mig_stat.get_max())
+        logging.info("Average migration speed: %d MB/s", real_speed)
+        logging.info("Minimum migration speed: %d MB/s",
+                     mig_stat["speed_min_mbps"])
+        logging.info("Maximum migration speed: %d MB/s",
+                     mig_stat["speed_max_mbps"])
 
         logging.info("Maximum tolerable divergence: %3.1f%%",
                      mig_speed_accuracy * 100)
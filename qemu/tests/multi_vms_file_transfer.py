@@ -1,5 +1,6 @@
 import time
 import os
+import json
 import logging
 
 from avocado.utils import crypto
@@ -11,6 +12,211 @@ from virttest import utils_misc
 from virttest import data_dir
 
 
+def get_net_counters(ifnames):
+    """
+    Read the rx/tx byte counters of host network interfaces
+
+    :param ifnames: list of host interface names, e.g. taps and the bridge
+    :return: dict of ifname: (rx_bytes, tx_bytes)
+    """
+    counters = {}
+    for ifname in ifnames:
+        stats = "/sys/class/net/%s/statistics/%%s_bytes" % ifname
+        try:
+            counters[ifname] = tuple(int(open(stats % d).read())
+                                     for d in ("rx", "tx"))
+        except (IOError, OSError):
+            logging.debug("No statistics for host interface %s", ifname)
+    return counters
+
+
+def parse_results(output):
+    """Get the result dicts reported by stream_transfer.py"""
+    return [json.loads(line.split("RESULT: ", 1)[1])
+            for line in output.splitlines() if "RESULT: " in line]
+
+
+@error_context.context_aware
+def run_parallel(test, params, env):
+    """
+    Transfer files between every pair of VMs at the same time.
+
+    1) Boot up N VMs, create incompressible files of every size in
+       'stream_file_sizes' on host and copy them to all VMs.
+    2) Start a stream_transfer.py receiver in every VM.
+    3) From every VM push each file to every other VM with
+       'parallel_streams' concurrent streams, all VM pairs at once.
+    4) Check the streaming hashes of both ends against the host ones.
+    5) Report per-pair and aggregate throughput, plus the tap and bridge
+       throughput seen on host.
+
+    :param test: KVM test object.
+    :param params: Dictionary with the test parameters.
+    :param env: Dictionary with test environment.
+    """
+    login_timeout = int(params.get("login_timeout", 360))
+    transfer_timeout = int(params.get("transfer_timeout", 1000))
+    tmp_dir_guest = params.get("tmp_dir_guest", "/var/tmp")
+    clean_cmd = params.get("clean_cmd", "rm -f")
+    sizes = params.objects("stream_file_sizes") or [params["filesize"]]
+    streams = int(params.get("parallel_streams", 1))
+    port = int(params.get("stream_port", 5201))
+    hash_name = params.get("stream_hash", "sha256")
+    recv_dir = os.path.join(tmp_dir_guest, "stream_recv")
+    script = params.get("stream_script", "stream_transfer.py")
+    host_script = os.path.join(data_dir.get_deps_dir("file_transfer"),
+                               script)
+    guest_script = os.path.join(tmp_dir_guest, script)
+    python_bin = params.get("python_bin",
+                            "`command -v python3 python | head -1`")
+
+    vms = [env.get_vm(name) for name in params.objects("vms")]
+    for vm in vms:
+        vm.verify_alive()
+    sessions = [vm.wait_for_login(timeout=login_timeout) for vm in vms]
+    addresses = dict((vm.get_address(), vm.name) for vm in vms)
+    host_files = {}
+    try:
+        error_context.context("Creating %s MB files on host" %
+                              ", ".join(sizes), logging.info)
+        tmp_dir = data_dir.get_tmp_dir()
+        for size in sizes:
+            path = os.path.join(tmp_dir, "stream-%sM" % size)
+            process.run("dd if=/dev/urandom of=%s bs=1M count=%s" %
+                        (path, size))
+            host_files[size] = (path, crypto.hash_file(path,
+                                                       algorithm=hash_name))
+        error_context.context("Copy files and %s to all VMs" % script,
+                              logging.info)
+        copies = [(vm.copy_files_to, (path, tmp_dir_guest),
+                   {"timeout": transfer_timeout})
+                  for vm in vms for path in [host_script] +
+                  [f[0] for f in host_files.values()]]
+        utils_misc.parallel(copies)
+
+        expected = (len(vms) - 1) * streams * len(sizes)
+        receive_cmd = ("%s %s receive -p %d -n %d -d %s --clean --hash %s "
+                       "--timeout %d" % (python_bin, guest_script, port,
+                                         expected, recv_dir, hash_name,
+                                         transfer_timeout))
+        recv_log = os.path.join(tmp_dir_guest, "stream_recv.log")
+        for vm, session in zip(vms, sessions):
+            stop_firewall_cmd = params.get("stop_firewall_cmd")
+            if stop_firewall_cmd:
+                session.cmd_status(stop_firewall_cmd)
+            session.cmd("nohup %s > %s 2>&1 &" % (receive_cmd, recv_log))
+            if not utils_misc.wait_for(
+                    lambda: "LISTENING" in session.cmd_output(
+                        "cat %s" % recv_log), 30, step=0.5):
+                test.error("Stream receiver did not start in %s: %s" %
+                           (vm.name, session.cmd_output("cat %s" % recv_log)))
+
+        send_cmds = []
+        for vm, session in zip(vms, sessions):
+            sends = []
+            for peer in vms:
+                if peer is vm:
+                    continue
+                for size in sizes:
+                    guest_file = os.path.join(
+                        tmp_dir_guest, os.path.basename(host_files[size][0]))
+                    for i in range(streams):
+                        sends.append(
+                            "%s %s send -a %s:%d -f %s --name %sM-%s-%d "
+                            "--hash %s --timeout %d &" %
+                            (python_bin, guest_script, peer.get_address(),
+                             port, guest_file, size, vm.name, i, hash_name,
+                             transfer_timeout))
+            send_cmds.append((session.cmd_output,
+                              (" ".join(sends + ["wait"]),),
+                              {"timeout": transfer_timeout}))
+
+        ifnames = [nic.ifname for vm in vms for nic in vm.virtnet
+                   if nic.get("ifname")]
+        bridges = set(nic.netdst for vm in vms for nic in vm.virtnet
+                      if nic.get("netdst"))
+        ifnames += list(bridges)
+        error_context.context("Run %d transfers between %d VMs at the "
+                              "same time" % (expected * len(vms), len(vms)),
+                              logging.info)
+        before = get_net_counters(ifnames)
+        t_begin = time.time()
+        outputs = utils_misc.parallel(send_cmds)
+        wall_time = time.time() - t_begin
+        after = get_net_counters(ifnames)
+
+        sent = []
+        for vm, output in zip(vms, outputs):
+            for result in parse_results(output):
+                result["src"] = vm.name
+                result["dst"] = addresses.get(result["peer"].split(":")[0])
+                sent.append(result)
+        received = []
+        for vm, session in zip(vms, sessions):
+            utils_misc.wait_for(
+                lambda: len(parse_results(session.cmd_output(
+                    "cat %s" % recv_log))) >= expected, 60, step=1)
+            for result in parse_results(session.cmd_output(
+                    "cat %s" % recv_log)):
+                result["dst"] = vm.name
+                received.append(result)
+
+        errors = [r for r in sent + received if "error" in r]
+        if errors or len(sent) != expected * len(vms):
+            test.fail("%d of %d transfers completed, errors: %s" %
+                      (len(sent) - len(errors), expected * len(vms), errors))
+        for result in sent + received:
+            size = result["name"].split("M-")[0]
+            digests = set([result["digest"], host_files[size][1]])
+            if "peer_digest" in result:
+                digests.add(result["peer_digest"])
+            if len(digests) != 1:
+                test.fail("File corrupted in transfer %s -> %s (%s): %s" %
+                          (result.get("src"), result["dst"], result["name"],
+                           result))
+
+        pairs = {}
+        for result in sent:
+            pair = pairs.setdefault("%s->%s" % (result["src"], result["dst"]),
+                                    {"bytes": 0, "seconds": 0.0})
+            pair["bytes"] += result["bytes"]
+            pair["seconds"] = max(pair["seconds"], result["seconds"])
+        for name, pair in sorted(pairs.items()):
+            pair["mbps"] = pair["bytes"] / 1048576.0 / pair["seconds"]
+            logging.info("%s: %.2f MB/s", name, pair["mbps"])
+        total_bytes = sum(r["bytes"] for r in sent)
+        aggregate = total_bytes / 1048576.0 / wall_time
+        logging.info("Aggregate guest throughput: %.2f MB/s over %.2fs",
+                     aggregate, wall_time)
+        host_net = {}
+        for ifname in set(before) & set(after):
+            rx, tx = [(a - b) / 1048576.0 / wall_time
+                      for a, b in zip(after[ifname], before[ifname])]
+            host_net[ifname] = {"rx_mbps": rx, "tx_mbps": tx}
+            logging.info("Host %s: rx %.2f MB/s, tx %.2f MB/s", ifname, rx,
+                         tx)
+        test.write_test_keyval({"aggregate_mbps": "%.2f" % aggregate})
+        with open(os.path.join(test.resultsdir,
+                               "multi_vms_file_transfer.json"), "w") as f:
+            json.dump({"vms": len(vms), "streams": streams, "sizes": sizes,
+                       "wall_time": wall_time, "aggregate_mbps": aggregate,
+                       "pairs": pairs, "host_net": host_net,
+                       "transfers": sent}, f, indent=2)
+    finally:
+        for session in sessions:
+            session.cmd_output("pkill -f '%s receive'; %s -r %s" %
+                               (script, clean_cmd, recv_dir))
+            for path, _ in host_files.values():
+                session.cmd_output("%s %s" % (clean_cmd, os.path.join(
+                    tmp_dir_guest, os.path.basename(path))))
+            session.close()
+        for path, _ in host_files.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
 @error_context.context_aware
 def run(test, params, env):
     """
@@ -26,10 +232,16 @@ def run(test, params, env):
     8) Compare copied file's md5 with original file.
     9) Repeat step 5-8
 
+    With transfer_mode = parallel, run_parallel() drives the transfers
+    between all VM pairs at once instead.
+
     :param test: KVM test object.
     :param params: Dictionary with the test parameters.
     :param env: Dictionary with test environment.
     """
+    if params.get("transfer_mode") == "parallel":
+        return run_parallel(test, params, env)
+
     def md5_check(session, orig_md5):
         msg = "Compare copied file's md5 with original file."
         error_context.context(msg, logging.info)
@@ -11,6 +11,8 @@ from virttest import error_context
 from virttest import qemu_storage
 from virttest import utils_misc
 
+from provider.vm_launcher import VMLauncher
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -71,10 +73,6 @@ def run(test, params, env):
             params[image_name] = 'images/%s' % vm_name
             params['remove_image_%s' % vm_name] = 'yes'
 
-    def wait_for_login_all_vms():
-        """Wait all VMs to login."""
-        return [vm.wait_for_login() for vm in vms]
-
     def wait_for_shutdown_all_vms(vms, sessions):
         """Wait all VMs to shutdown."""
         for vm, session in zip(vms, sessions):
@@ -96,11 +94,17 @@ def run(test, params, env):
     run_stress_background()
     is_stress_alive()
 
-    params['start_vm'] = 'yes'
+    # Only create the VM objects, the launcher starts them in parallel
+    params['start_vm'] = 'no'
     env_process.process(test, params, env,
                         env_process.preprocess_image,
                         env_process.preprocess_vm)
-    vms = env.get_all_vms()
-    for vm in vms:
-        vm.verify_alive()
-    wait_for_shutdown_all_vms(vms, wait_for_login_all_vms())
+    launcher = VMLauncher(test, params, env)
+    vms = [env.get_vm(vm_name) for vm_name in params.objects('vms')]
+    launcher.launch(vms)
+    launcher.save(test.resultsdir, 'multi_vms_with_stress')
+    if launcher.failed():
+        test.fail('Failed to start %s under host stress.'
+                  % ', '.join(launcher.failed()))
+    wait_for_shutdown_all_vms(
+        vms, [launcher.sessions[vm.name] for vm in vms])
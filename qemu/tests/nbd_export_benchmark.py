@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from virttest import error_context
+from virttest import utils_misc
+
+from provider import nbd_client
+from provider import qemu_img_utils as img_utils
+from provider.latency_stats import summarize
+from provider.nbd_image_export import InternalNBDExportImage
+from provider.nbd_image_export import QemuNBDExportImage
+
+OPERATIONS = {"read": nbd_client.CMD_READ,
+              "write": nbd_client.CMD_WRITE,
+              "block_status": nbd_client.CMD_BLOCK_STATUS}
+
+
+class NBDLoad(object):
+
+    """
+    Drive one operation over several connections to an NBD export, keeping
+    up to 'depth' requests in flight on every connection.
+    """
+
+    def __init__(self, params, connections, request_size, depth, span,
+                 pattern="sequential"):
+        """
+        :param params: image params of the export, see nbd_client.connect
+        :param connections: number of connections
+        :param request_size: bytes per request
+        :param depth: requests in flight per connection
+        :param span: bytes of the export to cover, split between the
+                     connections
+        :param pattern: 'sequential' or 'random' request order
+        """
+        self.params = params
+        self.connections = connections
+        self.request_size = request_size
+        self.depth = depth
+        self.span = span
+        self.pattern = pattern
+
+    def _offsets(self, index):
+        share = self.span // self.connections
+        share -= share % self.request_size
+        start = index * share
+        offsets = list(range(start, start + share, self.request_size))
+        if self.pattern == "random":
+            random.Random(index).shuffle(offsets)
+        return offsets
+
+    def _drive(self, client, operation, index, result):
+        command = OPERATIONS[operation]
+        data = os.urandom(self.request_size) if operation == "write" else None
+        submitted = {}
+        offsets = iter(self._offsets(index))
+        pending = True
+        try:
+            while True:
+                while pending and len(submitted) < self.depth:
+                    offset = next(offsets, None)
+                    if offset is None:
+                        pending = False
+                        break
+                    handle = client.submit(command, offset, self.request_size,
+                                           data)
+                    submitted[handle] = time.time()
+                if not submitted:
+                    break
+                handle, reply = client.receive()
+                result["latencies"].append(time.time() -
+                                           submitted.pop(handle))
+                if reply["error"]:
+                    result["errors"] += 1
+                else:
+                    result["bytes"] += self.request_size
+            if operation == "write":
+                client.flush()
+        except Exception as details:
+            result["failure"] = str(details)
+            logging.error("Connection %d failed during %s: %s", index,
+                          operation, details)
+
+    def run(self, operation):
+        """
+        Run one operation over the whole span.
+
+        :param operation: 'read', 'write' or 'block_status'
+        :return: dict with 'bytes', 'seconds', 'mbps', 'iops', 'errors',
+                 'failures' and 'latency_ms' (see latency_stats.summarize)
+        """
+        contexts = ["base:allocation"] if operation == "block_status" else []
+        clients = []
+        try:
+            for _ in range(self.connections):
+                clients.append(nbd_client.connect(self.params,
+                                                  meta_contexts=contexts))
+            if self.connections > 1 and not clients[0].can_multi_conn:
+                logging.warning("The server does not advertise multi-conn, "
+                                "connections may not see each other's writes")
+            results = [{"bytes": 0, "errors": 0, "failure": None,
+                        "latencies": []} for _ in clients]
+            threads = [threading.Thread(target=self._drive,
+                                        args=(client, operation, i,
+                                              results[i]))
+                       for i, client in enumerate(clients)]
+            begin = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.time() - begin
+        finally:
+            for client in clients:
+                client.close()
+        total = sum(r["bytes"] for r in results)
+        latencies = [t * 1000 for r in results for t in r["latencies"]]
+        return {"bytes": total, "seconds": seconds,
+                "mbps": total / 1048576.0 / seconds if seconds else 0,
+                "iops": len(latencies) / seconds if seconds else 0,
+                "errors": sum(r["errors"] for r in results),
+                "failures": [r["failure"] for r in results if r["failure"]],
+                "latency_ms": summarize(latencies)}
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Benchmark NBD exports with a pure python client.
+
+    1) Create a local image
+    2) For every export configuration in 'nbd_bench_exports':
+       2.1) Export the image with qemu-nbd, or with the internal NBD server
+            of a VM booted without images, over TCP or a unix socket
+       2.2) Drive every operation in 'nbd_bench_operations' over
+            'nbd_bench_connections' connections, with 'nbd_bench_depth'
+            requests of 'nbd_bench_request_size' in flight per connection
+       2.3) Stop the export
+    3) Report the throughput and latency percentiles of every export
+       configuration and operation
+
+    :param test: QEMU test object
+    :param params: Dictionary with the test parameters
+    :param env: Dictionary with test environment.
+    """
+    def _export(export_params):
+        if export_params["nbd_bench_exporter"] == "qemu-nbd":
+            exporter = QemuNBDExportImage(export_params, tag)
+            exporter.export_image()
+            return exporter
+        exporter = InternalNBDExportImage(vm, export_params, tag)
+        if not node_name:
+            # The node name is the export name as nbd_export_name is unset
+            exporter.hotplug_image()
+            node_name.append(exporter.get_export_name())
+            exporter.export_image()
+        else:
+            exporter.start_nbd_server()
+            exporter.add_nbd_image(node_name[0])
+        return exporter
+
+    tag = params["local_image_tag"]
+    request_size = int(utils_misc.normalize_data_size(
+        params.get("nbd_bench_request_size", "64K"), "B"))
+    span = int(utils_misc.normalize_data_size(
+        params.get("nbd_bench_span", params["image_size_%s" % tag]), "B"))
+    exports = params.objects("nbd_bench_exports")
+
+    error_context.context("Create image %s" % tag, logging.info)
+    QemuNBDExportImage(params, tag).create_image()
+
+    vm = None
+    if any(params.object_params(name)["nbd_bench_exporter"] == "internal"
+           for name in exports):
+        params["images"] = ""
+        try:
+            vm = img_utils.boot_vm_with_images(test, params, env)
+        finally:
+            # let VT remove it
+            params["images"] = " %s" % tag
+
+    node_name = []
+    report = {}
+    for name in exports:
+        export_params = params.object_params(name)
+        connections = export_params.get_numeric("nbd_bench_connections", 4)
+        depth = export_params.get_numeric("nbd_bench_depth", 16)
+        load = NBDLoad(export_params.object_params(tag), connections,
+                       request_size, depth, span,
+                       export_params.get("nbd_bench_pattern", "sequential"))
+        error_context.context("Benchmark export %s: %d connections, depth %d"
+                              % (name, connections, depth), logging.info)
+        exporter = _export(export_params)
+        if isinstance(exporter, InternalNBDExportImage):
+            load.params["nbd_export_name"] = exporter.get_export_name()
+        try:
+            report[name] = {
+                "exporter": export_params["nbd_bench_exporter"],
+                "transport": ("unix" if load.params.get("nbd_unix_socket")
+                              else "tcp"),
+                "iothread": export_params.get("block_export_iothread"),
+                "connections": connections, "depth": depth,
+                "request_size": request_size}
+            for operation in export_params.objects("nbd_bench_operations"):
+                result = load.run(operation)
+                report[name][operation] = result
+                logging.info("%s %s: %.1f MB/s, %.0f IOPS, p99 %s ms",
+                             name, operation, result["mbps"], result["iops"],
+                             result["latency_ms"]["p99"])
+        finally:
+            exporter.stop_export()
+
+    with open(os.path.join(test.resultsdir, "nbd_export_benchmark.json"),
+              "w") as result_file:
+        json.dump(report, result_file, indent=2)
+    with open(os.path.join(test.resultsdir, "nbd_export_benchmark.RHS"),
+              "w") as result_file:
+        result_file.write("%-24s%-14s%-10s%-10s%-10s%-10s%-10s\n" %
+                          ("export", "operation", "MB/s", "IOPS", "p50_ms",
+                           "p99_ms", "errors"))
+        for name in exports:
+            for operation in params.object_params(name).objects(
+                    "nbd_bench_operations"):
+                result = report[name][operation]
+                latency = result["latency_ms"]
+                result_file.write("%-24s%-14s%-10.1f%-10.0f%-10.3f%-10.3f"
+                                  "%-10d\n" % (name, operation, result["mbps"],
+                                               result["iops"],
+                                               latency["p50"] or 0,
+                                               latency["p99"] or 0,
+                                               result["errors"]))
+
+    failed = [name for name in exports
+              if any(report[name][op]["errors"] or report[name][op]["failures"]
+                     for op in params.object_params(name).objects(
+                         "nbd_bench_operations"))]
+    if failed:
+        test.fail("NBD requests failed on exports: %s" % ", ".join(failed))
@@ -1,5 +1,9 @@
+import logging
+
 from avocado.utils import process
 
+from provider.kvm_stats import KvmStats
+
 
 def run(test, params, env):
     """
@@ -33,7 +37,17 @@ def run(test, params, env):
     perf_report_cmd = "perf kvm --host --guest --guestkallsyms=%s" % vm_kallsyms_path
     perf_report_cmd += " --guestmodules=%s report -i /tmp/perf.data --force " % vm_modules_path
 
-    process.system(perf_record_cmd)
+    kvm_stats = KvmStats(vm, float(params.get("kvm_stats_interval", 1)))
+    kvm_stats.start()
+    try:
+        process.system(perf_record_cmd)
+    finally:
+        kvm_stats.stop()
+        kvm_stats.save(test.resultsdir, "perf_kvm")
+    exits = kvm_stats.exits()
+    logging.info("KVM exits during perf record: %s", ", ".join(
+        "%s=%s" % (reason, exits[reason])
+        for reason in sorted(exits, key=exits.get, reverse=True)))
     process.system(perf_report_cmd)
 
     session.close()
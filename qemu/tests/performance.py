@@ -1,13 +1,6 @@
 import os
 import re
-import shutil
-import shelve
 import six
-import threading
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
 
 from avocado.utils import download
 from avocado.utils import process
@@ -16,69 +9,42 @@ from virttest import utils_test
 from virttest import utils_misc
 from virttest import data_dir
 
+from provider.monitor_runner import MonitorRunner
 
-def cmd_runner_monitor(test, vm, monitor_cmd, test_cmd,
-                       guest_path, timeout=300):
+
+def cmd_runner_monitor(test, vm, monitor_cmd, test_cmd, result_dir,
+                       timeout=300, host_samplers=None):
     """
     For record the env information such as cpu utilization, meminfo while
     run guest test in guest.
+
+    Host samplers run as their own process groups and the guest monitor in
+    a dedicated session, their output streams into one timestamped dataset
+    (monitor_<tag>.jsonl) under result_dir while the test runs, so several
+    VMs can be measured at the same time.
+
     @vm: Guest Object
-    @monitor_cmd: monitor command running in backgroud
+    @monitor_cmd: monitor command running in backgroud on host and guest
     @test_cmd: test suit run command
-    @guest_path: path in guest to store the test result and monitor data
+    @result_dir: directory to store the test result and monitor data
     @timeout: longest time for monitor running
-    Return: tag the suffix of the results
+    @host_samplers: dict of name: command of extra host samplers
+    Return: result files of the test, the host and the guest monitor
     """
-    def thread_kill(cmd, p_file):
-        fd = shelve.open(p_file)
-        o = process.system_output("pstree -p %s" % fd["pid"], verbose=False,
-                                  ignore_status=True)
-        tmp = re.split(r"\s+", cmd)[0]
-        pid = re.findall(r"%s.(\d+)" % tmp, o)[0]
-        cmd_result = process.run("kill -9 %s" % pid, verbose=False,
-                                 ignore_status=True)
-        fd.close()
-        return (cmd_result.exit_status, cmd_result.stdout)
-
-    def monitor_thread(m_cmd, p_file, r_file):
-        fd = shelve.open(p_file)
-        fd["pid"] = os.getpid()
-        fd.close()
-        os.system("%s &> %s" % (m_cmd, r_file))
-
-    def test_thread(session, m_cmd, t_cmd, p_file, flag, timeout):
-        flag.put(True)
-        s, o = session.cmd_status_output(t_cmd, timeout)
-        if s != 0:
-            test.fail("Test failed or timeout: %s" % o)
-        if not flag.empty():
-            flag.get()
-            thread_kill(m_cmd, p_file)
-
-    kill_thread_flag = Queue(1)
-    session = vm.wait_for_login(timeout=300)
-    tag = vm.instance
-    pid_file = "/tmp/monitor_pid_%s" % tag
-    result_file = "/tmp/host_monitor_result_%s" % tag
-
-    monitor = threading.Thread(target=monitor_thread, args=(monitor_cmd,
-                                                            pid_file, result_file))
-    test_runner = threading.Thread(target=test_thread, args=(session,
-                                                             monitor_cmd, test_cmd, pid_file,
-                                                             kill_thread_flag, timeout))
-    monitor.start()
-    test_runner.start()
-    monitor.join(int(timeout))
-    if not kill_thread_flag.empty():
-        kill_thread_flag.get()
-        thread_kill(monitor_cmd, pid_file)
-        thread_kill("sh", pid_file)
-
-    guest_result_file = "/tmp/guest_result_%s" % tag
-    guest_monitor_result_file = "/tmp/guest_monitor_result_%s" % tag
-    vm.copy_files_from(guest_path, guest_result_file)
-    vm.copy_files_from("%s_monitor" % guest_path, guest_monitor_result_file)
-    return tag
+    runner = MonitorRunner(vm, result_dir)
+    samplers = {"monitor": monitor_cmd}
+    samplers.update(host_samplers or {})
+    s, o = runner.run(test_cmd, timeout, host_samplers=samplers,
+                      guest_monitors={"monitor": monitor_cmd})
+    guest_result_file = os.path.join(result_dir,
+                                     "guest_result_%s" % runner.tag)
+    with open(guest_result_file, "w") as f:
+        f.write(o)
+    if s != 0:
+        test.fail("Test failed or timeout: %s" % o)
+    return [guest_result_file,
+            runner.result_file("host", "monitor"),
+            runner.result_file("guest", "monitor")]
 
 
 def run(test, params, env):
@@ -100,7 +66,6 @@ def run(test, params, env):
     monitor_cmd = params["monitor_cmd"]
     login_timeout = int(params.get("login_timeout", 360))
     test_cmd = params["test_cmd"]
-    guest_path = params.get("result_path", "/tmp/guest_result")
     test_src = params["test_src"]
     test_patch = params.get("test_patch")
 
@@ -117,8 +82,6 @@ def run(test, params, env):
         session.close()
         return
 
-    guest_launcher = os.path.join(test.virtdir, "scripts/cmd_runner.py")
-    vm.copy_files_to(guest_launcher, "/tmp")
     md5value = params.get("md5value")
 
     tar_name = os.path.basename(test_src)
@@ -155,23 +118,16 @@ def run(test, params, env):
         if s != 0:
             test.error("Fail to prepare test env in guest")
 
-    cmd = "cd /tmp/src && python /tmp/cmd_runner.py \"%s &> " % monitor_cmd
-    cmd += "/tmp/guest_result_monitor\"  \"/tmp/src/%s" % test_cmd
-    cmd += " &> %s \" \"/tmp/guest_result\""
-    cmd += " %s" % int(test_timeout)
-
-    test_cmd = cmd
+    test_cmd = "cd /tmp/src && /tmp/src/%s" % test_cmd
+    host_samplers = dict((name, params["host_sampler_cmd_%s" % name])
+                         for name in params.objects("host_samplers"))
     # Run guest test with monitor
-    tag = cmd_runner_monitor(test, vm, monitor_cmd, test_cmd,
-                             guest_path, timeout=test_timeout)
+    guest_results_dir = os.path.join(test.outputdir, "guest_results")
+    result_list = cmd_runner_monitor(test, vm, monitor_cmd, test_cmd,
+                                     guest_results_dir, timeout=test_timeout,
+                                     host_samplers=host_samplers)
 
     # Result collecting
-    result_list = ["/tmp/guest_result_%s" % tag,
-                   "/tmp/host_monitor_result_%s" % tag,
-                   "/tmp/guest_monitor_result_%s" % tag]
-    guest_results_dir = os.path.join(test.outputdir, "guest_results")
-    if not os.path.exists(guest_results_dir):
-        os.mkdir(guest_results_dir)
     ignore_pattern = params.get("ignore_pattern")
     head_pattern = params.get("head_pattern")
     row_pattern = params.get("row_pattern")
@@ -194,8 +150,6 @@ def run(test, params, env):
             for keys in sum_info:
                 fd.write("%s\n" % sum_info[keys])
             fd.close()
-            shutil.copy("%s.sum" % i, guest_results_dir)
-        shutil.copy(i, guest_results_dir)
 
     session.cmd("rm -rf /tmp/src")
     session.cmd("rm -rf guest_test*")
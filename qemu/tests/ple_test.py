@@ -6,6 +6,8 @@ from avocado.utils import process
 from virttest import env_process
 from virttest import error_context
 
+from provider.kvm_stats import KvmStats
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -31,12 +33,22 @@ def run(test, params, env):
         cmd = "modprobe %s %s=%s" % (module, mod_param, value)
         process.system(cmd)
 
-    def run_unixbench(cmd):
+    def run_unixbench(cmd, tag):
         """
         Run unixbench inside guest, return benchmark scores
         """
         error_context.context("Run unixbench inside guest", logging.info)
-        output = session.cmd_output_safe(cmd, timeout=4800)
+        kvm_stats = KvmStats(vm, float(params.get("kvm_stats_interval", 5)))
+        kvm_stats.start()
+        try:
+            output = session.cmd_output_safe(cmd, timeout=4800)
+        finally:
+            kvm_stats.stop()
+            kvm_stats.save(test.resultsdir, tag)
+        delta = kvm_stats.delta()
+        logging.info("KVM exits with %s: %s, directed yields %s/%s", tag,
+                     kvm_stats.exits(), delta.get("directed_yield_successful"),
+                     delta.get("directed_yield_attempted"))
         scores = re.findall(r"System Benchmarks Index Score\s+(\d+\.?\d+)",
                             output)
         return [float(i) for i in scores]
@@ -61,7 +73,7 @@ def run(test, params, env):
     session.cmd(params["get_unixbench"])
     try:
         cmd = params["run_unixbench"]
-        scores_on = run_unixbench(cmd)
+        scores_on = run_unixbench(cmd, "ple_on")
         logging.info("Unixbench scores are %s when ple is on", scores_on)
         vm.destroy()
 
@@ -69,7 +81,7 @@ def run(test, params, env):
         reload_module(0)
         vm.create(params=params)
         session = vm.wait_for_login()
-        scores_off = run_unixbench(cmd)
+        scores_off = run_unixbench(cmd, "ple_off")
         logging.info("Unixbench scores are %s when ple is off", scores_off)
         scores_off = [x*0.96 for x in scores_off]
         if scores_on[0] < scores_off[0] or scores_on[1] < scores_off[1]:
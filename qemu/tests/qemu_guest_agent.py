@@ -3,11 +3,13 @@ import time
 import os
 import re
 import base64
+import json
 import random
 import string
 
 import aexpect
 
+from avocado.utils import crypto
 from avocado.utils import genio
 from avocado.utils import path as avo_path
 from avocado.utils import process
@@ -27,6 +29,12 @@ from virttest import qemu_migration
 
 from avocado import TestCancel
 
+from provider.fsfreeze_profiler import FreezeProfiler
+from provider.guest_exec import GuestExecRunner
+from provider.latency_stats import summarize
+from provider.qga_pipeline import GuestFileTransfer
+from provider.qga_pipeline import pipeline
+
 
 class BaseVirtTest(object):
 
@@ -1148,6 +1156,148 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
                       "after run command is %skb" % (memory_usage_before,
                                                      memory_usage_after))
 
+    @error_context.context_aware
+    def gagent_check_benchmark(self, test, params, env):
+        """
+        Measure the latency and the guest cpu cost of guest agent commands.
+
+        Steps:
+        1) Run every command in 'gagent_bench_commands' 'repeats' times,
+           one at a time, taking the cpu time of qemu-ga before and after.
+        2) Run the commands in 'gagent_bench_concurrent' again with
+           'gagent_bench_depth' requests in flight.
+        3) Save the latency distributions, compare them with the results
+           of another qemu-guest-agent version if given.
+
+        guest-exec is timed up to the process exit seen by
+        guest-exec-status, guest-fsfreeze as a freeze and a thaw.
+
+        :param test: kvm test object
+        :param params: Dictionary with the test parameters
+        :param env: Dictionary with test environment.
+        """
+        def _cpu_ms():
+            if not params.get("gagent_cpu_time_cmd"):
+                return None
+            output = session.cmd_output(params["gagent_cpu_time_cmd"])
+            # utime and stime are the 12th and 13th fields after comm
+            fields = output.rsplit(")", 1)[-1].split()
+            return (int(fields[11]) + int(fields[12])) * 1000.0 / clk_tck
+
+        def _exec():
+            ret = self.gagent.guest_exec(path=exec_cmd[0], arg=exec_cmd[1:],
+                                         capture_output=True)
+            while not self.gagent.guest_exec_status(ret["pid"])["exited"]:
+                time.sleep(poll_interval)
+
+        def _steps(command):
+            if command == "guest-exec":
+                return [(command, _exec)]
+            if command == "guest-fsfreeze":
+                return [(name, lambda name=name: self.gagent.cmd(name))
+                        for name in ("guest-fsfreeze-freeze",
+                                     "guest-fsfreeze-thaw")]
+            return [(command, lambda: self.gagent.cmd(command))]
+
+        def _run_serial(command):
+            latencies = {}
+            cpu_before = _cpu_ms()
+            for _ in range(repeats):
+                for name, step in _steps(command):
+                    begin = time.time()
+                    step()
+                    latencies.setdefault(name, []).append(
+                        (time.time() - begin) * 1000)
+            cpu = None
+            if cpu_before is not None:
+                cpu = (_cpu_ms() - cpu_before) / repeats
+            return dict((name, dict(summarize(values), cpu_ms=cpu))
+                        for name, values in latencies.items())
+
+        def _run_concurrent(command):
+            latencies = []
+
+            def _requests():
+                for _ in range(repeats):
+                    yield command, None, {"sent": time.time()}
+
+            def _on_reply(context, result):
+                latencies.append((time.time() - context["sent"]) * 1000)
+
+            begin = time.time()
+            pipeline(self.gagent, _requests(), _on_reply, depth,
+                     params.get_numeric("gagent_bench_reply_timeout", 60))
+            seconds = time.time() - begin
+            return dict(summarize(latencies), depth=depth,
+                        throughput=repeats / seconds if seconds else None)
+
+        repeats = params.get_numeric("repeats", 100)
+        depth = params.get_numeric("gagent_bench_depth", 8)
+        poll_interval = params.get_numeric("gagent_bench_poll_interval",
+                                           0.05, float)
+        exec_cmd = params["gagent_bench_exec_cmd"].split()
+        session = self._get_session(params, self.vm)
+        self._open_session_list.append(session)
+        self._change_bl(session)
+        clk_tck = 100
+        if params.get("gagent_cpu_time_cmd"):
+            clk_tck = int(session.cmd_output("getconf CLK_TCK").strip())
+        version = self.gagent.guest_info()["version"]
+        report = {"version": version, "repeats": repeats, "serial": {},
+                  "concurrent": {}}
+
+        for command in params.objects("gagent_bench_commands"):
+            error_context.context("Run %s %d times" % (command, repeats),
+                                  logging.info)
+            report["serial"].update(_run_serial(command))
+            if command in params.objects("gagent_bench_concurrent"):
+                error_context.context("Run %s %d times, %d in flight"
+                                      % (command, repeats, depth),
+                                      logging.info)
+                report["concurrent"][command] = _run_concurrent(command)
+        self._change_bl_back(session)
+
+        with open(os.path.join(test.resultsdir, "qga_benchmark.json"),
+                  "w") as result_file:
+            json.dump(report, result_file, indent=2)
+        with open(os.path.join(test.resultsdir, "qga_benchmark.RHS"),
+                  "w") as result_file:
+            result_file.write("%-26s%-12s%-10s%-10s%-10s%-10s%-10s\n" %
+                              ("command", "mode", "p50_ms", "p90_ms",
+                               "p99_ms", "max_ms", "cpu_ms"))
+            for mode in ("serial", "concurrent"):
+                for command, result in sorted(report[mode].items()):
+                    cpu = result.get("cpu_ms")
+                    result_file.write(
+                        "%-26s%-12s%-10.3f%-10.3f%-10.3f%-10.3f%-10s\n" %
+                        (command, mode, result["p50"], result["p90"],
+                         result["p99"], result["max"],
+                         "-" if cpu is None else "%.3f" % cpu))
+
+        baseline = params.get("gagent_bench_baseline")
+        if not baseline or not os.path.isfile(baseline):
+            return
+        error_context.context("Compare with the results in %s" % baseline,
+                              logging.info)
+        with open(baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        ratio = params.get_numeric("gagent_bench_regression_ratio", 1.5,
+                                   float)
+        regressions = []
+        for mode in ("serial", "concurrent"):
+            for command, result in report[mode].items():
+                old = baseline.get(mode, {}).get(command) or {}
+                if old.get("p50") and result["p50"] > old["p50"] * ratio:
+                    regressions.append("%s %s p50 %.3fms (%.3fms in %s)"
+                                       % (command, mode, result["p50"],
+                                          old["p50"], baseline["version"]))
+        if regressions:
+            msg = "qemu-guest-agent %s regressed: %s" % (
+                version, "; ".join(regressions))
+            if params.get("gagent_bench_fail_on_regression") == "yes":
+                test.fail(msg)
+            logging.warning(msg)
+
     @error_context.context_aware
     def gagent_check_fstrim(self, test, params, env):
         """
@@ -1975,6 +2125,72 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
         session.cmd(cmd_del_file)
         self._change_bl_back(session)
 
+    @error_context.context_aware
+    def gagent_check_file_transfer(self, test, params, env):
+        """
+        Pipelined file transfer through guest-file-read/write.
+
+        Test steps:
+        1) create a big random file in guest.
+        2) copy it to host with pipelined guest-file-read and compare
+           the md5sum.
+        3) copy a big random host file to guest with pipelined
+           guest-file-write and compare the md5sum.
+        4) report the throughput of both directions.
+
+        :param test: kvm test object
+        :param params: Dictionary with the test parameters
+        :param env: Dictionary with test environment.
+        """
+        def _guest_md5(guest_file):
+            output = session.cmd_output(params["cmd_md5"] % guest_file,
+                                        timeout=timeout)
+            return re.findall(r"\b[0-9a-fA-F]{32}\b", output)[0].lower()
+
+        session, tmp_file = self._guest_file_prepare()
+        size = int(params.get("transfer_file_size", 256))
+        timeout = params.get_numeric("transfer_timeout", 600)
+        transfer = GuestFileTransfer(
+            self.gagent, int(utils_misc.normalize_data_size(
+                params.get("transfer_chunk_size", "16M"), "B")),
+            params.get_numeric("transfer_depth", 4),
+            params.get_numeric("transfer_reply_timeout", 60))
+        host_file = os.path.join(test.tmpdir, "qga_transfer")
+
+        error_context.context("Create a %dMB file in guest" % size,
+                              logging.info)
+        session.cmd(params["cmd_create_file"] % (tmp_file, size),
+                    timeout=timeout)
+        error_context.context("Copy the guest file to host via pipelined"
+                              " guest-file-read", logging.info)
+        transfer.download(tmp_file, host_file)
+        if crypto.hash_file(host_file, algorithm="md5") != _guest_md5(
+                tmp_file):
+            test.fail("The file copied from guest differs from the origin")
+
+        error_context.context("Copy a %dMB host file to guest via pipelined"
+                              " guest-file-write" % size, logging.info)
+        process.run("dd if=/dev/urandom of=%s bs=1M count=%d"
+                    % (host_file, size))
+        upload_file = tmp_file + "_upload"
+        transfer.upload(host_file, upload_file)
+        if crypto.hash_file(host_file, algorithm="md5") != _guest_md5(
+                upload_file):
+            test.fail("The file copied to guest differs from the origin")
+
+        with open(os.path.join(test.resultsdir, "qga_file_transfer.json"),
+                  "w") as result_file:
+            json.dump(transfer.records, result_file, indent=2)
+        min_mbps = params.get_numeric("transfer_min_mbps", 0, float)
+        for record in transfer.records:
+            if record["mbps"] < min_mbps:
+                test.fail("%s throughput %.1f MB/s is below %s MB/s"
+                          % (record["direction"], record["mbps"], min_mbps))
+
+        session.cmd("%s %s %s" % (params["cmd_del"], tmp_file, upload_file))
+        os.remove(host_file)
+        self._change_bl_back(session)
+
     @error_context.context_aware
     def gagent_check_with_fsfreeze(self, test, params, env):
         """
@@ -2267,6 +2483,50 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
             test.fail("The cmd should be failed with wrong args.")
         self._change_bl_back(session)
 
+    @error_context.context_aware
+    def gagent_check_guest_exec_concurrent(self, test, params, env):
+        """
+        Run many guest commands at once through guest-exec.
+
+        Steps:
+        1) Change guest-exec related cmd to white list, linux guest only.
+        2) Start 'guest_exec_count' commands with GuestExecRunner and check
+           the output of every command.
+        3) Check they ran concurrently, in less time than run one by one.
+
+        :param test: kvm test object
+        :param params: Dictionary with the test parameters
+        """
+        session = self._get_session(params, self.vm)
+        self._open_session_list.append(session)
+        error_context.context("Change guest-exec related cmd to white list.",
+                              logging.info)
+        self._change_bl(session)
+
+        count = params.get_numeric("guest_exec_count", 32)
+        duration = params.get_numeric("guest_exec_duration", 2, float)
+        runner = GuestExecRunner(
+            self.gagent, params["os_type"],
+            params.get_numeric("guest_exec_max_running", 16),
+            timeout=params.get_numeric("guest_cmd_timeout", 60))
+        cmds = [params["guest_exec_concurrent_cmd"] % (duration, i)
+                for i in range(count)]
+        error_context.context("Run %d guest commands concurrently" % count,
+                              logging.info)
+        begin = time.time()
+        results = runner.map(cmds)
+        elapsed = time.time() - begin
+        for i, result in enumerate(results):
+            if result["exitcode"] != 0 or result["out"].split()[-1:] != [
+                    str(i)]:
+                test.fail("Unexpected result of '%s': %s" % (cmds[i], result))
+        logging.info("%d commands of %ss ran in %.1fs", count, duration,
+                     elapsed)
+        if elapsed >= count * duration:
+            test.fail("Guest commands did not run concurrently: %d commands"
+                      " of %ss took %.1fs" % (count, duration, elapsed))
+        self._change_bl_back(session)
+
     @error_context.context_aware
     def _action_before_fsfreeze(self, *args):
         session = self._get_session(self.params, None)
@@ -2404,6 +2664,92 @@ class QemuGuestAgentBasicCheck(QemuGuestAgentTest):
         """
         self._fsfreeze()
 
+    def _fsfreeze_profile_action(self):
+        """
+        Action to time while the whole guest is frozen, e.g. a live
+        snapshot, nothing by default.
+
+        :return: callable or None
+        """
+        return None
+
+    @error_context.context_aware
+    def gagent_check_fsfreeze_profile(self, test, params, env):
+        """
+        Profile fsfreeze/thaw under a guest write workload.
+
+        Test steps:
+        1) Start a synchronous write loop on every profiled filesystem.
+        2) Freeze and thaw every filesystem alone 'repeats' times, timing
+           the freeze, the frozen window and the thaw.
+        3) Freeze the whole guest, run the action of the test (e.g. a
+           live snapshot) and thaw, timing the whole path.
+        4) Stop the workload and get the write stall of every freeze.
+
+        :param test: kvm test object
+        :param params: Dictionary with the test parameters
+        :param env: Dictionary with test environment.
+        """
+        session = self._get_session(params, self.vm)
+        self._open_session_list.append(session)
+        mountpoints = params.objects("fsfreeze_profile_mountpoints")
+        if not mountpoints:
+            mountpoints = sorted(set(
+                fs["mountpoint"] for fs in self.gagent.get_fsinfo()))
+        profiler = FreezeProfiler(
+            self.gagent, session, params.get("fsfreeze_profile_log_dir",
+                                             "/dev/shm"),
+            params.get("fsfreeze_profile_block_size", "4k"))
+        interval = params.get_numeric("fsfreeze_profile_interval", 1, float)
+
+        error_context.context("Start the write workload on %s"
+                              % " ".join(mountpoints), logging.info)
+        profiler.start_workload(mountpoints)
+        try:
+            for _ in range(params.get_numeric("repeats", 5)):
+                for mountpoint in mountpoints:
+                    time.sleep(interval)
+                    profiler.profile([mountpoint], name=mountpoint)
+            action = self._fsfreeze_profile_action()
+            error_context.context("Freeze the guest, %s and thaw" %
+                                  ("run the action" if action else
+                                   "do nothing"), logging.info)
+            time.sleep(interval)
+            profiler.profile(action=action, name="end_to_end")
+        finally:
+            profiler.stop_workload()
+
+        with open(os.path.join(test.resultsdir, "fsfreeze_profile.json"),
+                  "w") as result_file:
+            json.dump(profiler.records, result_file, indent=2)
+        with open(os.path.join(test.resultsdir, "fsfreeze_profile.RHS"),
+                  "w") as result_file:
+            result_file.write("%-24s%-8s%-12s%-12s%-12s%-12s%-12s\n" %
+                              ("name", "samples", "freeze_ms", "action_ms",
+                               "thaw_ms", "frozen_ms", "stall_ms"))
+            for name in mountpoints + ["end_to_end"]:
+                records = [r for r in profiler.records if r["name"] == name]
+                if not records:
+                    continue
+                stalls = [v for r in records
+                          for v in r.get("stall_ms", {}).values()
+                          if v is not None]
+                row = [summarize([r[key] for r in records])["p50"]
+                       for key in ("freeze_ms", "action_ms", "thaw_ms",
+                                   "frozen_ms")]
+                row.append(max(stalls) if stalls else 0)
+                result_file.write("%-24s%-8d%-12.2f%-12.2f%-12.2f%-12.2f"
+                                  "%-12.2f\n" % tuple([name, len(records)] +
+                                                      row))
+
+        max_frozen = params.get_numeric("fsfreeze_profile_max_frozen_ms", 0,
+                                        float)
+        slow = [r["name"] for r in profiler.records
+                if max_frozen and r["frozen_ms"] > max_frozen]
+        if slow:
+            test.fail("Filesystems frozen for more than %sms: %s"
+                      % (max_frozen, ", ".join(slow)))
+
     @error_context.context_aware
     def gagent_check_fsfreeze_list(self, test, params, env):
         """
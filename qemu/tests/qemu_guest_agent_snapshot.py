@@ -82,6 +82,12 @@ class QemuGuestAgentSnapshotTest(QemuGuestAgentBasicCheckWin):
                                   logging.info)
             self.check_snapshot()
 
+    def _fsfreeze_profile_action(self):
+        def _snapshot():
+            self.snapshot_create.prepare_snapshot_file()
+            self.snapshot_create.create_snapshot()
+        return _snapshot
+
     @error_context.context_aware
     def _action_before_fsthaw(self, *args):
         pass
@@ -5,6 +5,8 @@ from virttest import env_process
 from virttest import error_context
 from virttest.staging import utils_memory
 
+from provider.boot_profiler import BootProfiler
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -15,7 +17,8 @@ def run(test, params, env):
     3) Wait for the console
     4) Send a 'reboot' command to the guest
     5) Boot up the guest and measure the boot time
-    6) Restore guest run level
+    6) Break the reboot time down into phases from the serial console
+    7) Restore guest run level
 
     :param test: QEMU test object
     :param params: Dictionary with the test parameters
@@ -44,14 +47,18 @@ def run(test, params, env):
         error_context.context("Send a 'reboot' command to the guest",
                               logging.info)
         utils_memory.drop_caches()
+        profiler = BootProfiler(vm, params)
+        profiler.start_reboot(utils_misc.monotonic_time())
         session.cmd('reboot & exit', timeout=1, ignore_all_errors=True)
         before_reboot_stamp = utils_misc.monotonic_time()
 
         error_context.context("Boot up the guest and measure the boot time",
                               logging.info)
         session = vm.wait_for_serial_login(timeout=timeout)
-        reboot_time = utils_misc.monotonic_time() - before_reboot_stamp
+        login_time = utils_misc.monotonic_time()
+        reboot_time = login_time - before_reboot_stamp
         test.write_test_keyval({'result': "%ss" % reboot_time})
+        profiler.save(test, profiler.stop(login_time), "reboot")
         expect_time = int(params.get("expect_reboot_time", "30"))
         logging.info("Reboot time: %ss", reboot_time)
 
@@ -3,12 +3,13 @@ import time
 
 import aexpect
 
-from avocado.utils import process
 from avocado.utils import cpu
 
 from virttest import utils_test
 from virttest import utils_time
 
+from provider.thread_pinning import pin_process_tree, restore_affinity
+
 
 def run(test, params, env):
     """
@@ -29,42 +30,6 @@ def run(test, params, env):
     :param params: Dictionary with test parameters.
     :param env: Dictionary with the test environment.
     """
-    # Helper functions
-    def set_cpu_affinity(pid, mask):
-        """
-        Set the CPU affinity of all threads of the process with PID pid.
-        Do this recursively for all child processes as well.
-
-        :param pid: The process ID.
-        :param mask: The CPU affinity mask.
-        :return: A dict containing the previous mask for each thread.
-        """
-        tids = process.run("ps -L --pid=%s -o lwp=" % pid,
-                           verbose=False,
-                           ignore_status=True).stdout_text.split()
-        prev_masks = {}
-        for tid in tids:
-            prev_mask = process.run(
-                "taskset -p %s" % tid, verbose=False).stdout_text.split()[-1]
-            prev_masks[tid] = prev_mask
-            process.system("taskset -p %s %s" % (mask, tid), verbose=False)
-        children = process.run("ps --ppid=%s -o pid=" % pid,
-                               verbose=False,
-                               ignore_status=True).stdout_text.split()
-        for child in children:
-            prev_masks.update(set_cpu_affinity(child, mask))
-        return prev_masks
-
-    def restore_cpu_affinity(prev_masks):
-        """
-        Restore the CPU affinity of several threads.
-
-        :param prev_masks: A dict containing TIDs as keys and masks as values.
-        """
-        for tid, mask in prev_masks.items():
-            process.system("taskset -p %s %s" % (mask, tid), verbose=False,
-                           ignore_status=True)
-
     vm = env.get_vm(params["main_vm"])
     vm.verify_alive()
 
@@ -113,7 +78,7 @@ def run(test, params, env):
 
     try:
         # Set the VM's CPU affinity
-        prev_affinity = set_cpu_affinity(vm.get_shell_pid(), cpu_mask)
+        prev_affinity = pin_process_tree(vm.get_shell_pid(), cpu_mask)
 
         try:
             # Open shell sessions with the guest
@@ -154,7 +119,7 @@ def run(test, params, env):
                 host_load_sessions.append(load_cmd)
                 # Set the CPU affinity of the load process
                 pid = load_cmd.get_pid()
-                set_cpu_affinity(pid, cpu_mask << i)
+                pin_process_tree(pid, cpu_mask << i)
 
             # Sleep for a while (during load)
             logging.info("Sleeping for %s seconds...", load_duration)
@@ -180,7 +145,7 @@ def run(test, params, env):
         finally:
             logging.info("Cleaning up...")
             # Restore the VM's CPU affinity
-            restore_cpu_affinity(prev_affinity)
+            restore_affinity(prev_affinity)
             # Stop the guest load
             if guest_load_stop_command:
                 session.cmd_output(guest_load_stop_command)
@@ -7,9 +7,11 @@ from avocado.utils import service
 from avocado.utils import cpu
 
 from virttest import utils_time
-from virttest import env_process
 from virttest import error_context
 
+from provider.thread_pinning import pin_process_tree
+from provider.vm_launcher import VMLauncher
+
 
 @error_context.context_aware
 def run(test, params, env):
@@ -48,28 +50,24 @@ def run(test, params, env):
     process.system(ntp_cmd, shell=True)
 
     error_context.context("Boot four guests", logging.info)
-    params["start_vm"] = "yes"
     vms = params.get("vms").split()
-    vm_obj = []
-    sessions = []
     host_cpu_list = cpu.online_list()
     if same_cpu == "no":
         if len(host_cpu_list) < len(vms):
             test.cancel("There aren't enough physical cpus to pin all guests")
-    for vm_name in vms:
-        env_process.preprocess_vm(test, params, env, vm_name)
-        vm = env.get_vm(vm_name)
-        vm.verify_alive()
-        vm_obj.append(vm)
-        sessions.append(vm.wait_for_login())
+    launcher = VMLauncher(test, params, env)
+    vm_obj = launcher.define(vms)
+    launcher.launch(vm_obj)
+    launcher.save(test.resultsdir, "timedrift_with_multi_vms_boot")
+    if launcher.failed():
+        test.error("Failed to boot %s" % ", ".join(launcher.failed()))
+    sessions = [launcher.sessions[vm_name] for vm_name in vms]
 
     error_context.context("Pin guest to physical cpu", logging.info)
     for vmid, se in enumerate(sessions):
         # Get the respective vm object
         cpu_id = vmid if same_cpu == "no" else 0
-        process.system("taskset -cp %s %s" %
-                       (host_cpu_list[cpu_id], vm_obj[vmid].get_pid()),
-                       shell=True)
+        pin_process_tree(vm_obj[vmid].get_pid(), [host_cpu_list[cpu_id]])
         error_context.context("Check the current clocksource", logging.info)
         currentsource = se.cmd_output_safe(clocksource_cmd)
         if clocksource not in currentsource:
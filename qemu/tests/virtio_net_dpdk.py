@@ -11,7 +11,8 @@ from virttest import virt_vm
 from virttest import remote
 from virttest import data_dir
 from virttest import utils_misc
-from virttest import utils_test
+
+from provider.thread_pinning import ThreadPinner
 
 
 def format_result(result, base="12", fbase="2"):
@@ -54,9 +55,7 @@ def run(test, params, env):
         :param node: which numa node to pin
         """
         if node:
-            if not isinstance(node, utils_misc.NumaNode):
-                node = utils_misc.NumaNode(int(node))
-            utils_test.qemu.pin_vm_threads(vm, node)
+            ThreadPinner(vm).pin_to_node(node)
 
     def install_dpdk():
         """ Install dpdk realted packages"""
@@ -0,0 +1,150 @@
+import os
+import json
+import logging
+
+from avocado.utils import process
+
+from virttest import data_dir
+from virttest import error_context
+from virttest import utils_misc
+
+from qemu.tests.virtio_serial_file_transfer import get_virtio_port_property
+
+
+def parse_result(output):
+    """
+    Get the result dict reported by vserial_perf.py
+
+    :param output: output of the transfer script
+    :return: result dict, None if the script did not report one
+    """
+    for line in reversed(output.splitlines()):
+        if line.startswith("RESULT: "):
+            return json.loads(line[len("RESULT: "):])
+    return None
+
+
+@error_context.context_aware
+def run_transfer(test, params, vm, session, sender, host_script,
+                 guest_script):
+    """
+    Run one transfer between host and guest and return both ends' results
+
+    :param sender: 'host' or 'guest'
+    :return: tuple of (host result, guest result)
+    """
+    port_name = params["file_transfer_serial_port"]
+    port_type, port_path = get_virtio_port_property(vm, port_name)
+    timeout = int(params.get("transfer_timeout", 720))
+    receiver = "guest" if sender == "host" else "host"
+    common = ("-s %s -c %s -b %s --hash %s --stall-threshold %s" %
+              (params.get("transfer_size", "1G"),
+               params.get("chunk_size", "64K"),
+               params.get("buffer_size", "64K"),
+               params.get("transfer_hash", "sha256"),
+               params.get("stall_threshold", "0.1")))
+    python_bin = '`command -v python3 python | head -1`'
+    host_cmd = ("%s %s --side host -t %s -p %s -a %s %s" %
+                (python_bin, host_script, port_type, port_path,
+                 "send" if sender == "host" else "receive", common))
+    guest_cmd = ("%s %s --side guest -p %s -a %s %s" %
+                 (params.get("python_bin", python_bin), guest_script,
+                  port_name, "send" if sender == "guest" else "receive",
+                  common))
+
+    error_context.context("Transfer %s from %s to %s" %
+                          (params.get("transfer_size", "1G"), sender,
+                           receiver), logging.info)
+    # Both scripts wait for each other through the HELLO/READY handshake
+    # on the port, no need to give the host side a head start.
+    host_thread = utils_misc.InterruptedThread(
+        process.getoutput, kwargs={"cmd": host_cmd, "shell": True,
+                                   "timeout": timeout})
+    host_thread.start()
+    g_output = ""
+    try:
+        g_output = session.cmd_output(guest_cmd, timeout=timeout)
+    finally:
+        h_output = host_thread.join(timeout)
+
+    host_result = parse_result(h_output)
+    guest_result = parse_result(g_output)
+    for side, result, output in (("host", host_result, h_output),
+                                 ("guest", guest_result, g_output)):
+        if not result or "error" in result:
+            test.fail("Transfer script failed on %s:\n%s" % (side, output))
+    if host_result["digest"] != guest_result["digest"]:
+        test.fail("Data corrupted during transfer from %s, %s digest "
+                  "mismatch: host %s, guest %s" %
+                  (sender, params.get("transfer_hash", "sha256"),
+                   host_result["digest"], guest_result["digest"]))
+    return host_result, guest_result
+
+
+@error_context.context_aware
+def run(test, params, env):
+    """
+    Measure virtio serial throughput between host and guest.
+
+    Steps:
+    1) Boot up a VM with virtio serial device.
+    2) Start the transfer script on both host and guest, they synchronise
+       with a handshake on the port.
+    3) Stream incompressible data of 'transfer_size' in 'chunk_size'
+       writes, hashing on both ends while it flows.
+    4) Compare the digests and report MB/s, per-chunk latency and stalls.
+
+    :param test: QEMU test object.
+    :param params: Dictionary with the test parameters.
+    :param env: Dictionary with test environment.
+    """
+    vm = env.get_vm(params["main_vm"])
+    vm.verify_alive()
+    session = vm.wait_for_login()
+    script = params.get("perf_script", "vserial_perf.py")
+    host_script = os.path.join(data_dir.get_deps_dir("virtio_serial"),
+                               script)
+    guest_dir = params.get("guest_script_folder", "/var/tmp/")
+    guest_script = os.path.join(guest_dir, script)
+    vm.copy_files_to(host_script, guest_dir, timeout=60)
+
+    senders = params.get("file_sender", "both")
+    senders = ["host", "guest"] if senders == "both" else [senders]
+    repeat = int(params.get("transfer_repeat", 1))
+    results = []
+    try:
+        for sender in senders:
+            for i in range(repeat):
+                host_result, guest_result = run_transfer(
+                    test, params, vm, session, sender, host_script,
+                    guest_script)
+                recv_result = (guest_result if sender == "host"
+                               else host_result)
+                logging.info("Round %d from %s: %.2f MB/s, chunk latency "
+                             "p50 %.6fs p99 %.6fs max %.6fs, %d stalls",
+                             i + 1, sender, recv_result["mbps"],
+                             recv_result["latency"]["p50"],
+                             recv_result["latency"]["p99"],
+                             recv_result["latency"]["max"],
+                             recv_result["stalls"])
+                results.append({"sender": sender, "round": i + 1,
+                                "host": host_result, "guest": guest_result})
+    finally:
+        session.cmd("rm -f %s" % guest_script, ignore_all_errors=True)
+        session.close()
+
+    result_file = os.path.join(test.resultsdir, "virtio_serial_throughput.json")
+    with open(result_file, "w") as f:
+        json.dump({"chunk_size": params.get("chunk_size", "64K"),
+                   "buffer_size": params.get("buffer_size", "64K"),
+                   "transfer_size": params.get("transfer_size", "1G"),
+                   "results": results}, f, indent=2)
+    min_mbps = params.get("min_throughput")
+    if min_mbps:
+        for result in results:
+            mbps = result[("guest" if result["sender"] == "host"
+                           else "host")]["mbps"]
+            if mbps < float(min_mbps):
+                test.fail("Throughput from %s dropped to %.2f MB/s, "
+                          "lower than %s MB/s" % (result["sender"], mbps,
+                                                  min_mbps))
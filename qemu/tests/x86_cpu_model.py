@@ -1,12 +1,12 @@
 import logging
 import re
-import json
 
 from avocado.utils import cpu
 from avocado.utils import process
 
-from virttest import error_context, utils_misc, env_process
+from virttest import error_context, env_process
 from provider.cpu_utils import check_cpu_flags
+from provider.cpu_capabilities import get_capabilities
 
 
 @error_context.context_aware
@@ -24,18 +24,6 @@ def run(test, params, env):
     :param params: Dictionary with the test parameters
     :param env: Dictionary with test environment.
     """
-    qemu_binary = utils_misc.get_qemu_binary(params)
-    qmp_cmds = ['{"execute": "qmp_capabilities"}',
-                '{"execute": "query-cpu-definitions", "id": "RAND91"}',
-                '{"execute": "quit"}']
-    cmd = "echo -e '{0}' | {1} -qmp stdio -vnc none -M none | grep return |"\
-          "grep RAND91".format(r"\n".join(qmp_cmds), qemu_binary)
-    output = process.run(cmd, timeout=10,
-                         ignore_status=True,
-                         shell=True,
-                         verbose=False).stdout_text
-    out = json.loads(output)["return"]
-
     model = params["model"]
     model_pattern = params["model_pattern"]
     flags = params["flags"]
@@ -48,7 +36,7 @@ def run(test, params, env):
         flag_ib = " ibpb"
         name_ib = " \\(with IBPB\\)"
 
-    models = [x["name"] for x in out if not x["unavailable-features"]]
+    models = get_capabilities(params).runnable_models()
     if model_ib in models:
         cpu_model = model_ib
         guest_model = model_pattern % name_ib